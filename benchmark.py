@@ -0,0 +1,731 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark Script
+Measure extract_audio.py throughput and orchestration overhead on locally generated video files
+"""
+
+import os
+import re
+import subprocess
+import sys
+import json
+import shutil
+import signal
+import argparse
+import multiprocessing
+import tempfile
+import threading
+import time
+
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extract_audio.py')
+
+# Child processes that are not part of the Python orchestrator
+FFMPEG_PROCESS_NAMES = {'ffmpeg', 'ffprobe'}
+
+
+def generate_clip(output_file, duration=1.0, audio_codec='aac', bitrate='128k', sample_rate=44100, channel_layout='stereo', frequency=440, container='matroska',
+                  silence=0.0):
+    """Generate a small video file with a tone from ffmpeg lavfi sources
+    
+    silence mutes that many seconds at the start and at the end of the tone.
+    """
+    bitrate_args = ['-b:a', bitrate] if bitrate else []
+    audio_filter = f"aformat=channel_layouts={channel_layout}"
+    if silence > 0:
+        audio_filter += f",volume=0:enable='lt(t,{silence})+gte(t,{duration - silence})'"
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc=size=64x48:rate=5:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency={frequency}:sample_rate={sample_rate}:duration={duration}",
+        '-af', audio_filter,
+        '-c:v', 'mpeg4', '-c:a', audio_codec
+    ] + bitrate_args + ['-shortest', '-f', container, output_file]
+    subprocess.run(cmd, check=True)
+
+
+def build_small_file_corpus(directory, count, duration=1.0):
+    """Create a corpus of identical files, linked from one generated clip"""
+    os.makedirs(directory, exist_ok=True)
+    # Generated outside the video extensions so it is never picked up as input
+    template = os.path.join(directory, 'template.mkv.tmp')
+    generate_clip(template, duration=duration)
+    for i in range(count):
+        target = os.path.join(directory, f"clip_{i:06d}.mkv")
+        try:
+            os.link(template, target)
+        except OSError:
+            shutil.copyfile(template, target)
+    os.remove(template)
+
+
+# Source variants cycled through by the synthetic corpus:
+# (audio codec, bitrate, sample rate, channel layout, container, extension)
+CORPUS_AUDIO_VARIANTS = [
+    ('aac', '128k', 44100, 'stereo', 'mp4', '.mp4'),
+    ('libmp3lame', '96k', 44100, 'mono', 'matroska', '.mkv'),
+    ('aac', '256k', 48000, '5.1', 'mp4', '.mp4'),
+    ('flac', None, 48000, 'stereo', 'matroska', '.mkv'),
+    ('ac3', '192k', 48000, 'stereo', 'matroska', '.mkv'),
+    ('aac', '64k', 22050, 'mono', 'mov', '.mov'),
+]
+
+# Durations in seconds cycled through by the synthetic corpus, before scaling
+CORPUS_DURATIONS = [5, 30, 120, 15, 600, 60]
+
+
+def build_synthetic_corpus(directory, count, scale=1.0, silence=0.0):
+    """Generate a deterministic corpus mixing durations, codecs, bitrates and channel layouts
+    
+    silence is the fraction of each file muted at the start and, again, at
+    the end. The corpus is described by manifest.json and reused when the
+    manifest already matches the requested count, scale and silence.
+    """
+    manifest_file = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('count') == count and manifest.get('scale') == scale and manifest.get('silence', 0.0) == silence:
+            return manifest
+
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for i in range(count):
+        audio_codec, bitrate, sample_rate, channel_layout, container, extension = CORPUS_AUDIO_VARIANTS[i % len(CORPUS_AUDIO_VARIANTS)]
+        duration = CORPUS_DURATIONS[i % len(CORPUS_DURATIONS)] * scale
+        output_file = os.path.join(directory, f"synthetic_{i:04d}{extension}")
+        print(f"Generating {os.path.basename(output_file)} ({audio_codec}, {channel_layout}, {duration:.0f}s)...", file=sys.stderr)
+        generate_clip(output_file, duration, audio_codec, bitrate, sample_rate, channel_layout,
+                      frequency=220 + 40 * i, container=container, silence=duration * silence)
+        files.append({
+            'file': os.path.basename(output_file),
+            'audio_codec': audio_codec,
+            'bitrate': bitrate,
+            'sample_rate': sample_rate,
+            'channel_layout': channel_layout,
+            'duration': duration,
+            'size': os.path.getsize(output_file)
+        })
+
+    manifest = {
+        'count': count,
+        'scale': scale,
+        'silence': silence,
+        'audio_seconds': sum(entry['duration'] for entry in files),
+        'bytes': sum(entry['size'] for entry in files),
+        'files': files
+    }
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def get_version_info():
+    """Describe the code and tools being benchmarked"""
+    info = {'python': sys.version.split()[0], 'git_revision': None, 'ffmpeg': None}
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(SCRIPT_PATH))
+        if result.returncode == 0:
+            info['git_revision'] = result.stdout.strip()
+    except FileNotFoundError:
+        pass
+    result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.stdout:
+        info['ffmpeg'] = result.stdout.splitlines()[0].strip()
+    return info
+
+
+def get_process_tree(root_pid):
+    """Get {pid: name} for a process and all of its descendants (Linux /proc)"""
+    children = {}
+    names = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The process name is in parentheses and may contain spaces
+        name = stat[stat.index('(') + 1:stat.rindex(')')]
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        pid = int(entry)
+        names[pid] = name
+        children.setdefault(ppid, []).append(pid)
+
+    tree = {}
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        if pid in names:
+            tree[pid] = names[pid]
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def get_rss_bytes(pid):
+    """Get resident set size of a process in bytes (Linux /proc)"""
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def sample_orchestrator_rss(root_pid, stop_event, peak, interval=0.05):
+    """Track peak combined RSS of the Python processes and of the whole process tree"""
+    while not stop_event.is_set():
+        tree = get_process_tree(root_pid)
+        rss_by_pid = {pid: get_rss_bytes(pid) for pid in tree}
+        rss = sum(rss_by_pid[pid] for pid, name in tree.items() if name not in FFMPEG_PROCESS_NAMES)
+        python_processes = sum(1 for name in tree.values() if name not in FFMPEG_PROCESS_NAMES)
+        peak['rss_bytes'] = max(peak['rss_bytes'], rss)
+        peak['total_rss_bytes'] = max(peak['total_rss_bytes'], sum(rss_by_pid.values()))
+        peak['python_processes'] = max(peak['python_processes'], python_processes)
+        stop_event.wait(interval)
+
+
+def run_extractor(work_dir, extra_args):
+    """Run extract_audio.py once and measure wall time, CPU time and orchestrator RSS
+    
+    A run that exits with a non-zero status is marked invalid, since its
+    timings do not cover a full extraction.
+    """
+    cmd = [sys.executable, SCRIPT_PATH] + extra_args
+    peak = {'rss_bytes': 0, 'total_rss_bytes': 0, 'python_processes': 0}
+    stop_event = threading.Event()
+
+    start_time = time.perf_counter()
+    process = subprocess.Popen(cmd, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sampler = None
+    if os.path.isdir('/proc'):
+        sampler = threading.Thread(target=sample_orchestrator_rss, args=(process.pid, stop_event, peak), daemon=True)
+        sampler.start()
+
+    cpu_time = None
+    if hasattr(os, 'wait4'):
+        # wait4 reports CPU time of the extractor and every child it reaped
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        cpu_time = usage.ru_utime + usage.ru_stime
+    else:
+        process.wait()
+    wall_time = time.perf_counter() - start_time
+
+    stop_event.set()
+    if sampler:
+        sampler.join()
+    if process.returncode != 0:
+        print(f"extract_audio.py {' '.join(extra_args)} exited with status {process.returncode}, run marked invalid", file=sys.stderr)
+
+    return {
+        'returncode': process.returncode,
+        'valid': process.returncode == 0,
+        'wall_time': wall_time,
+        'cpu_time': cpu_time,
+        'peak_orchestrator_rss_bytes': peak['rss_bytes'] if sampler else None,
+        'peak_total_rss_bytes': peak['total_rss_bytes'] if sampler else None,
+        'peak_python_processes': peak['python_processes'] if sampler else None
+    }
+
+
+def benchmark_executors(args):
+    """Compare orchestration overhead of the thread and process executors"""
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        print(f"Generating {args.files} small files in {corpus_dir}...", file=sys.stderr)
+        build_small_file_corpus(corpus_dir, args.files)
+
+        results = []
+        for executor_mode in args.executors:
+            output_dir = os.path.join(work_dir, f"out_{executor_mode}")
+            print(f"Running {executor_mode} executor with {args.jobs} jobs...", file=sys.stderr)
+            run = run_extractor(work_dir, [
+                '-d', corpus_dir, '-o', output_dir, '-f', 'wav', '--no-resume',
+                '--executor', executor_mode, '-j', str(args.jobs)
+            ])
+            run['executor'] = executor_mode
+            run['files'] = args.files
+            run['files_per_second'] = args.files / run['wall_time']
+            run['per_file_ms'] = run['wall_time'] * 1000 / args.files
+            results.append(run)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        return {
+            'benchmark': 'executors',
+            'files': args.files,
+            'jobs': args.jobs,
+            'cpu_count': multiprocessing.cpu_count(),
+            'results': results
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_cpu_splits(cpu_budget):
+    """Get (jobs, threads) splits that use the whole budget, from all jobs to one job"""
+    splits = []
+    jobs = cpu_budget
+    while jobs >= 1:
+        splits.append((jobs, cpu_budget // jobs))
+        jobs //= 2
+    return splits
+
+
+def benchmark_cpu_split(args):
+    """Compare aggregate throughput of different jobs x ffmpeg threads splits"""
+    cpu_budget = args.cpu_budget or multiprocessing.cpu_count()
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        print(f"Generating {args.files} files of {args.duration:.0f}s in {corpus_dir}...", file=sys.stderr)
+        build_small_file_corpus(corpus_dir, args.files, args.duration)
+        audio_seconds = args.files * args.duration
+
+        results = []
+        for jobs, threads in get_cpu_splits(cpu_budget):
+            output_dir = os.path.join(work_dir, f"out_{jobs}x{threads}")
+            print(f"Running {jobs} jobs x {threads} threads...", file=sys.stderr)
+            run = run_extractor(work_dir, [
+                '-d', corpus_dir, '-o', output_dir, '-f', args.format, '--no-resume',
+                '-j', str(jobs), '--ffmpeg-threads', str(threads), '--cpu-budget', str(cpu_budget),
+                '--progress-interval', '0'
+            ])
+            run['jobs'] = jobs
+            run['threads'] = threads
+            run['files_per_second'] = args.files / run['wall_time']
+            run['audio_seconds_per_second'] = audio_seconds / run['wall_time']
+            results.append(run)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        return {
+            'benchmark': 'cpu-split',
+            'format': args.format,
+            'files': args.files,
+            'duration': args.duration,
+            'cpu_budget': cpu_budget,
+            'cpu_count': multiprocessing.cpu_count(),
+            'results': results
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Extractor arguments for each execution mode
+EXECUTION_MODES = {
+    'sequential': ['--sequential'],
+    'thread': ['--executor', 'thread'],
+    'process': ['--executor', 'process'],
+    'asyncio': ['--executor', 'asyncio'],
+}
+
+
+def benchmark_suite(args):
+    """Measure end-to-end throughput of every execution mode on the synthetic corpus"""
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = args.corpus or os.path.join(work_dir, 'corpus')
+        manifest = build_synthetic_corpus(corpus_dir, args.files, args.scale)
+        audio_hours = manifest['audio_seconds'] / 3600
+
+        results = []
+        for mode in args.modes:
+            output_dir = os.path.join(work_dir, f"out_{mode}")
+            print(f"Running {mode} mode...", file=sys.stderr)
+            extra_args = list(EXECUTION_MODES[mode])
+            if args.jobs and mode != 'sequential':
+                extra_args += ['-j', str(args.jobs)]
+            run = run_extractor(work_dir, [
+                '-d', corpus_dir, '-o', output_dir, '-f'] + args.format + [
+                '-q', args.quality, '--no-resume', '--no-probe-cache', '--progress-interval', '0'
+            ] + (['--adaptive'] if args.adaptive else []) + extra_args)
+            run['mode'] = mode
+            run['files_per_second'] = manifest['count'] / run['wall_time']
+            run['audio_hours_per_second'] = audio_hours / run['wall_time']
+            run['output_bytes'] = get_directory_size(output_dir)
+            results.append(run)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        return {
+            'benchmark': 'suite',
+            'version': get_version_info(),
+            'timestamp': time.time(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'format': args.format,
+            'quality': args.quality,
+            'adaptive': args.adaptive,
+            'corpus': {
+                'files': manifest['count'],
+                'scale': manifest['scale'],
+                'audio_hours': audio_hours,
+                'bytes': manifest['bytes']
+            },
+            'results': results
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_decoded_samples(audio_file):
+    """Get the number of samples an audio file decodes to"""
+    cmd = ['ffmpeg', '-v', 'error', '-i', audio_file, '-ac', '1', '-f', 's16le', '-']
+    result = subprocess.run(cmd, capture_output=True, check=True)
+    return len(result.stdout) // 2
+
+
+def compare_decoded_audio(reference_file, audio_file):
+    """Get RMS and peak level in dB of the difference between two decoded files"""
+    graph = ('[0:a]aformat=channel_layouts=mono[a];[1:a]aformat=channel_layouts=mono[b];'
+             '[a][b]amerge=inputs=2,pan=mono|c0=c0-c1,astats')
+    cmd = ['ffmpeg', '-hide_banner', '-i', reference_file, '-i', audio_file,
+           '-filter_complex', graph, '-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore', check=True)
+    levels = {}
+    for key, name in (('difference_rms_db', 'RMS level dB'), ('difference_peak_db', 'Peak level dB')):
+        match = re.search(rf"{name}: (\S+)", result.stderr)
+        levels[key] = float(match.group(1)) if match else None
+    return levels
+
+
+def benchmark_segments(args):
+    """Compare a segmented encode of one long input against a single-pass encode"""
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        os.makedirs(corpus_dir)
+        print(f"Generating a {args.duration:.0f}s file in {corpus_dir}...", file=sys.stderr)
+        generate_clip(os.path.join(corpus_dir, 'long.mkv'), args.duration, sample_rate=48000)
+
+        runs = {}
+        # Segments count against the CPU budget, so give the single task room for all of them
+        segmented_args = ['--segment-above', '1', '--segments', str(args.segments), '--cpu-budget', str(args.segments)]
+        for mode, extra_args in (('single', []), ('segmented', segmented_args)):
+            output_dir = os.path.join(work_dir, f"out_{mode}")
+            print(f"Running {mode} encode...", file=sys.stderr)
+            run = run_extractor(work_dir, [
+                '-d', corpus_dir, '-o', output_dir, '-f'] + args.format + [
+                '--no-resume', '--no-probe-cache', '--progress-interval', '0'
+            ] + extra_args)
+            run['mode'] = mode
+            run['output_dir'] = output_dir
+            runs[mode] = run
+
+        results = []
+        for audio_format in (args.format if all(run['valid'] for run in runs.values()) else []):
+            reference_file = os.path.join(runs['single']['output_dir'], f"long.{audio_format}")
+            audio_file = os.path.join(runs['segmented']['output_dir'], f"long.{audio_format}")
+            result = {
+                'format': audio_format,
+                'reference_samples': get_decoded_samples(reference_file),
+                'samples': get_decoded_samples(audio_file),
+                'reference_bytes': os.path.getsize(reference_file),
+                'bytes': os.path.getsize(audio_file)
+            }
+            result.update(compare_decoded_audio(reference_file, audio_file))
+            results.append(result)
+
+        for run in runs.values():
+            del run['output_dir']
+        return {
+            'benchmark': 'segments',
+            'format': args.format,
+            'duration': args.duration,
+            'segments': args.segments,
+            'cpu_count': multiprocessing.cpu_count(),
+            'runs': list(runs.values()),
+            'results': results
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_queue(args):
+    """Run several extractor nodes on one shared work queue and check for duplicated encodes"""
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = os.path.join(work_dir, 'corpus')
+        print(f"Generating {args.files} files of {args.duration:.0f}s in {corpus_dir}...", file=sys.stderr)
+        build_small_file_corpus(corpus_dir, args.files, args.duration)
+
+        results = []
+        for node_count in args.nodes:
+            run_dir = os.path.join(work_dir, f"nodes_{node_count}")
+            os.makedirs(run_dir)
+            print(f"Running {node_count} nodes...", file=sys.stderr)
+            start_time = time.perf_counter()
+            processes = []
+            for index in range(node_count):
+                cmd = [
+                    sys.executable, SCRIPT_PATH, '-d', corpus_dir, '-o', os.path.join(run_dir, 'out'), '-f', args.format,
+                    '--queue-dir', os.path.join(run_dir, 'queue'), '--node-id', f"node{index}",
+                    '--lease-ttl', str(args.lease_ttl), '-j', str(args.jobs), '--ffmpeg-threads', '1',
+                    '--metrics-file', os.path.join(run_dir, f"metrics_node{index}.jsonl"),
+                    '--no-probe-cache', '--progress-interval', '0'
+                ]
+                # Own session, so a killed node takes its ffmpeg processes with it like a crashed machine
+                processes.append(subprocess.Popen(cmd, cwd=run_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True))
+            killed = None
+            if args.kill_after is not None and node_count > 1:
+                time.sleep(args.kill_after)
+                killed = 'node0'
+                os.killpg(processes[0].pid, signal.SIGKILL)
+            returncodes = [process.wait() for process in processes]
+            wall_time = time.perf_counter() - start_time
+            # Every node but the one killed on purpose must finish cleanly
+            valid = all(returncode == 0 for index, returncode in enumerate(returncodes) if not (killed and index == 0))
+            if not valid:
+                print(f"{node_count} nodes: exit statuses {returncodes}, run marked invalid", file=sys.stderr)
+
+            encodes = {}
+            for index in range(node_count):
+                metrics_file = os.path.join(run_dir, f"metrics_node{index}.jsonl")
+                if not os.path.exists(metrics_file):
+                    continue
+                with open(metrics_file, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if entry['status'] == 'completed':
+                            encodes.setdefault(entry['file'], []).append(f"node{index}")
+            outputs = [name for name in os.listdir(os.path.join(run_dir, 'out')) if name.endswith(f".{args.format}")]
+            results.append({
+                'nodes': node_count,
+                'returncodes': returncodes,
+                'valid': valid,
+                'killed': killed,
+                'wall_time': wall_time,
+                'files_per_second': args.files / wall_time,
+                'outputs': len(outputs),
+                'encodes': sum(len(nodes) for nodes in encodes.values()),
+                'duplicated_encodes': sum(len(nodes) - 1 for nodes in encodes.values()),
+                'encodes_per_node': {f"node{index}": sum(nodes.count(f"node{index}") for nodes in encodes.values()) for index in range(node_count)}
+            })
+            if not args.keep:
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+        return {
+            'benchmark': 'queue',
+            'format': args.format,
+            'files': args.files,
+            'duration': args.duration,
+            'jobs': args.jobs,
+            'lease_ttl': args.lease_ttl,
+            'cpu_count': multiprocessing.cpu_count(),
+            'results': results
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def sum_metrics(metrics_file, keys):
+    """Sum per-file metrics of a --metrics-file over every completed file"""
+    totals = dict.fromkeys(keys, 0.0)
+    with open(metrics_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get('status') != 'completed':
+                continue
+            for key in keys:
+                totals[key] += entry.get(key) or 0.0
+    return totals
+
+
+def benchmark_silence(args):
+    """Measure output bytes and encode time saved by silence trimming on the synthetic corpus"""
+    work_dir = tempfile.mkdtemp(prefix='extract_audio_bench_')
+    try:
+        corpus_dir = args.corpus or os.path.join(work_dir, 'corpus')
+        manifest = build_synthetic_corpus(corpus_dir, args.files, args.scale, args.silence)
+        probe_cache = os.path.join(work_dir, 'probe_cache.json')
+        trim_args = ['--trim-silence', '--probe-cache', probe_cache]
+
+        # The second trimmed run reuses the silence detections of the first from the probe cache
+        runs = []
+        for mode, extra_args in (('full', ['--no-probe-cache']), ('trimmed', trim_args), ('trimmed-cached', trim_args)):
+            output_dir = os.path.join(work_dir, f"out_{mode}")
+            metrics_file = os.path.join(work_dir, f"metrics_{mode}.jsonl")
+            print(f"Running {mode} extraction...", file=sys.stderr)
+            run = run_extractor(work_dir, [
+                '-d', corpus_dir, '-o', output_dir, '-f'] + args.format + [
+                '-q', args.quality, '--no-resume', '--progress-interval', '0', '--metrics-file', metrics_file
+            ] + (['-j', str(args.jobs)] if args.jobs else []) + extra_args)
+            run['mode'] = mode
+            run['output_bytes'] = get_directory_size(output_dir)
+            if run['valid']:
+                run.update(sum_metrics(metrics_file, ['encode_wall_time', 'silence_time']))
+            runs.append(run)
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+        full = runs[0]
+        for run in (runs[1:] if full['valid'] else []):
+            if not run['valid']:
+                continue
+            run['bytes_saved_percent'] = 100 * (1 - run['output_bytes'] / full['output_bytes']) if full['output_bytes'] else None
+            run['encode_time_saved_percent'] = 100 * (1 - run['encode_wall_time'] / full['encode_wall_time']) if full['encode_wall_time'] else None
+            run['wall_time_saved_percent'] = 100 * (1 - run['wall_time'] / full['wall_time'])
+
+        return {
+            'benchmark': 'silence',
+            'version': get_version_info(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'format': args.format,
+            'quality': args.quality,
+            'corpus': {
+                'files': manifest['count'],
+                'scale': manifest['scale'],
+                'silence': manifest['silence'],
+                'audio_hours': manifest['audio_seconds'] / 3600,
+                'bytes': manifest['bytes']
+            },
+            'results': runs
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def get_directory_size(directory):
+    """Get total size in bytes of the files below a directory"""
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark extract_audio.py on locally generated video files')
+    parser.add_argument('--json', default=None,
+                       help='Write results to this JSON file (default: print to stdout)')
+    parser.add_argument('--keep', action='store_true',
+                       help='Keep the generated working directory')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    executors_parser = subparsers.add_parser('executors',
+                                             help='Compare orchestrator RSS and per-file overhead of the executors')
+    executors_parser.add_argument('-n', '--files', type=int, default=10000,
+                                  help='Number of small files to generate (default: 10000)')
+    executors_parser.add_argument('-j', '--jobs', type=int, default=max(2, multiprocessing.cpu_count()),
+                                  help='Parallel jobs passed to the extractor (default: CPU cores, at least 2)')
+    executors_parser.add_argument('--executors', nargs='+', default=['thread', 'process'],
+                                  choices=['thread', 'process', 'asyncio'],
+                                  help='Executors to compare (default: thread process)')
+    executors_parser.set_defaults(func=benchmark_executors)
+
+    split_parser = subparsers.add_parser('cpu-split',
+                                         help='Compare throughput of jobs x ffmpeg threads splits of the CPU budget')
+    split_parser.add_argument('-n', '--files', type=int, default=64,
+                              help='Number of files to generate (default: 64)')
+    split_parser.add_argument('--duration', type=float, default=60,
+                              help='Duration of each file in seconds (default: 60)')
+    split_parser.add_argument('-f', '--format', default='flac', choices=['mp3', 'aac', 'wav', 'flac'],
+                              help='Output format (default: flac)')
+    split_parser.add_argument('--cpu-budget', type=int, default=0,
+                              help='CPU cores to split, e.g. 32 (default: CPU cores of this machine)')
+    split_parser.set_defaults(func=benchmark_cpu_split)
+
+    suite_parser = subparsers.add_parser('suite',
+                                         help='End-to-end throughput of every execution mode on a synthetic corpus')
+    suite_parser.add_argument('-n', '--files', type=int, default=24,
+                              help='Number of files in the synthetic corpus (default: 24)')
+    suite_parser.add_argument('--scale', type=float, default=1.0,
+                              help='Multiply corpus durations (5s to 10min) by this factor (default: 1.0)')
+    suite_parser.add_argument('--corpus', default=None,
+                              help='Directory to generate the corpus in and reuse across runs (default: temporary)')
+    suite_parser.add_argument('--modes', nargs='+', default=list(EXECUTION_MODES),
+                              choices=list(EXECUTION_MODES),
+                              help='Execution modes to run (default: all)')
+    suite_parser.add_argument('-f', '--format', nargs='+', default=['mp3'], choices=['mp3', 'aac', 'wav', 'flac'],
+                              help='Output format(s) (default: mp3)')
+    suite_parser.add_argument('-q', '--quality', default='192k',
+                              help='Output quality (default: 192k)')
+    suite_parser.add_argument('--adaptive', action='store_true',
+                              help='Run the extractor with --adaptive')
+    suite_parser.add_argument('-j', '--jobs', type=int, default=0,
+                              help='Parallel jobs for the parallel modes (default: extractor default)')
+    suite_parser.set_defaults(func=benchmark_suite)
+
+    segments_parser = subparsers.add_parser('segments',
+                                            help='Compare a segmented encode of one long file against a single-pass encode')
+    segments_parser.add_argument('--duration', type=float, default=600,
+                                 help='Duration of the file in seconds (default: 600)')
+    segments_parser.add_argument('--segments', type=int, default=max(2, multiprocessing.cpu_count()),
+                                 help='Number of segments (default: CPU cores, at least 2)')
+    segments_parser.add_argument('-f', '--format', nargs='+', default=['mp3', 'aac'], choices=['mp3', 'aac'],
+                                 help='Output format(s) (default: mp3 aac)')
+    segments_parser.set_defaults(func=benchmark_segments)
+
+    queue_parser = subparsers.add_parser('queue',
+                                         help='Run several local nodes on one shared work queue and count duplicated encodes')
+    queue_parser.add_argument('-n', '--files', type=int, default=48,
+                              help='Number of files to generate (default: 48)')
+    queue_parser.add_argument('--duration', type=float, default=30,
+                              help='Duration of each file in seconds (default: 30)')
+    queue_parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4],
+                              help='Node counts to run, one local process per node (default: 1 2 4)')
+    queue_parser.add_argument('-j', '--jobs', type=int, default=1,
+                              help='Parallel jobs of each node (default: 1)')
+    queue_parser.add_argument('-f', '--format', default='mp3', choices=['mp3', 'aac', 'wav', 'flac'],
+                              help='Output format (default: mp3)')
+    queue_parser.add_argument('--lease-ttl', type=float, default=10,
+                              help='Lease TTL passed to the nodes (default: 10)')
+    queue_parser.add_argument('--kill-after', type=float, default=None,
+                              help='Kill the first node after this many seconds to test lease recovery')
+    queue_parser.set_defaults(func=benchmark_queue)
+
+    silence_parser = subparsers.add_parser('silence',
+                                           help='Output bytes and encode time saved by --trim-silence on a synthetic corpus with silent ends')
+    silence_parser.add_argument('-n', '--files', type=int, default=12,
+                                help='Number of files in the synthetic corpus (default: 12)')
+    silence_parser.add_argument('--scale', type=float, default=0.25,
+                                help='Multiply corpus durations (5s to 10min) by this factor (default: 0.25)')
+    silence_parser.add_argument('--silence', type=float, default=0.2,
+                                help='Fraction of each file that is silent at the start, and again at the end (default: 0.2)')
+    silence_parser.add_argument('--corpus', default=None,
+                                help='Directory to generate the corpus in and reuse across runs (default: temporary)')
+    silence_parser.add_argument('-f', '--format', nargs='+', default=['mp3'], choices=['mp3', 'aac', 'wav', 'flac'],
+                                help='Output format(s) (default: mp3)')
+    silence_parser.add_argument('-q', '--quality', default='192k',
+                                help='Output quality (default: 192k)')
+    silence_parser.add_argument('-j', '--jobs', type=int, default=0,
+                                help='Parallel jobs (default: extractor default)')
+    silence_parser.set_defaults(func=benchmark_silence)
+
+    args = parser.parse_args()
+
+    try:
+        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        print("Error: ffmpeg not found. Please ensure ffmpeg is installed and added to system PATH.", file=sys.stderr)
+        sys.exit(1)
+
+    report = args.func(args)
+
+    output = json.dumps(report, indent=2)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    # The report is still written, but runs of a failed extractor must not pass as results
+    invalid = [row for key in ('runs', 'results') for row in report.get(key, []) if row.get('valid') is False]
+    if invalid:
+        print(f"Error: {len(invalid)} run(s) failed and are marked invalid", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,129 +11,426 @@ import sys
 import json
 import shutil
 import re
+import math
+import glob
 from pathlib import Path
 import argparse
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import time
 import signal
 import atexit
 import logging
 import threading
+import hashlib
+import select
+import struct
+import ctypes
+import ctypes.util
+import mmap
+import asyncio
+import socket
+import sqlite3
+from collections import deque
+from collections.abc import MutableMapping
 
 
-# Thread-safe print lock
-print_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+# Status and progress lines of extraction workers, which carry their own
+# [Worker N] prefix
+worker_logger = logging.getLogger(f"{__name__}.worker")
 
-# Monkey patch print function for thread-safe output
-import builtins
-original_print = builtins.print
 
-def safe_print(*args, **kwargs):
-    """Thread-safe print function"""
-    with print_lock:
-        original_print(*args, **kwargs)
+def configure_console():
+    """Attach the logging handlers of command line runs
+    
+    Called from main() instead of at import time, so importing this module
+    leaves the logging configuration of the host program alone; library users
+    get the records of logger and worker_logger through their own handlers.
+    """
+    # Configure logging for clean, thread-safe output
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(threadName)s] %(message)s',
+        datefmt='%H:%M:%S'
+    )
+    # Worker lines go to stdout as they are
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    worker_logger.addHandler(handler)
+    worker_logger.propagate = False
+
+# Global variables for signal handling - record file -> record for each output format
+current_records = {}
+current_probe_cache_file = None
+current_probe_cache = None
+current_work_queue = None
+
+# Set by the first SIGINT/SIGTERM: no new tasks are started and running ffmpeg
+# processes are stopped, then the batch winds down and saves its records
+interrupt_event = threading.Event()
+
+# Running ffmpeg child processes and their command lines, stopped on
+# interrupt. Reentrant because the signal handler may run while the main
+# thread holds the lock.
+active_processes = {}
+active_processes_lock = threading.RLock()
 
-# Replace the built-in print with our safe version
-builtins.print = safe_print
+# Work queue leases of the tasks running in this process, video path ->
+# (lease file, token), and the videos whose lease another node took over.
+# Child processes reading an aborted video are stopped.
+task_leases = {}
+aborted_videos = set()
 
-# Configure logging for clean, thread-safe output
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(threadName)s] %(message)s',
-    datefmt='%H:%M:%S'
-)
+# Number of running child processes across this process and the workers of a
+# process executor, exported to Prometheus. Shared memory is created on first
+# use and handed to worker processes by the executor initializer.
+active_process_counter = None
 
-# Global variables for signal handling
-current_record_file = None
-current_record = {}
+# Number of journal events appended since the last snapshot, per record file
+journal_event_counts = {}
 
 
 def signal_handler(signum, frame):
-    """Signal handler to ensure records are saved"""
-    if current_record_file and current_record:
-        logging.info(f"\nSaving interrupt record to {current_record_file}...")
-        save_extraction_record(current_record_file, current_record)
-    sys.exit(0)
+    """Stop the batch on the first signal, exit right away on the second
+    
+    The first signal cancels queued tasks and terminates running ffmpeg
+    processes; the batch loop then handles the results still in flight and
+    saves the records before exiting. A second signal saves the records as
+    they are and exits immediately.
+    """
+    if not interrupt_event.is_set():
+        interrupt_event.set()
+        logger.info("\nInterrupted, stopping running encodes (interrupt again to exit immediately)...")
+        terminate_active_processes()
+        return
+    for record_file, record in current_records.items():
+        if record:
+            logger.info(f"\nSaving interrupt record to {record_file}...")
+            save_extraction_record(record_file, record)
+    if current_probe_cache_file and current_probe_cache:
+        save_probe_cache(current_probe_cache_file, current_probe_cache)
+    if current_work_queue:
+        release_all_leases(current_work_queue)
+    os._exit(130)
 
 
 def atexit_handler():
     """Handler function when program exits"""
-    if current_record_file and current_record:
-        save_extraction_record(current_record_file, current_record)
+    for record_file, record in current_records.items():
+        if record:
+            save_extraction_record(record_file, record)
+    if current_probe_cache_file and current_probe_cache:
+        save_probe_cache(current_probe_cache_file, current_probe_cache)
+    if current_work_queue:
+        release_all_leases(current_work_queue)
 
 
-def get_video_audio_bitrate(video_path):
-    """Get audio bitrate from video file"""
+def track_process(process, cmd=()):
+    """Register a running child process so an interrupt can stop it
+    
+    A process started after the interrupt, or for a video whose lease was
+    lost, is stopped right away.
+    """
+    counter = get_active_process_counter()
+    with active_processes_lock:
+        active_processes[process] = cmd
+        aborted = any(video_path in cmd for video_path in aborted_videos)
+    with counter.get_lock():
+        counter.value += 1
+    if interrupt_event.is_set() or aborted:
+        terminate_process(process)
+
+
+def untrack_process(process):
+    """Unregister a child process once it has been reaped"""
+    with active_processes_lock:
+        if process not in active_processes:
+            return
+        del active_processes[process]
+    counter = get_active_process_counter()
+    with counter.get_lock():
+        counter.value -= 1
+
+
+def get_active_process_counter():
+    """Return the shared counter of running child processes, creating it on first use"""
+    global active_process_counter
+    with active_processes_lock:
+        if active_process_counter is None:
+            active_process_counter = multiprocessing.Value('i', 0)
+        return active_process_counter
+
+
+def count_active_processes():
+    """Return the number of child processes currently running"""
+    return get_active_process_counter().value
+
+
+def terminate_process(process):
+    """Terminate a subprocess.Popen or asyncio subprocess that may already have exited"""
     try:
-        # Use ffprobe to get audio information
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_streams', '-select_streams', 'a:0', video_path
-        ]
+        process.terminate()
+    except (ProcessLookupError, OSError):
+        pass
+
+
+def terminate_active_processes():
+    """Terminate every registered child process"""
+    with active_processes_lock:
+        processes = list(active_processes)
+    for process in processes:
+        terminate_process(process)
+
+
+def register_task_lease(video_path, lease):
+    """Register the work queue lease a task in this process encodes under"""
+    with active_processes_lock:
+        task_leases[video_path] = lease
+
+
+def unregister_task_lease(video_path):
+    """Forget the lease of a finished task"""
+    with active_processes_lock:
+        task_leases.pop(video_path, None)
+        aborted_videos.discard(video_path)
+
+
+def abort_lost_lease_tasks():
+    """Stop the child processes of tasks whose lease was taken over by another node
+    
+    The task's later ffmpeg/ffprobe runs are stopped as they start, so the task
+    fails instead of writing the same outputs as the node now holding the lease.
+    """
+    with active_processes_lock:
+        leases = list(task_leases.items())
+    for video_path, (lease_file, token) in leases:
+        if read_lease_token(lease_file) == token:
+            continue
+        with active_processes_lock:
+            aborted_videos.add(video_path)
+            processes = [process for process, cmd in active_processes.items() if video_path in cmd]
+        for process in processes:
+            terminate_process(process)
+
+
+def run_tracked_process(cmd):
+    """Run a command to completion with its output captured, stopped on interrupt
+    
+    Returns (returncode, stdout, stderr) as text.
+    """
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='ignore')
+    track_process(process, cmd)
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        untrack_process(process)
+    return process.returncode, stdout, stderr
+
+
+def parse_audio_stream(stream, track_index, container_duration=None):
+    """Get basic properties of one ffprobe audio stream entry"""
+    tags = stream.get('tags', {})
+    
+    # Try to get bitrate information
+    bit_rate = None
+    if 'bit_rate' in stream:
+        # Direct bitrate
+        bit_rate = int(stream['bit_rate'])
+    elif 'BPS' in tags:
+        # Get bitrate from tags
+        bit_rate = int(tags['BPS'])
+    elif 'bit_rate' in tags:
+        # Get bitrate from tags
+        bit_rate = int(tags['bit_rate'])
+    
+    # Prefer the stream duration, fall back to the container duration
+    duration = None
+    if 'duration' in stream:
+        duration = float(stream['duration'])
+    elif container_duration is not None:
+        duration = container_duration
+    
+    return {
+        'track': track_index,
+        'codec': stream.get('codec_name'),
+        'bit_rate': bit_rate,
+        'sample_rate': int(stream['sample_rate']) if 'sample_rate' in stream else None,
+        'channels': int(stream['channels']) if 'channels' in stream else None,
+        'duration': duration,
+        'language': tags.get('language')
+    }
+
+
+def build_probe_command(video_path):
+    """Build the ffprobe command listing the audio streams of a video file"""
+    return [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_streams', '-show_format', '-select_streams', 'a', video_path
+    ]
+
+
+def parse_probe_output(output):
+    """Parse ffprobe JSON output into audio information, or None without audio streams"""
+    data = json.loads(output)
+    if 'streams' in data and len(data['streams']) > 0:
+        container_duration = None
+        if 'duration' in data.get('format', {}):
+            container_duration = float(data['format']['duration'])
         
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        tracks = [
+            parse_audio_stream(stream, track_index, container_duration)
+            for track_index, stream in enumerate(data['streams'])
+        ]
+        info = dict(tracks[0])
+        del info['track']
+        info['stream_count'] = len(tracks)
+        info['tracks'] = tracks
+        return info
+    return None
+
+
+def probe_audio_stream(video_path):
+    """Probe the audio streams of a video file
+    
+    Returns the properties of the first audio stream, plus the number of audio
+    streams and a 'tracks' list with the properties of every audio stream.
+    """
+    try:
+        # Use ffprobe to get audio information
+        result = subprocess.run(build_probe_command(video_path), capture_output=True, text=True, encoding='utf-8', errors='ignore')
         
         if result.returncode == 0:
-            data = json.loads(result.stdout)
-            if 'streams' in data and len(data['streams']) > 0:
-                stream = data['streams'][0]
-                
-                # Try to get bitrate information
-                if 'bit_rate' in stream:
-                    # Direct bitrate
-                    bitrate = int(stream['bit_rate'])
-                    return bitrate
-                elif 'tags' in stream and 'BPS' in stream['tags']:
-                    # Get bitrate from tags
-                    bitrate = int(stream['tags']['BPS'])
-                    return bitrate
-                elif 'tags' in stream and 'bit_rate' in stream['tags']:
-                    # Get bitrate from tags
-                    bitrate = int(stream['tags']['bit_rate'])
-                    return bitrate
-                
-                # If no bitrate info, try to estimate from sample rate and channels
-                if 'sample_rate' in stream and 'channels' in stream:
-                    sample_rate = int(stream['sample_rate'])
-                    channels = int(stream['channels'])
-                    # Estimate bitrate (assuming 16-bit sampling)
-                    estimated_bitrate = sample_rate * channels * 16
-                    return estimated_bitrate
+            return parse_probe_output(result.stdout)
         
         # If unable to get, return None
         return None
         
     except Exception as e:
-        logging.info(f"Failed to get audio bitrate for {os.path.basename(video_path)}: {e}")
+        logger.info(f"Failed to probe audio stream for {os.path.basename(video_path)}: {e}")
+        return None
+
+
+# Bump when the layout of cached probe information changes
+PROBE_CACHE_SCHEMA = 2
+
+
+def load_probe_cache(cache_file, ffprobe_version):
+    """Load probe cache, discarding it if it was built by another ffprobe version"""
+    cache = {
+        'schema': PROBE_CACHE_SCHEMA,
+        'ffprobe_version': ffprobe_version,
+        'entries': {}
+    }
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('schema') == PROBE_CACHE_SCHEMA and data.get('ffprobe_version') == ffprobe_version:
+                cache['entries'] = data.get('entries', {})
+            else:
+                logger.info(f"Probe cache {cache_file} was built by another ffprobe version, rebuilding")
+        except Exception:
+            pass
+    return cache
+
+
+def save_probe_cache(cache_file, cache):
+    """Save probe cache"""
+    try:
+        # Per-process temporary name, nodes of a shared work queue may save at the same time
+        temp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(temp_file, cache_file)
+    except Exception as e:
+        logger.error(f"Failed to save probe cache: {e}")
+
+
+def lookup_probe_cache(cache, video_path):
+    """Get cached audio information if the file has not changed since it was probed"""
+    if not cache:
+        return None
+    try:
+        path = os.path.abspath(video_path)
+        entry = cache['entries'].get(path)
+        if entry is None:
+            return None
+        stat = os.stat(path)
+        if entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+            return entry.get('info')
+    except OSError:
+        pass
+    return None
+
+
+def store_probe_cache(cache, video_path, audio_info):
+    """Store probed audio information keyed by absolute path, size and mtime"""
+    if cache is None or not audio_info:
+        return
+    try:
+        path = os.path.abspath(video_path)
+        stat = os.stat(path)
+        cache['entries'][path] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'info': audio_info
+        }
+    except OSError:
+        pass
+
+
+def get_audio_info_bitrate(audio_info):
+    """Get audio bitrate from probed audio stream information"""
+    if not audio_info:
         return None
+    
+    if audio_info.get('bit_rate'):
+        return audio_info['bit_rate']
+    
+    # If no bitrate info, try to estimate from sample rate and channels
+    if audio_info.get('sample_rate') and audio_info.get('channels'):
+        # Estimate bitrate (assuming 16-bit sampling)
+        estimated_bitrate = audio_info['sample_rate'] * audio_info['channels'] * 16
+        return estimated_bitrate
+    
+    return None
+
+
+def get_video_audio_bitrate(video_path):
+    """Get audio bitrate from video file"""
+    return get_audio_info_bitrate(probe_audio_stream(video_path))
 
 
-def get_adaptive_quality(video_path, target_quality, audio_format, worker_id=None, log_message=None):
+def get_adaptive_quality(video_path, target_quality, audio_format, worker_id=None, log_message=None, audio_info=None):
     """Adaptively set extraction quality based on video audio bitrate"""
-    print(f"[Worker {worker_id}] Analyzing video: {os.path.basename(video_path)}")
-    print(f"[Worker {worker_id}] Target quality: {target_quality}, Audio format: {audio_format}")
+    worker_logger.info(f"[Worker {worker_id}] Analyzing video: {os.path.basename(video_path)}")
+    worker_logger.info(f"[Worker {worker_id}] Target quality: {target_quality}, Audio format: {audio_format}")
     
-    original_bitrate = get_video_audio_bitrate(video_path)
+    if audio_info is not None:
+        original_bitrate = get_audio_info_bitrate(audio_info)
+    else:
+        original_bitrate = get_video_audio_bitrate(video_path)
     
     if original_bitrate is None:
-        print(f"[Worker {worker_id}] Cannot detect audio bitrate, using target quality: {target_quality}")
+        worker_logger.info(f"[Worker {worker_id}] Cannot detect audio bitrate, using target quality: {target_quality}")
         return target_quality
     
-    print(f"[Worker {worker_id}] Detected original audio bitrate: {original_bitrate} bps ({original_bitrate//1000}k)")
+    worker_logger.info(f"[Worker {worker_id}] Detected original audio bitrate: {original_bitrate} bps ({original_bitrate//1000}k)")
     
     # Convert target quality to bps
     target_bps = parse_quality_to_bps(target_quality)
     
     if target_bps is None:
-        print(f"[Worker {worker_id}] Cannot parse target quality '{target_quality}', using target quality")
+        worker_logger.info(f"[Worker {worker_id}] Cannot parse target quality '{target_quality}', using target quality")
         return target_quality
     
-    print(f"[Worker {worker_id}] Target quality converted to: {target_bps} bps")
+    worker_logger.info(f"[Worker {worker_id}] Target quality converted to: {target_bps} bps")
     
     # If target bitrate is higher than original audio bitrate, use original audio bitrate
     if target_bps > original_bitrate:
-        print(f"[Worker {worker_id}] Target bitrate {target_bps} bps is higher than original audio bitrate {original_bitrate} bps, will adjust")
+        worker_logger.info(f"[Worker {worker_id}] Target bitrate {target_bps} bps is higher than original audio bitrate {original_bitrate} bps, will adjust")
         
         # Choose appropriate bitrate based on audio format
         if audio_format == 'mp3':
@@ -164,10 +461,10 @@ def get_adaptive_quality(video_path, target_quality, audio_format, worker_id=Non
             # Keep original bitrate for other formats
             adaptive_quality = f"{original_bitrate // 1000}k"
         
-        print(f"[Worker {worker_id}] Adaptive quality adjusted to: {adaptive_quality}")
+        worker_logger.info(f"[Worker {worker_id}] Adaptive quality adjusted to: {adaptive_quality}")
         return adaptive_quality
     else:
-        print(f"[Worker {worker_id}] Target bitrate {target_bps} bps is appropriate, keeping target quality: {target_quality}")
+        worker_logger.info(f"[Worker {worker_id}] Target bitrate {target_bps} bps is appropriate, keeping target quality: {target_quality}")
         return target_quality
 
 
@@ -187,25 +484,452 @@ def parse_quality_to_bps(quality_str):
         return None
 
 
+# Source codecs that can be stream-copied into each output format without re-encoding
+PASSTHROUGH_CODECS = {
+    'mp3': 'mp3',
+    'aac': 'aac',
+    'flac': 'flac',
+    'wav': 'pcm_s16le'
+}
+
+
+def get_passthrough_decision(audio_info, audio_format, quality):
+    """Decide whether the source audio can be stream-copied into the output format
+    
+    Returns a (passthrough, reason) tuple. Lossy sources are only copied when their
+    bitrate is known and at or below the requested quality, so passthrough never
+    produces a larger file than re-encoding would.
+    """
+    if not audio_info or not audio_info.get('codec'):
+        return False, "source audio could not be probed"
+    
+    source_codec = audio_info['codec']
+    if PASSTHROUGH_CODECS.get(audio_format) != source_codec:
+        return False, f"source codec {source_codec} does not match {audio_format} output"
+    
+    if audio_format == 'wav':
+        # WAV output is always resampled to 44100 Hz
+        if audio_info.get('sample_rate') != 44100:
+            return False, f"source sample rate {audio_info.get('sample_rate')} Hz is not 44100 Hz"
+        return True, "source is already 16-bit PCM at 44100 Hz"
+    
+    if audio_format == 'flac':
+        return True, "source is already FLAC"
+    
+    source_bitrate = audio_info.get('bit_rate')
+    if not source_bitrate:
+        return False, "source bitrate is unknown"
+    
+    target_bps = parse_quality_to_bps(quality)
+    if target_bps is None or source_bitrate > target_bps:
+        return False, f"source bitrate {source_bitrate} bps is above target quality {quality}"
+    
+    return True, f"source {source_codec} at {source_bitrate} bps is within target quality {quality}"
+
+
+def get_audio_output_path(output_dir, video_name, audio_format, track=None):
+    """Get output audio file path for a video
+    
+    With a track, the file is named <video>.track<N>[-<language>].<format>,
+    where N counts audio streams from 1.
+    """
+    if track is None:
+        return os.path.join(output_dir, f"{video_name}.{audio_format}")
+    suffix = f"track{track['track'] + 1}"
+    language = track.get('language')
+    if language and language != 'und':
+        suffix += f"-{re.sub(r'[^A-Za-z0-9]', '', language)}"
+    return os.path.join(output_dir, f"{video_name}.{suffix}.{audio_format}")
+
+
+# Encoders that can write each output format, preferred (fastest) first. The
+# first one is used when the capabilities of the local ffmpeg are unknown.
+ENCODER_PREFERENCES = {
+    'mp3': ['libmp3lame', 'mp3_mf'],
+    'aac': ['libfdk_aac', 'aac_at', 'aac'],
+    'wav': ['pcm_s16le'],
+    'flac': ['flac']
+}
+
+DEFAULT_ENCODERS = {
+    'mp3': 'libmp3lame',
+    'aac': 'aac',
+    'wav': 'pcm_s16le',
+    'flac': 'flac'
+}
+
+
+def build_audio_codec_args(audio_format, quality, passthrough=False, encoder=None):
+    """Build ffmpeg audio codec arguments for the output format
+    
+    encoder picks one of the ENCODER_PREFERENCES of a lossy format instead of
+    the default one.
+    """
+    if passthrough:
+        return ['-acodec', 'copy']
+    if audio_format == 'mp3':
+        return ['-acodec', encoder or DEFAULT_ENCODERS['mp3'], '-ab', quality]
+    elif audio_format == 'aac':
+        return ['-acodec', encoder or DEFAULT_ENCODERS['aac'], '-b:a', quality]
+    elif audio_format == 'wav':
+        return ['-acodec', 'pcm_s16le', '-ar', '44100']
+    elif audio_format == 'flac':
+        return ['-acodec', 'flac']
+    return None
+
+
+def get_record_journal_file(record_file):
+    """Get journal file path for an extraction record"""
+    return f"{os.path.splitext(record_file)[0]}.journal"
+
+
 def load_extraction_record(record_file):
-    """Load extraction record"""
+    """Load extraction record
+    
+    The JSON snapshot is loaded first, then the events appended to the journal
+    since the last compaction are replayed on top of it.
+    """
+    record = {}
     if os.path.exists(record_file):
         try:
             with open(record_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                record = json.load(f)
         except:
-            return {}
-    return {}
+            record = {}
+    
+    journal_file = get_record_journal_file(record_file)
+    if os.path.exists(journal_file):
+        try:
+            line = '\n'
+            with open(journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # Skip a line torn by an interrupted write
+                        continue
+                    if event.get('value') is None:
+                        record.pop(event.get('key'), None)
+                    else:
+                        record[event['key']] = event['value']
+            if not line.endswith('\n'):
+                # Terminate a torn last line so the next event starts on its own line
+                with open(journal_file, 'a', encoding='utf-8') as f:
+                    f.write('\n')
+        except Exception as e:
+            logger.error(f"Failed to replay record journal {journal_file}: {e}")
+    
+    return record
 
 
 def save_extraction_record(record_file, record):
-    """Save extraction record"""
+    """Save extraction record
+    
+    Writes a full snapshot and then clears the journal, compacting all events
+    appended so far into the snapshot. SQLite records are committed instead.
+    """
+    if isinstance(record, SqliteRecord):
+        commit_record_db(record.db)
+        return
     try:
-        with open(record_file, 'w', encoding='utf-8') as f:
+        temp_file = f"{record_file}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
             json.dump(record, f, ensure_ascii=False, indent=2)
-            # pass
+        os.replace(temp_file, record_file)
+        
+        journal_file = get_record_journal_file(record_file)
+        if os.path.exists(journal_file):
+            os.remove(journal_file)
+        journal_event_counts[record_file] = 0
+    except Exception as e:
+        logger.error(f"Failed to save record: {e}")
+
+
+def append_extraction_record(record_file, key, entry):
+    """Append a record change to the journal without rewriting the snapshot"""
+    try:
+        event = {'key': key, 'value': entry}
+        with open(get_record_journal_file(record_file), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        journal_event_counts[record_file] = journal_event_counts.get(record_file, 0) + 1
     except Exception as e:
-        logging.error(f"Failed to save record: {e}")
+        logger.error(f"Failed to append record journal: {e}")
+
+
+def update_extraction_record(record_file, record, key, entry, compact_every=1000):
+    """Update a record entry, journaling it and compacting periodically"""
+    record[key] = entry
+    if isinstance(record, SqliteRecord):
+        # The database batches its own commits
+        return
+    append_extraction_record(record_file, key, entry)
+    if compact_every and journal_event_counts.get(record_file, 0) >= compact_every:
+        save_extraction_record(record_file, record)
+
+
+RECORD_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    format TEXT NOT NULL,
+    key TEXT NOT NULL,
+    status TEXT,
+    fingerprint TEXT,
+    timestamp REAL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (format, key)
+);
+CREATE INDEX IF NOT EXISTS records_status ON records (status, timestamp);
+CREATE INDEX IF NOT EXISTS records_format ON records (format, status);
+CREATE INDEX IF NOT EXISTS records_fingerprint ON records (fingerprint);
+CREATE INDEX IF NOT EXISTS records_timestamp ON records (timestamp);
+CREATE TABLE IF NOT EXISTS migrations (
+    record_file TEXT PRIMARY KEY,
+    entries INTEGER,
+    migrated REAL
+);
+"""
+
+
+def open_record_db(db_file, commit_every=1000, commit_interval=1.0, read_only=False):
+    """Open the SQLite record database in WAL mode
+    
+    Writes are committed in batches, after commit_every changes or once
+    commit_interval seconds have passed since the last commit. A read-only
+    database is opened as it is, without creating the schema.
+    """
+    if read_only:
+        conn = sqlite3.connect(f"{Path(db_file).resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(RECORD_DB_SCHEMA)
+    return {
+        'file': db_file,
+        'conn': conn,
+        'lock': threading.RLock(),
+        'pending': 0,
+        'commit_every': commit_every,
+        'commit_interval': commit_interval,
+        'last_commit': time.monotonic()
+    }
+
+
+def commit_record_db(db):
+    """Commit pending record changes"""
+    with db['lock']:
+        try:
+            db['conn'].commit()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to commit records to {db['file']}: {e}")
+        db['pending'] = 0
+        db['last_commit'] = time.monotonic()
+
+
+def get_entry_timestamp(entry):
+    """Get the timestamp of a record entry as seconds since the epoch"""
+    try:
+        return float(entry.get('timestamp'))
+    except (TypeError, ValueError):
+        return None
+
+
+class SqliteRecord(MutableMapping):
+    """Extraction record of one format backed by the SQLite record database
+    
+    Behaves like the dict loaded from a JSON record, but looks entries up by
+    key instead of loading them all at startup.
+    """
+    
+    def __init__(self, db, audio_format):
+        self.db = db
+        self.audio_format = audio_format
+    
+    def _execute(self, sql, params=()):
+        with self.db['lock']:
+            return self.db['conn'].execute(sql, params).fetchall()
+    
+    def _written(self):
+        db = self.db
+        db['pending'] += 1
+        if db['pending'] >= db['commit_every'] or time.monotonic() - db['last_commit'] >= db['commit_interval']:
+            commit_record_db(db)
+    
+    def __getitem__(self, key):
+        rows = self._execute('SELECT entry FROM records WHERE format = ? AND key = ?', (self.audio_format, key))
+        if not rows:
+            raise KeyError(key)
+        return json.loads(rows[0][0])
+    
+    def __contains__(self, key):
+        return bool(self._execute('SELECT 1 FROM records WHERE format = ? AND key = ?', (self.audio_format, key)))
+    
+    def __setitem__(self, key, entry):
+        with self.db['lock']:
+            self.db['conn'].execute(
+                'INSERT OR REPLACE INTO records (format, key, status, fingerprint, timestamp, entry) VALUES (?, ?, ?, ?, ?, ?)',
+                (self.audio_format, key, entry.get('status'), entry.get('fingerprint'), get_entry_timestamp(entry),
+                 json.dumps(entry, ensure_ascii=False))
+            )
+            self._written()
+    
+    def __delitem__(self, key):
+        with self.db['lock']:
+            cursor = self.db['conn'].execute('DELETE FROM records WHERE format = ? AND key = ?', (self.audio_format, key))
+            if cursor.rowcount == 0:
+                raise KeyError(key)
+            self._written()
+    
+    def __iter__(self):
+        return iter([row[0] for row in self._execute('SELECT key FROM records WHERE format = ?', (self.audio_format,))])
+    
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM records WHERE format = ?', (self.audio_format,))[0][0]
+    
+    def __bool__(self):
+        return bool(self._execute('SELECT 1 FROM records WHERE format = ? LIMIT 1', (self.audio_format,)))
+    
+    def find_fingerprint(self, fingerprint):
+        """Get (key, entry) of a completed entry with this fingerprint, or None"""
+        rows = self._execute(
+            "SELECT key, entry FROM records WHERE fingerprint = ? AND format = ? AND status = 'completed' LIMIT 1",
+            (fingerprint, self.audio_format)
+        )
+        return (rows[0][0], json.loads(rows[0][1])) if rows else None
+    
+    def query(self, status=None, since=None):
+        """Yield (key, entry) pairs by status and minimum timestamp, newest first"""
+        sql = 'SELECT key, entry FROM records WHERE format = ?'
+        params = [self.audio_format]
+        if status is not None:
+            sql += ' AND status = ?'
+            params.append(status)
+        if since is not None:
+            sql += ' AND timestamp >= ?'
+            params.append(since)
+        for key, entry in self._execute(sql + ' ORDER BY timestamp DESC', params):
+            yield key, json.loads(entry)
+
+
+class SqliteFingerprintIndex:
+    """Fingerprint index of one format answered by the record database
+    
+    Takes the place of the dict built by build_fingerprint_index. Entries
+    added during the run are already in the database, so setting is a no-op.
+    """
+    
+    def __init__(self, record):
+        self.record = record
+    
+    def get(self, fingerprint, default=None):
+        found = self.record.find_fingerprint(fingerprint)
+        return found if found is not None else default
+    
+    def __setitem__(self, fingerprint, value):
+        pass
+
+
+def migrate_json_record(db, record_file, audio_format):
+    """Copy a JSON record and its journal into the database, once per record file
+    
+    Returns the number of entries copied, or None if the file was migrated before.
+    """
+    conn = db['conn']
+    with db['lock']:
+        if conn.execute('SELECT 1 FROM migrations WHERE record_file = ?', (os.path.abspath(record_file),)).fetchall():
+            return None
+        record = {}
+        if os.path.exists(record_file) or os.path.exists(get_record_journal_file(record_file)):
+            record = load_extraction_record(record_file)
+        with conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO records (format, key, status, fingerprint, timestamp, entry) VALUES (?, ?, ?, ?, ?, ?)',
+                ((audio_format, key, entry.get('status'), entry.get('fingerprint'), get_entry_timestamp(entry),
+                  json.dumps(entry, ensure_ascii=False)) for key, entry in record.items())
+            )
+            conn.execute('INSERT INTO migrations (record_file, entries, migrated) VALUES (?, ?, ?)',
+                         (os.path.abspath(record_file), len(record), time.time()))
+        return len(record)
+
+
+def iter_record_entries(record, status=None, since=None):
+    """Yield (key, entry) pairs of a record by status and minimum timestamp"""
+    if isinstance(record, SqliteRecord):
+        yield from record.query(status, since)
+        return
+    for key, entry in record.items():
+        if status is not None and entry.get('status') != status:
+            continue
+        timestamp = get_entry_timestamp(entry)
+        if since is not None and (timestamp is None or timestamp < since):
+            continue
+        yield key, entry
+
+
+def parse_duration_seconds(value):
+    """Parse a duration like 90, 45m, 12h, 7d or 2w into seconds"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', value.lower())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+    return float(match.group(1)) * units[match.group(2) or 's']
+
+
+def is_json_record_migrated(db, record_file):
+    """Check whether a JSON record was copied into the database"""
+    with db['lock']:
+        return bool(db['conn'].execute('SELECT 1 FROM migrations WHERE record_file = ?',
+                                       (os.path.abspath(record_file),)).fetchall())
+
+
+def open_extraction_records(audio_formats, record_store='json', record_db='extraction_records.db', node_id=None, commit_every=1000,
+                            read_only=False):
+    """Open the extraction record of every format
+    
+    JSON records are extraction_record_<format>.json, with the node name
+    inserted for nodes of a shared work queue. The SQLite store keeps every
+    format in record_db and migrates existing JSON records into it once.
+    read_only opens the records for listing: nothing is migrated or created,
+    and JSON records not migrated yet are read from their files.
+    Returns ({format: record file}, {format: record}).
+    """
+    record_files = {}
+    records = {}
+    db = None
+    if record_store == 'sqlite' and not read_only:
+        db = open_record_db(record_db, commit_every)
+    elif record_store == 'sqlite' and os.path.exists(record_db):
+        db = open_record_db(record_db, read_only=True)
+    for audio_format in audio_formats:
+        record_file = f"extraction_record_{audio_format}.json"
+        if node_id:
+            record_file = f"extraction_record_{audio_format}.{node_id}.json"
+        if db is None or (read_only and not is_json_record_migrated(db, record_file)):
+            record_files[audio_format] = record_file
+            records[audio_format] = load_extraction_record(record_file)
+            continue
+        if read_only:
+            record_files[audio_format] = record_db
+            records[audio_format] = SqliteRecord(db, audio_format)
+            continue
+        migrated = migrate_json_record(db, record_file, audio_format)
+        if migrated:
+            logger.info(f"Migrated {migrated} {audio_format} records from {record_file} to {record_db}, the JSON file is no longer updated")
+        record_files[audio_format] = record_db
+        records[audio_format] = SqliteRecord(db, audio_format)
+    return record_files, records
+
+
+def list_extraction_records(records, status=None, since=None):
+    """Print record entries as tab-separated format, key, time, status and output or error"""
+    count = 0
+    for audio_format, record in records.items():
+        for key, entry in iter_record_entries(record, status, since):
+            timestamp = get_entry_timestamp(entry)
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp is not None else '-'
+            detail = entry.get('error') or entry.get('output_file') or ''
+            print(f"{audio_format}\t{key}\t{when}\t{entry.get('status')}\t{detail}")
+            count += 1
+    return count
 
 
 def move_video_files_to_original(video_files, original_dir):
@@ -225,9 +949,9 @@ def move_video_files_to_original(video_files, original_dir):
             try:
                 shutil.move(video_file, new_path)
                 moved_files.append(new_path)
-                logging.info(f"Moved: {filename} -> {original_dir}/")
+                logger.info(f"Moved: {filename} -> {original_dir}/")
             except Exception as e:
-                logging.info(f"Failed to move file {filename}: {e}")
+                logger.info(f"Failed to move file {filename}: {e}")
                 # If move fails, use original path
                 moved_files.append(video_file)
         else:
@@ -238,192 +962,2999 @@ def move_video_files_to_original(video_files, original_dir):
 
 
 def move_completed_file_to_done(video_file, original_dir, log_message=None):
-    """Move completed video files to original/done folder"""
+    """Move a completed video file to original/done, keeping its path below original_dir
+    
+    Files in subdirectories of a recursive scan keep their subdirectory, so
+    files with the same name in different folders do not collide. An existing
+    file in done is never overwritten; the video is left in place instead.
+    """
+    filename = os.path.basename(video_file)
     try:
-        filename = os.path.basename(video_file)
         done_dir = os.path.join(original_dir, 'done')
+        relative_path = os.path.relpath(video_file, original_dir)
+        # Videos outside the video directory go to the top of done
+        if relative_path.startswith(os.pardir + os.sep) or os.path.isabs(relative_path):
+            relative_path = filename
+        new_path = os.path.join(done_dir, relative_path)
         
         # Ensure done folder exists
-        os.makedirs(done_dir, exist_ok=True)
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
         
-        # Move file
-        new_path = os.path.join(done_dir, filename)
+        if os.path.lexists(new_path):
+            logger.error(f"Not moving completed file {relative_path}: {new_path} already exists")
+            return False
         shutil.move(video_file, new_path)
-        print(f"Moved completed file: {filename} -> {done_dir}/")
+        logger.info(f"Moved completed file: {relative_path} -> {done_dir}/")
         return True
     except Exception as e:
-        print(f"Failed to move completed file {filename}: {e}")
+        logger.error(f"Failed to move completed file {filename}: {e}")
         return False
 
 
-def check_existing_audio_files(video_files, output_dir, audio_format):
+def detect_existing_track_files(video_file, output_dir, audio_format, audio_info=None):
+    """Get the per-track outputs of a multi-track video if every track has one
+    
+    audio_info is the cached probe of the video, which is probed when it is
+    missing. Returns a list of (track, output_file, stat), or None when a
+    track output is missing or empty, so an interrupted multi-track run is
+    finished on the next one.
+    """
+    video_name = Path(video_file).stem
+    pattern = os.path.join(glob.escape(output_dir), f"{glob.escape(video_name)}.track[0-9]*.{audio_format}")
+    if not glob.glob(pattern):
+        return None
+    if audio_info is None:
+        audio_info = probe_audio_stream(video_file)
+    tracks = (audio_info or {}).get('tracks', [])
+    if len(tracks) < 2:
+        return None
+    track_files = []
+    for track in tracks:
+        track_file = get_audio_output_path(output_dir, video_name, audio_format, track)
+        try:
+            stat = os.stat(track_file)
+        except OSError:
+            return None
+        if stat.st_size == 0:
+            return None
+        track_files.append((track, track_file, stat))
+    return track_files
+
+
+def detect_existing_audio_file(video_file, output_dir, audio_format, all_tracks=False, audio_info=None):
+    """Get an auto-detected record entry if the audio file already exists
+    
+    With all_tracks, multi-track videos whose tracks all have an output are
+    also accepted, see detect_existing_track_files.
+    """
+    if audio_format not in ('mp3', 'aac', 'wav', 'flac'):
+        return None
+    
+    video_name = Path(video_file).stem
+    audio_file = get_audio_output_path(output_dir, video_name, audio_format)
+    track_files = None
+    try:
+        stat = os.stat(audio_file)
+    except OSError:
+        if not all_tracks:
+            return None
+        track_files = detect_existing_track_files(video_file, output_dir, audio_format, audio_info)
+        if not track_files:
+            return None
+        _, audio_file, stat = track_files[0]
+    
+    if stat.st_size > 0:
+        entry = {
+            'status': 'completed',
+            'output_file': audio_file,
+            'audio_format': audio_format,
+            'detected': 'auto',  # Mark as auto-detected
+            'timestamp': str(stat.st_mtime)
+        }
+        if track_files:
+            entry['tracks'] = [
+                {'track': track['track'], 'language': track.get('language'), 'output_file': track_file}
+                for track, track_file, _ in track_files
+            ]
+        return entry
+    return None
+
+
+def check_existing_audio_files(video_files, output_dir, audio_format, directory=None):
     """Check existing audio files, even without JSON records"""
     existing_files = {}
     
     for video_file in video_files:
-        video_name = Path(video_file).stem
-        if audio_format == 'mp3':
-            audio_file = os.path.join(output_dir, f"{video_name}.mp3")
-        elif audio_format == 'aac':
-            audio_file = os.path.join(output_dir, f"{video_name}.aac")
-        elif audio_format == 'wav':
-            audio_file = os.path.join(output_dir, f"{video_name}.wav")
-        elif audio_format == 'flac':
-            audio_file = os.path.join(output_dir, f"{video_name}.flac")
-        else:
-            continue
-            
-        if os.path.exists(audio_file) and os.path.getsize(audio_file) > 0:
-            existing_files[os.path.basename(video_file)] = {
-                'status': 'completed',
-                'output_file': audio_file,
-                'audio_format': audio_format,
-                'detected': 'auto',  # Mark as auto-detected
-                'timestamp': str(Path(audio_file).stat().st_mtime)
-            }
+        info = detect_existing_audio_file(video_file, get_output_subdir(output_dir, video_file, directory), audio_format)
+        if info:
+            existing_files[get_record_key(video_file, directory)] = info
     
     return existing_files
 
 
-def extract_audio_from_video_worker(args):
-    """Worker process function for parallel processing"""
-    video_path, output_dir, audio_format, quality, record_file, worker_id, original_dir, use_adaptive = args
-    
+def parse_wav_duration(audio_file):
+    """Get the duration of a WAV file from its RIFF header, or None if it cannot be parsed"""
+    with open(audio_file, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        byte_rate = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt_chunk = f.read(chunk_size + (chunk_size & 1))
+                byte_rate = struct.unpack_from('<I', fmt_chunk, 8)[0]
+            elif chunk_id == b'data':
+                if not byte_rate:
+                    return None
+                # Bytes actually present, in case the header promises more than was written
+                data_size = min(chunk_size, os.fstat(f.fileno()).st_size - f.tell())
+                return data_size / byte_rate
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def parse_flac_duration(audio_file):
+    """Get the duration of a FLAC file from its STREAMINFO block, or None if it cannot be parsed"""
+    with open(audio_file, 'rb') as f:
+        header = f.read(4 + 4 + 18)
+    if len(header) < 26 or header[:4] != b'fLaC' or header[4] & 0x7f != 0:
+        return None
+    # 20 bits sample rate, 3 bits channels, 5 bits sample size, 36 bits total samples
+    fields = int.from_bytes(header[18:26], 'big')
+    sample_rate = fields >> 44
+    total_samples = fields & 0xfffffffff
+    if not sample_rate or not total_samples:
+        return None
+    return total_samples / sample_rate
+
+
+def parse_adts_duration(audio_file):
+    """Get the duration of an ADTS AAC file by counting its frames with ffprobe
+
+    ADTS has no header with the length, and the duration ffprobe reports for
+    it is estimated from the bitrate, so the frames are counted instead.
+    """
+    cmd = ['ffprobe', '-v', 'quiet', '-f', 'aac', '-select_streams', 'a:0', '-count_packets',
+           '-show_entries', 'stream=nb_read_packets,sample_rate', '-of', 'json', audio_file]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+    if result.returncode != 0:
+        return None
+    streams = json.loads(result.stdout).get('streams', [])
+    if not streams or not streams[0].get('sample_rate') or not streams[0].get('nb_read_packets'):
+        return None
+    return int(streams[0]['nb_read_packets']) * 1024 / int(streams[0]['sample_rate'])
+
+
+def get_output_duration(audio_file):
+    """Get the duration of an audio output
+
+    WAV and FLAC durations come straight from their headers and ADTS frames
+    are counted. MP3 is probed with ffprobe, which reads the Xing header or,
+    without one, estimates from the bitrate. Partial outputs are read by the
+    extension of their final name.
+    """
+    name = audio_file[:-len(PARTIAL_SUFFIX)] if audio_file.endswith(PARTIAL_SUFFIX) else audio_file
+    parsers = {'.wav': parse_wav_duration, '.flac': parse_flac_duration, '.aac': parse_adts_duration}
+    parser = parsers.get(os.path.splitext(name)[1].lower())
+    if parser is not None:
+        try:
+            duration = parser(audio_file)
+            if duration is not None:
+                return duration
+        except (OSError, ValueError, struct.error):
+            pass
     try:
-        video_name = Path(video_path).stem
-        original_quality = quality  # Save original quality for record
-        
-        # If adaptive quality is enabled, get appropriate bitrate
-        if use_adaptive:
-            print(f"[Worker {worker_id}] Analyzing audio bitrate for {video_name}...")
-            adaptive_quality = get_adaptive_quality(video_path, quality, audio_format, worker_id, None)
-            if adaptive_quality != quality:
-                print(f"[Worker {worker_id}] Detected original audio bitrate, adjusting quality: {quality} -> {adaptive_quality}")
-            quality = adaptive_quality
-        else:
-            print(f"[Worker {worker_id}] Using fixed quality: {quality}")
-        
-        if audio_format == 'mp3':
-            output_file = os.path.join(output_dir, f"{video_name}.mp3")
-            cmd = [
-                'ffmpeg', '-i', video_path,
-                '-vn', '-acodec', 'libmp3lame', '-ab', quality, '-y', output_file
-            ]
-        elif audio_format == 'aac':
-            output_file = os.path.join(output_dir, f"{video_name}.aac")
-            cmd = [
-                'ffmpeg', '-i', video_path, '-vn', '-acodec', 'aac', '-b:a', quality, '-y', output_file
-            ]
-        elif audio_format == 'wav':
-            output_file = os.path.join(output_dir, f"{video_name}.wav")
-            cmd = [
-                'ffmpeg', '-i', video_path, '-vn', '-acodec', 'pcm_s16le', '-ar', '44100', '-y', output_file
-            ]
-        elif audio_format == 'flac':
-            output_file = os.path.join(output_dir, f"{video_name}.flac")
-            cmd = [
-                'ffmpeg', '-i', video_path, '-vn', '-acodec', 'flac', '-y', output_file
-            ]
-        else:
-            return False, f"Unsupported audio format: {audio_format}"
-        
-        print(f"[Worker {worker_id}] Extracting: {video_name} (Final quality: {quality})")
+        cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration', '-of', 'csv=p=0', audio_file]
         result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-        
         if result.returncode == 0:
-            print(f"[Worker {worker_id}] ✓ Successfully extracted: {video_name}")
-            # Move file to done folder after successful extraction
-            # move_completed_file_to_done(video_path, original_dir, None)
-            # Return success status and actual quality used
-            return True, (video_name, quality, original_quality)
-        else:
-            error_msg = f"Extraction failed: {video_name}"
-            if result.stderr:
-                error_msg += f" - {result.stderr}"
-            print(f"[Worker {worker_id}] ✗ {error_msg}")
-            return False, error_msg
-            
-    except Exception as e:
-        error_msg = f"Error processing file {video_path}: {str(e)}"
-        print(f"[Worker {worker_id}] ✗ {error_msg}")
-        return False, error_msg
+            return float(result.stdout.strip())
+    except ValueError:
+        pass
+    return None
 
 
-def extract_audio_from_video(video_path, output_dir, audio_format='mp3', quality='192k', record_file=None, original_dir=None, use_adaptive=False):
-    """Extract audio from video file (single process version, backward compatible)"""
-    result = extract_audio_from_video_worker((video_path, output_dir, audio_format, quality, record_file, 0, original_dir, use_adaptive))
-    if isinstance(result, tuple) and len(result) == 2:
-        success, data = result
-        if success and isinstance(data, tuple) and len(data) == 3:
-            return success, data[1]  # Return success status and actual quality used
-        return success, None
-    return result, None
+def get_expected_output_duration(audio_info, track=0, trim=None):
+    """Get the duration an output of a track should have, or None if it is unknown
 
+    With trim, the silence trimming settings, the ranges trimmed from the
+    cached silence detection are subtracted. Without a detection made with
+    the same settings the trimmed length is unknown.
+    """
+    duration = get_track_info(audio_info, track).get('duration')
+    if not duration or not trim:
+        return duration
+    detection = audio_info.get('silence', {}).get(str(track))
+    if not detection or detection['threshold'] != trim['threshold'] or detection['min_duration'] != trim['min_duration']:
+        return None
+    _, ranges = plan_silence_trim(detection, trim, duration)
+    return duration - sum(range_end - range_start for range_start, range_end in ranges if range_end is not None)
 
-def get_video_files(directory):
-    """Get all video files in directory"""
-    video_extensions = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v'}
-    video_files = []
-    
-    if not os.path.exists(directory):
-        logging.info(f"Directory {directory} does not exist")
-        return []
-    
-    for file_path in Path(directory).iterdir():
-        if file_path.is_file() and file_path.suffix.lower() in video_extensions:
-            video_files.append(str(file_path))
-    
-    return video_files
 
+def verify_existing_outputs(video_file, output_files, audio_info=None, tolerance=0.5, trim=None):
+    """Check that existing outputs are as long as the source audio
 
-def get_video_files_from_root():
-    """Get all video files in root directory"""
-    video_extensions = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v'}
-    video_files = []
-    
-    current_dir = os.getcwd()
-    for file_path in Path(current_dir).iterdir():
-        if file_path.is_file() and file_path.suffix.lower() in video_extensions:
-            # Use absolute path
-            video_files.append(str(file_path.absolute()))
-    
-    return video_files
+    audio_info is the cached probe of the source, the source is probed when
+    it is missing. With trim, outputs are expected to be as long as the
+    source without its trimmed silence, see get_expected_output_duration.
+    Returns (failures, fresh_audio_info) where failures maps output files to
+    the reason they failed; outputs are accepted when the expected duration
+    is unknown.
+    """
+    fresh_audio_info = None
+    if audio_info is None:
+        audio_info = fresh_audio_info = probe_audio_stream(video_file)
+    failures = {}
+    if not audio_info:
+        return failures, fresh_audio_info
+    for output_file in output_files:
+        # Outputs of --all-tracks are named <name>.track<N>-<language>.<format>, counting from 1
+        match = re.search(r'\.track(\d+)', os.path.basename(output_file))
+        expected_duration = get_expected_output_duration(audio_info, int(match.group(1)) - 1 if match else 0, trim)
+        if not expected_duration:
+            continue
+        duration = get_output_duration(output_file)
+        if duration is None:
+            failures[output_file] = "duration could not be read"
+        elif abs(duration - expected_duration) > tolerance:
+            failures[output_file] = f"{duration:.1f}s of {expected_duration:.1f}s"
+    return failures, fresh_audio_info
 
 
-def main():
-    global current_record_file, current_record
-    
-    parser = argparse.ArgumentParser(description='Batch extract audio from video files with resume support and parallel processing')
-    parser.add_argument('-d', '--directory', default='./original', 
-                       help='Video files directory (default: ./original)')
-    parser.add_argument('-o', '--output', default='./extracted_audio',
-                       help='Audio output directory (default: ./extracted_audio)')
-    parser.add_argument('-f', '--format', default='mp3', 
-                       choices=['mp3', 'aac', 'wav', 'flac'],
-                       help='Audio format (default: mp3)')
-    parser.add_argument('-q', '--quality', default='192k',
-                       help='Audio quality (default: 192k)')
-    parser.add_argument('--adaptive', action='store_true',
-                       help='Enable adaptive quality: automatically adjust extraction quality based on original video audio bitrate')
-    parser.add_argument('--no-resume', action='store_true',
-                       help='Disable resume functionality')
-    parser.add_argument('-j', '--jobs', type=int, default=0,
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+
+
+def compute_file_fingerprint(video_path, full=False, chunk_size=FINGERPRINT_CHUNK_SIZE):
+    """Get a content fingerprint of a video file, or None if it cannot be read
+
+    The partial fingerprint hashes the file size with its first and last
+    chunk_size bytes, which is enough to tell re-uploads apart from other
+    videos at the cost of two reads. With full, the whole file is hashed.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(video_path, 'rb') as f:
+            if full:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    digest.update(chunk)
+                return f"sha256:{digest.hexdigest()}"
+            size = os.fstat(f.fileno()).st_size
+            digest.update(str(size).encode())
+            digest.update(f.read(chunk_size))
+            if size > chunk_size:
+                f.seek(max(size - chunk_size, chunk_size))
+                digest.update(f.read(chunk_size))
+            return f"partial:{digest.hexdigest()}"
+    except OSError as e:
+        logger.info(f"Failed to fingerprint {video_path}: {e}")
+        return None
+
+
+def build_fingerprint_index(records):
+    """Map fingerprints of completed files to their (record key, entry), per format"""
+    index = {}
+    for audio_format, record in records.items():
+        if isinstance(record, SqliteRecord):
+            index[audio_format] = SqliteFingerprintIndex(record)
+            continue
+        index[audio_format] = {
+            entry['fingerprint']: (key, entry) for key, entry in record.items()
+            if entry.get('status') == 'completed' and entry.get('fingerprint')
+        }
+    return index
+
+
+def link_or_copy_file(source, destination):
+    """Hardlink destination to source, copying when a hardlink is not possible
+
+    Returns 'hardlink' or 'copy'. An existing destination is replaced.
+    """
+    temp_file = get_partial_output_path(destination)
+    try:
+        if os.path.lexists(temp_file):
+            os.remove(temp_file)
+        os.link(source, temp_file)
+        method = 'hardlink'
+    except OSError:
+        # Different filesystem, or hardlinks are not supported
+        shutil.copy2(source, temp_file)
+        method = 'copy'
+    os.replace(temp_file, destination)
+    return method
+
+
+def reuse_duplicate_outputs(video_file, output_dir, audio_format, original_key, original_entry, fingerprint):
+    """Link the outputs of an already extracted duplicate instead of re-encoding
+
+    Returns the record entry for video_file, or None when the original outputs
+    are missing and the file has to be extracted after all.
+    """
+    video_name = Path(video_file).stem
+    if original_entry.get('tracks'):
+        pairs = [(track['output_file'], get_audio_output_path(output_dir, video_name, audio_format, track))
+                 for track in original_entry['tracks']]
+    else:
+        pairs = [(original_entry['output_file'], get_audio_output_path(output_dir, video_name, audio_format))]
+    if not all(os.path.isfile(source) for source, _ in pairs):
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    method = None
+    for source, destination in pairs:
+        if os.path.abspath(source) != os.path.abspath(destination):
+            method = link_or_copy_file(source, destination)
+
+    entry = dict(original_entry)
+    entry.pop('detected', None)
+    entry['output_file'] = pairs[0][1]
+    if original_entry.get('tracks'):
+        entry['tracks'] = [dict(track, output_file=destination) for track, (_, destination) in zip(original_entry['tracks'], pairs)]
+    entry['fingerprint'] = fingerprint
+    entry['duplicate_of'] = original_key
+    entry['reused'] = method or 'existing'
+    entry['timestamp'] = str(time.time())
+    return entry
+
+
+def plan_audio_output(video_path, output_dir, audio_format, quality, use_adaptive, use_passthrough, audio_info, worker_id=None, track=None):
+    """Decide codec settings and output path for one output format
+    
+    With a track, the output maps that audio stream and adaptive quality and
+    passthrough are decided from the track's own properties.
+    """
+    video_name = Path(video_path).stem
+    output = {
+        'format': audio_format,
+        'output_file': get_audio_output_path(output_dir, video_name, audio_format, track),
+        'quality': quality,
+        'passthrough': False
+    }
+    if track is not None:
+        output['track'] = track['track']
+        output['language'] = track.get('language')
+        audio_info = track
+    
+    # If adaptive quality is enabled, get appropriate bitrate
+    if use_adaptive:
+        worker_logger.info(f"[Worker {worker_id}] Analyzing audio bitrate for {video_name}...")
+        adaptive_quality = get_adaptive_quality(video_path, quality, audio_format, worker_id, None, audio_info)
+        if adaptive_quality != quality:
+            worker_logger.info(f"[Worker {worker_id}] Detected original audio bitrate, adjusting quality: {quality} -> {adaptive_quality}")
+        output['quality'] = adaptive_quality
+    else:
+        worker_logger.info(f"[Worker {worker_id}] Using fixed quality: {quality}")
+    
+    # Stream-copy the source audio if it already satisfies the target
+    if use_passthrough:
+        passthrough, reason = get_passthrough_decision(audio_info, audio_format, quality)
+        output['passthrough'] = passthrough
+        output['passthrough_reason'] = reason
+        if passthrough:
+            worker_logger.info(f"[Worker {worker_id}] Passthrough ({audio_format}): {reason}")
+            if audio_info.get('bit_rate'):
+                output['quality'] = f"{audio_info['bit_rate'] // 1000}k"
+        else:
+            worker_logger.info(f"[Worker {worker_id}] Re-encoding ({audio_format}): {reason}")
+    
+    return output
+
+
+# Outputs are written under a temporary name and renamed once ffmpeg succeeds
+PARTIAL_SUFFIX = '.part'
+
+# Seconds a partial output must be left unmodified before the startup sweep
+# treats it as orphaned rather than written by another running instance
+PARTIAL_SWEEP_MIN_AGE = 300
+
+# Muxer for each output format, needed because .part hides the extension from ffmpeg
+OUTPUT_MUXERS = {
+    'mp3': 'mp3',
+    'aac': 'adts',
+    'wav': 'wav',
+    'flac': 'flac'
+}
+
+
+def get_partial_output_path(output_file):
+    """Get the temporary path an output is written to until it is complete"""
+    return output_file + PARTIAL_SUFFIX
+
+
+def commit_partial_outputs(outputs):
+    """Rename completed partial outputs to their final names"""
+    for output in outputs:
+        os.replace(get_partial_output_path(output['output_file']), output['output_file'])
+
+
+def remove_partial_outputs(outputs):
+    """Remove partial outputs left by a failed encode"""
+    for output in outputs:
+        try:
+            os.remove(get_partial_output_path(output['output_file']))
+        except OSError:
+            pass
+
+
+def sweep_partial_outputs(output_dir, min_age=None):
+    """Remove partial outputs orphaned by interrupted runs in one pass over the output tree
+    
+    With min_age, only partial outputs not modified for that many seconds are
+    removed, so encodes running on other nodes keep theirs. Returns the number
+    of files removed.
+    """
+    removed = 0
+    cutoff = time.time() - min_age if min_age is not None else None
+    pending_dirs = [output_dir]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                        elif entry.name.endswith(PARTIAL_SUFFIX):
+                            if cutoff is not None and entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                                continue
+                            os.remove(entry.path)
+                            removed += 1
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return removed
+
+
+def build_extraction_command(video_path, outputs, threads=None):
+    """Build one ffmpeg command that writes every planned output
+    
+    The input is demuxed and decoded once and the decoded audio is fed to
+    each output's encoder. threads caps the decoder and encoder threads.
+    Outputs go to their partial paths, see commit_partial_outputs.
+    """
+    thread_args = ['-threads', str(threads)] if threads else []
+    cmd = ['ffmpeg', '-y'] + thread_args + ['-i', video_path]
+    for output in outputs:
+        codec_args = build_audio_codec_args(output['format'], output['quality'], output['passthrough'], output.get('encoder'))
+        map_args = ['-map', f"0:a:{output['track']}"] if 'track' in output else []
+        filter_args = ['-af', output['audio_filter']] if output.get('audio_filter') else []
+        muxer_args = ['-f', OUTPUT_MUXERS[output['format']]]
+        cmd += map_args + ['-vn'] + filter_args + codec_args + thread_args + muxer_args + [get_partial_output_path(output['output_file'])]
+    return cmd
+
+
+# Threads one ffmpeg job can keep busy for each output format. MP3 and PCM
+# encoding are single-threaded; AAC and FLAC jobs also gain from threaded
+# decoding of the source audio.
+FORMAT_THREAD_DEMAND = {
+    'mp3': 1,
+    'aac': 2,
+    'wav': 1,
+    'flac': 2
+}
+
+
+def get_job_thread_demand(audio_formats):
+    """Get how many threads one job writing these formats can keep busy"""
+    demands = [FORMAT_THREAD_DEMAND.get(fmt, 1) for fmt in audio_formats]
+    # Every extra output adds one encoder to the same ffmpeg process
+    return max(demands) + len(demands) - 1
+
+
+def plan_cpu_budget(cpu_budget, audio_formats, max_workers=None, job_count=None):
+    """Split a CPU budget into concurrent jobs and ffmpeg threads per job
+    
+    Without max_workers, the budget is divided by the threads each job can
+    keep busy. Threads per job are the budget left per worker, capped at that
+    demand so jobs never oversubscribe the machine. Returns (workers, threads).
+    """
+    demand = get_job_thread_demand(audio_formats)
+    if not max_workers:
+        max_workers = max(1, cpu_budget // demand)
+        if job_count is not None:
+            max_workers = max(1, min(max_workers, job_count))
+    threads = max(1, min(cpu_budget // max_workers, demand))
+    return max_workers, threads
+
+
+def plan_segment_count(cpu_budget, max_workers, segments=0):
+    """Get how many time segments one task may encode in parallel
+    
+    Every segment is a single-threaded ffmpeg process, so a task gets at most
+    its share of the CPU budget; segments lowers that. A result of 1 means
+    long inputs are encoded in one pass.
+    """
+    share = max(1, cpu_budget // max_workers)
+    return min(segments, share) if segments > 0 else share
+
+
+def format_seconds(seconds):
+    """Format seconds as HH:MM:SS"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_ffmpeg_progress_time(progress):
+    """Get encoded position in seconds from an ffmpeg -progress block"""
+    # out_time_ms is also reported in microseconds
+    for key in ('out_time_us', 'out_time_ms'):
+        value = progress.get(key, '')
+        if value.lstrip('-').isdigit():
+            return max(int(value), 0) / 1000000
+    return None
+
+
+def update_ffmpeg_progress(progress, block, line):
+    """Feed one line of ffmpeg -progress output into progress
+    
+    key=value lines are collected in block until a progress=continue/end line
+    closes it. Returns True when a block was closed and progress updated.
+    """
+    key, _, value = line.strip().partition('=')
+    if key != 'progress':
+        block[key] = value
+        return False
+    
+    out_time = parse_ffmpeg_progress_time(block)
+    if out_time is not None:
+        progress['out_time'] = out_time
+    speed = block.get('speed', '').rstrip('x')
+    try:
+        progress['speed'] = float(speed)
+    except ValueError:
+        pass
+    block.clear()
+    return True
+
+
+def format_ffmpeg_progress(progress, duration=None, worker_id=None, label=None):
+    """Format a progress report with position, percentage, speed and ETA"""
+    message = f"[Worker {worker_id}] {label}: {format_seconds(progress['out_time'])}"
+    if duration:
+        percent = min(progress['out_time'] / duration * 100, 100)
+        message += f" / {format_seconds(duration)} ({percent:.0f}%)"
+    if progress['speed']:
+        message += f", speed {progress['speed']:.1f}x"
+        if duration:
+            remaining = max(duration - progress['out_time'], 0) / progress['speed']
+            message += f", ETA {format_seconds(remaining)}"
+    return message
+
+
+def wait_process_cpu_time(process):
+    """Wait for a subprocess.Popen to exit and return the CPU time it used, or None
+    
+    wait4 runs under the Popen's own wait lock, so an interrupt calling
+    terminate() from another thread never reaps the same child. If the child
+    was reaped elsewhere anyway, the exit status comes from Popen without
+    resource usage.
+    """
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    # Popen keeps no public lock; without it the ChildProcessError fallback still applies
+    lock = getattr(process, '_waitpid_lock', None) or threading.Lock()
+    with lock:
+        if process.returncode is None:
+            try:
+                _, status, usage = os.wait4(process.pid, 0)
+            except ChildProcessError:
+                pass
+            else:
+                process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                return usage.ru_utime + usage.ru_stime
+    process.wait()
+    return None
+
+
+def run_ffmpeg(cmd, duration=None, worker_id=None, label=None, progress_interval=10, stderr_lines=50):
+    """Run ffmpeg, reporting progress from -progress events as they arrive
+    
+    Only the last stderr_lines lines of stderr are kept for error reporting.
+    Returns (returncode, stderr_tail, progress) where progress holds the final
+    encoded position, speed and the CPU time ffmpeg used.
+    """
+    cmd = [cmd[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='ignore')
+    track_process(process, cmd)
+    
+    # Drain stderr in the background so ffmpeg never blocks on a full pipe
+    stderr_tail = deque(maxlen=stderr_lines)
+    stderr_thread = threading.Thread(target=lambda: stderr_tail.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    
+    start_time = time.time()
+    last_report = start_time
+    block = {}
+    progress = {'out_time': None, 'speed': None}
+    for line in process.stdout:
+        if not update_ffmpeg_progress(progress, block, line):
+            continue
+        
+        now = time.time()
+        if progress_interval and now - last_report >= progress_interval and progress['out_time'] is not None:
+            last_report = now
+            worker_logger.info(format_ffmpeg_progress(progress, duration, worker_id, label))
+    
+    try:
+        progress['cpu_time'] = wait_process_cpu_time(process)
+    finally:
+        untrack_process(process)
+    returncode = process.returncode
+    stderr_thread.join()
+    return returncode, ''.join(stderr_tail), progress
+
+
+# Segment boundaries are multiples of this many samples, a multiple of the
+# MP3 (1152 or 576) and AAC (1024) frame sizes, so every segment starts on a
+# frame boundary of the single-pass encode
+SEGMENT_GRID_SAMPLES = 9216
+# Audio encoded before and after each segment and dropped again, so the
+# encoder state is warmed up at the joins
+SEGMENT_OVERLAP_SAMPLES = 2 * SEGMENT_GRID_SAMPLES
+# Seconds decoded and discarded before the overlap so the decoder has settled
+SEGMENT_SEEK_MARGIN = 2.0
+
+# Extra output arguments for segment encodes. MP3 frames are written without
+# the bit reservoir so every frame can be cut from its segment on its own;
+# the Xing/LAME frame reports the encoder delay and padding.
+SEGMENT_OUTPUT_ARGS = {
+    'mp3': ['-reservoir', '0', '-write_xing', '1', '-id3v2_version', '0', '-f', 'mp3'],
+    'aac': ['-f', 'adts']
+}
+
+# Sample rates libmp3lame encodes without resampling, which would move the frame grid
+MP3_SAMPLE_RATES = {8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000}
+
+MP3_BITRATES = {
+    'mpeg1': [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    'mpeg2': [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+}
+MP3_SAMPLE_RATE_TABLE = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+# Encoders whose segments are known to join sample-accurately
+SEGMENT_ENCODERS = {'libmp3lame', 'aac', 'libfdk_aac'}
+
+
+def can_segment_outputs(outputs, audio_info):
+    """Check whether outputs can be encoded in time segments and joined sample-accurately"""
+    if not audio_info or not audio_info.get('duration') or not audio_info.get('sample_rate'):
+        return False
+    for output in outputs:
+        if output['format'] not in SEGMENT_OUTPUT_ARGS or output['passthrough'] or 'track' in output:
+            return False
+        # Filters such as dynamic loudnorm depend on audio outside the segment
+        if output.get('audio_filter'):
+            return False
+        if output['format'] == 'mp3' and audio_info['sample_rate'] not in MP3_SAMPLE_RATES:
+            return False
+        # Joins rely on the libmp3lame bit reservoir option and on 1024-sample AAC frames
+        if output.get('encoder', DEFAULT_ENCODERS[output['format']]) not in SEGMENT_ENCODERS:
+            return False
+    return True
+
+
+def probe_audio_origin(video_path):
+    """Get the timestamp of the first decoded audio sample, in samples, the sample rate
+    and whether the container's timestamps are sample-accurate
+    
+    Containers such as Matroska store timestamps in milliseconds, so audio
+    decoded after a seek starts at a rounded timestamp and cannot be cut at
+    an exact sample.
+    """
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-copyts', '-i', video_path, '-vn',
+           '-af', 'ashowinfo', '-frames:a', '1', '-f', 'null', '-']
+    returncode, _, stderr = run_tracked_process(cmd)
+    match = re.search(r'\bpts:(-?\d+)\b.*\brate:(\d+)', stderr)
+    if returncode != 0 or not match:
+        return None
+    origin, sample_rate = int(match.group(1)), int(match.group(2))
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=time_base',
+           '-of', 'csv=p=0', video_path]
+    returncode, stdout, _ = run_tracked_process(cmd)
+    time_base = re.match(r'\s*(\d+)/(\d+)', stdout)
+    # Exact when every sample lasts a whole number of timestamp ticks
+    exact = bool(returncode == 0 and time_base and int(time_base.group(2)) % (sample_rate * int(time_base.group(1))) == 0)
+    return origin, sample_rate, exact
+
+
+def plan_segments(total_samples, segment_count):
+    """Split total_samples into segment_count (start, end) ranges on the frame grid
+
+    The last range has no end so it runs to the end of the stream.
+    """
+    grid_count = max(-(-total_samples // SEGMENT_GRID_SAMPLES), 1)
+    segment_count = max(min(segment_count, grid_count), 1)
+    length = -(-grid_count // segment_count) * SEGMENT_GRID_SAMPLES
+    starts = [index * length for index in range(segment_count) if index * length < total_samples]
+    return [(start, starts[index + 1] if index + 1 < len(starts) else None) for index, start in enumerate(starts)]
+
+
+def build_segment_command(video_path, outputs, segment_files, origin, sample_rate, start, end, exact_seek=True):
+    """Build the ffmpeg command encoding one time segment of every output
+
+    Timestamps are kept (-copyts) so atrim can cut at exact sample positions
+    after a fast seek, with SEGMENT_OVERLAP_SAMPLES of extra audio on both
+    sides. The first segment is decoded from the start without seeking.
+    Without exact_seek, every segment is decoded from the start and cut at
+    sample counts instead of timestamps, for containers whose timestamps are
+    not sample-accurate.
+    """
+    trim_start = max(start - SEGMENT_OVERLAP_SAMPLES, 0)
+    cmd = ['ffmpeg', '-y', '-threads', '1']
+    if trim_start > 0 and exact_seek:
+        seek_time = (origin + trim_start) / sample_rate - SEGMENT_SEEK_MARGIN
+        if seek_time > 0:
+            cmd += ['-ss', f"{seek_time:.6f}", '-noaccurate_seek']
+    cmd += ['-copyts', '-i', video_path]
+    trim = ''
+    if not exact_seek:
+        # Number the samples from the first decoded one
+        trim, origin = 'asetpts=N/SR/TB,', 0
+    trim += f"atrim=start_pts={origin + trim_start}"
+    if end is not None:
+        trim += f":end_pts={origin + end + SEGMENT_OVERLAP_SAMPLES}"
+    trim += ",asetpts=PTS-STARTPTS"
+    for output, segment_file in zip(outputs, segment_files):
+        codec_args = build_audio_codec_args(output['format'], output['quality'], encoder=output.get('encoder'))
+        cmd += ['-vn', '-af', trim] + codec_args + ['-threads', '1'] + SEGMENT_OUTPUT_ARGS[output['format']] + [segment_file]
+    return cmd
+
+
+def iter_mp3_frames(data):
+    """Yield (offset, size, samples) of the MPEG audio frames in data, skipping an ID3v2 tag"""
+    offset = 0
+    if data[:3] == b'ID3':
+        offset = 10 + ((data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f))
+    while offset + 4 <= len(data):
+        header = int.from_bytes(data[offset:offset + 4], 'big')
+        version = (header >> 19) & 3
+        if header >> 21 != 0x7ff or version == 1 or (header >> 17) & 3 != 1:
+            raise ValueError(f"Invalid MP3 frame header at byte {offset}")
+        bitrate = MP3_BITRATES['mpeg1' if version == 3 else 'mpeg2'][(header >> 12) & 15]
+        sample_rate = MP3_SAMPLE_RATE_TABLE[version][(header >> 10) & 3]
+        samples = 1152 if version == 3 else 576
+        size = samples // 8 * bitrate * 1000 // sample_rate + ((header >> 9) & 1)
+        yield offset, size, samples
+        offset += size
+
+
+def iter_adts_frames(data):
+    """Yield (offset, size, samples) of the ADTS frames in data"""
+    offset = 0
+    while offset + 7 <= len(data):
+        if data[offset] != 0xff or data[offset + 1] & 0xf6 != 0xf0:
+            raise ValueError(f"Invalid ADTS frame header at byte {offset}")
+        size = (data[offset + 3] & 3) << 11 | data[offset + 4] << 3 | data[offset + 5] >> 5
+        yield offset, size, ((data[offset + 6] & 3) + 1) * 1024
+        offset += size
+
+
+def find_mp3_delay_padding(data, frame_offset, frame_size):
+    """Get the offset of the LAME delay/padding field in a Xing/Info frame, or None"""
+    frame = data[frame_offset:frame_offset + frame_size]
+    for tag in (b'Info', b'Xing'):
+        position = frame.find(tag)
+        if position >= 0:
+            break
+    else:
+        return None
+    flags = int.from_bytes(frame[position + 4:position + 8], 'big')
+    # Frames, bytes, TOC and quality fields are present when their flag is set
+    extension = position + 8 + sum(size for bit, size in ((1, 4), (2, 4), (4, 100), (8, 4)) if flags & bit)
+    if frame[extension:extension + 4] not in (b'LAME', b'Lavc', b'Lavf'):
+        return None
+    return frame_offset + extension + 21
+
+
+def read_mp3_delay_padding(data, frame_offset, frame_size):
+    """Get (encoder delay, padding) from a Xing/Info frame, or None"""
+    field = find_mp3_delay_padding(data, frame_offset, frame_size)
+    if field is None:
+        return None
+    value = int.from_bytes(data[field:field + 3], 'big')
+    return value >> 12, value & 0xfff
+
+
+def join_segment_frames(segment_files, audio_format, segments, joined_file):
+    """Cut every segment to its range on the frame grid and write the frames back to back
+
+    Returns (encoder delay, padding) for MP3, read from the first and last
+    segment's Info frame, and None for AAC.
+    """
+    iter_frames = iter_mp3_frames if audio_format == 'mp3' else iter_adts_frames
+    delay_padding = None
+    with open(joined_file, 'wb') as joined:
+        for index, (segment_file, (start, end)) in enumerate(zip(segment_files, segments)):
+            with open(segment_file, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                frames = list(iter_frames(data))
+                if audio_format == 'mp3':
+                    # The first frame is the Info frame, not audio
+                    info = read_mp3_delay_padding(data, frames[0][0], frames[0][1])
+                    frames = frames[1:]
+                    if info is not None:
+                        if index == 0:
+                            delay_padding = info
+                        else:
+                            delay_padding = (delay_padding[0], info[1]) if delay_padding else info
+                frame_samples = frames[0][2]
+                first = (start - max(start - SEGMENT_OVERLAP_SAMPLES, 0)) // frame_samples
+                kept = frames[first:] if end is None else frames[first:first + (end - start) // frame_samples]
+                begin = kept[0][0]
+                finish = kept[-1][0] + kept[-1][1]
+                for chunk_start in range(begin, finish, 16 * 1024 * 1024):
+                    joined.write(data[chunk_start:min(chunk_start + 16 * 1024 * 1024, finish)])
+            finally:
+                data.close()
+    return delay_padding
+
+
+def patch_mp3_delay_padding(audio_file, delay, padding):
+    """Write the encoder delay and padding into the LAME tag of an MP3 file"""
+    with open(audio_file, 'r+b') as f:
+        data = f.read(64 * 1024)
+        offset, size, _ = next(iter_mp3_frames(data))
+        field = find_mp3_delay_padding(data, offset, size)
+        if field is None:
+            return False
+        f.seek(field)
+        f.write((delay << 12 | padding).to_bytes(3, 'big'))
+    return True
+
+
+def run_segmented_ffmpeg(video_path, outputs, audio_info, segment_count, worker_id=None, label=None, progress_interval=10):
+    """Encode outputs in parallel time segments and join them sample-accurately
+
+    Segments start on a shared frame grid and are encoded with overlapping
+    audio, then the overlap frames are dropped so each join falls on a frame
+    boundary of a single-pass encode. MP3 segments are written without the
+    bit reservoir, which makes the joined frames identical to a single-pass
+    encode with -reservoir 0. The joined MP3 gets the Info frame of a normal
+    encode, with the delay and padding of the first and last segments.
+
+    Returns (returncode, stderr_tail, progress) like run_ffmpeg.
+    """
+    start_time = time.time()
+    origin = probe_audio_origin(video_path)
+    if origin is None:
+        return 1, "Failed to find the first audio sample", {'out_time': None, 'speed': None, 'cpu_time': None}
+    origin, sample_rate, exact = origin
+    segments = plan_segments(int(audio_info['duration'] * sample_rate), segment_count)
+    segment_files = [
+        [get_partial_output_path(f"{output['output_file']}.seg{index:03d}") for output in outputs]
+        for index in range(len(segments))
+    ]
+    joined_files = [get_partial_output_path(f"{output['output_file']}.joined") for output in outputs]
+    worker_logger.info(f"[Worker {worker_id}] {label}: encoding {len(segments)} segments in parallel")
+
+    cpu_time = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix='Segment') as executor:
+            futures = []
+            for index, (start, end) in enumerate(segments):
+                cmd = build_segment_command(video_path, outputs, segment_files[index], origin, sample_rate, start, end, exact)
+                length = ((end if end is not None else int(audio_info['duration'] * sample_rate)) - start) / sample_rate
+                futures.append(executor.submit(run_ffmpeg, cmd, length, worker_id, f"{label} [{index + 1}/{len(segments)}]", progress_interval))
+            results = [future.result() for future in futures]
+        for returncode, stderr_tail, progress in results:
+            cpu_time += progress.get('cpu_time') or 0.0
+            if returncode != 0:
+                return returncode, stderr_tail, {'out_time': None, 'speed': None, 'cpu_time': cpu_time}
+
+        for output_index, output in enumerate(outputs):
+            files = [segment_files[index][output_index] for index in range(len(segments))]
+            partial_file = get_partial_output_path(output['output_file'])
+            if output['format'] == 'aac':
+                join_segment_frames(files, 'aac', segments, partial_file)
+                continue
+            delay_padding = join_segment_frames(files, 'mp3', segments, joined_files[output_index])
+            # Remux so ffmpeg writes the Info frame (frame count, TOC) and tags of a normal encode
+            cmd = ['ffmpeg', '-y', '-f', 'mp3', '-i', joined_files[output_index], '-c', 'copy', '-write_xing', '1', '-f', 'mp3', partial_file]
+            returncode, stderr_tail, progress = run_ffmpeg(cmd, progress_interval=0)
+            cpu_time += progress.get('cpu_time') or 0.0
+            if returncode != 0:
+                return returncode, stderr_tail, {'out_time': None, 'speed': None, 'cpu_time': cpu_time}
+            if delay_padding:
+                patch_mp3_delay_padding(partial_file, *delay_padding)
+    except (OSError, ValueError, IndexError) as e:
+        return 1, f"Failed to join segments: {e}", {'out_time': None, 'speed': None, 'cpu_time': cpu_time}
+    finally:
+        for path in [path for files in segment_files for path in files] + joined_files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    wall_time = time.time() - start_time
+    duration = audio_info['duration']
+    return 0, '', {'out_time': duration, 'speed': duration / wall_time if wall_time > 0 else None, 'cpu_time': cpu_time}
+
+
+# EBU R128 targets of the loudnorm filter: integrated loudness (LUFS), true
+# peak (dBTP) and loudness range (LU)
+DEFAULT_LOUDNORM_TARGET = {'I': -16.0, 'TP': -1.5, 'LRA': 11.0}
+
+# Values of the first loudnorm pass needed by the second pass
+LOUDNORM_MEASUREMENT_KEYS = ['input_i', 'input_tp', 'input_lra', 'input_thresh', 'target_offset']
+
+# loudnorm works at 192 kHz internally; outputs are resampled to this rate
+# when the source rate is unknown
+LOUDNORM_FALLBACK_SAMPLE_RATE = 48000
+
+
+def get_track_info(audio_info, track):
+    """Get the probed properties of one audio track, or of the first stream without a track list"""
+    tracks = (audio_info or {}).get('tracks', [])
+    return tracks[track] if track < len(tracks) else (audio_info or {})
+
+
+def format_loudnorm_target(target):
+    """Format loudnorm targets as filter options, also used to key stored measurements"""
+    return f"I={target['I']}:TP={target['TP']}:LRA={target['LRA']}"
+
+
+def build_loudness_command(video_path, target, track=0):
+    """Build the ffmpeg command of the loudnorm measurement pass for one audio track"""
+    return [
+        'ffmpeg', '-hide_banner', '-nostats', '-i', video_path, '-map', f"0:a:{track}", '-vn',
+        '-af', f"loudnorm={format_loudnorm_target(target)}:print_format=json", '-f', 'null', '-'
+    ]
+
+
+def parse_loudness_output(output, target):
+    """Parse the JSON summary loudnorm prints at the end of a measurement pass
+
+    Returns the measurement, or None if it is missing or the track is silent,
+    which loudnorm cannot normalize linearly.
+    """
+    match = re.search(r'\{[^{}]*"input_i"[^{}]*\}', output)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+        measurement = {key: float(data[key]) for key in LOUDNORM_MEASUREMENT_KEYS}
+    except (ValueError, KeyError):
+        return None
+    if not all(math.isfinite(value) for value in measurement.values()):
+        return None
+    measurement['target'] = format_loudnorm_target(target)
+    return measurement
+
+
+def measure_loudness(video_path, target, track=0):
+    """Run the loudnorm measurement pass over one audio track, see parse_loudness_output"""
+    try:
+        returncode, _, stderr = run_tracked_process(build_loudness_command(video_path, target, track))
+        if returncode == 0:
+            return parse_loudness_output(stderr, target)
+        return None
+    except Exception as e:
+        logger.info(f"Failed to measure loudness of {os.path.basename(video_path)}: {e}")
+        return None
+
+
+async def measure_loudness_async(video_path, target, track=0):
+    """Run the loudnorm measurement pass with an asyncio subprocess, like measure_loudness"""
+    returncode, _, stderr = await run_async_process(build_loudness_command(video_path, target, track), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if returncode != 0:
+        return None
+    return parse_loudness_output(stderr.decode('utf-8', errors='ignore'), target)
+
+
+def get_missing_loudness_tracks(outputs, audio_info, options):
+    """List the audio tracks a two-pass normalization still has to measure
+
+    Measurements are stored in audio_info['loudness'] by track, see
+    store_track_measurements. The input values do not depend on the
+    targets, so measurements taken for other targets are reused.
+    """
+    if options.get('normalize') != 'two-pass':
+        return []
+    stored = (audio_info or {}).get('loudness', {})
+    return sorted({output.get('track', 0) for output in outputs if str(output.get('track', 0)) not in stored})
+
+
+def store_track_measurements(audio_info, key, measurements, details):
+    """Add fresh per-track measurements under audio_info[key] of a copy of audio_info
+
+    The copy is handed back in details so the caller stores it in the probe
+    cache. Returns the updated audio information.
+    """
+    stored = dict((audio_info or {}).get(key, {}))
+    stored.update({str(track): measurement for track, measurement in measurements.items() if measurement})
+    audio_info = dict(audio_info or {}, **{key: stored})
+    # Without a probe result there is nothing to cache the measurements with
+    if len(audio_info) > 1:
+        details['audio_info'] = audio_info
+    return audio_info
+
+
+def build_loudnorm_filter(target, measurement=None, sample_rate=None):
+    """Build the loudnorm filter chain of one output
+
+    With a measurement the second pass applies a linear gain, otherwise
+    loudnorm normalizes dynamically in a single pass. The output is resampled
+    from loudnorm's 192 kHz back to the source rate.
+    """
+    options = format_loudnorm_target(target)
+    if measurement:
+        options += (
+            f":measured_I={measurement['input_i']}:measured_TP={measurement['input_tp']}"
+            f":measured_LRA={measurement['input_lra']}:measured_thresh={measurement['input_thresh']}:linear=true"
+        )
+        # The offset is only valid for the targets it was measured with
+        if measurement.get('target') == format_loudnorm_target(target):
+            options += f":offset={measurement['target_offset']}"
+    return f"loudnorm={options},aformat=sample_rates={sample_rate or LOUDNORM_FALLBACK_SAMPLE_RATE}"
+
+
+def apply_loudness_normalization(outputs, audio_info, options, worker_id=None):
+    """Add the loudnorm filter to every output of a normalized task
+
+    Outputs of tracks without a measurement fall back to dynamic normalization.
+    """
+    target = options.get('loudnorm_target') or DEFAULT_LOUDNORM_TARGET
+    audio_info = audio_info or {}
+    stored = audio_info.get('loudness', {})
+    for output in outputs:
+        track = output.get('track', 0)
+        measurement = stored.get(str(track)) if options['normalize'] == 'two-pass' else None
+        if options['normalize'] == 'two-pass' and not measurement:
+            worker_logger.info(f"[Worker {worker_id}] No loudness measurement for track {track}, normalizing dynamically")
+        sample_rate = get_track_info(audio_info, track).get('sample_rate')
+        # Appended to the silence trim, so the gain ramps of dynamic mode start on the content
+        output['audio_filter'] = ','.join(
+            audio_filter for audio_filter in (output.get('audio_filter'), build_loudnorm_filter(target, measurement, sample_rate)) if audio_filter
+        )
+        output['loudnorm'] = {
+            'mode': 'two-pass' if measurement else 'dynamic',
+            'target': dict(target),
+            'measured': {key: measurement[key] for key in LOUDNORM_MEASUREMENT_KEYS} if measurement else None
+        }
+
+
+# Silence trimming defaults: level in dB below which audio counts as silent,
+# shortest silence in seconds that is trimmed, and seconds of silence kept
+# next to the content
+DEFAULT_SILENCE_TRIM = {'threshold': -50.0, 'min_duration': 2.0, 'padding': 0.5}
+
+# Silence starting or ending within this many seconds of the track start or
+# end counts as leading or trailing silence
+SILENCE_EDGE_TOLERANCE = 0.1
+
+
+def build_silence_command(video_path, trim, track=0):
+    """Build the ffmpeg command detecting the silent ranges of one audio track"""
+    return [
+        'ffmpeg', '-hide_banner', '-nostats', '-i', video_path, '-map', f"0:a:{track}", '-vn',
+        '-af', f"silencedetect=noise={trim['threshold']}dB:d={trim['min_duration']}", '-f', 'null', '-'
+    ]
+
+
+def parse_silence_output(output, trim, duration=None):
+    """Find where the content of a track starts and ends from silencedetect output
+
+    Returns the detection settings with content_start and content_end in
+    seconds; content_end is None without trailing silence. Trailing silence
+    needs the track duration unless ffmpeg reports no end for it.
+    """
+    silences = []
+    for match in re.finditer(r'silence_(start|end): (-?[\d.]+(?:e[+-]?\d+)?)', output):
+        if match.group(1) == 'start':
+            silences.append([float(match.group(2)), None])
+        elif silences:
+            silences[-1][1] = float(match.group(2))
+    detection = {'threshold': trim['threshold'], 'min_duration': trim['min_duration'], 'content_start': 0.0, 'content_end': None}
+    if silences and silences[0][0] <= SILENCE_EDGE_TOLERANCE and silences[0][1] is not None:
+        detection['content_start'] = silences[0][1]
+    if silences:
+        last_start, last_end = silences[-1]
+        if last_end is None or (duration and last_end >= duration - SILENCE_EDGE_TOLERANCE):
+            detection['content_end'] = last_start
+    return detection
+
+
+def detect_silence(video_path, trim, track=0, duration=None):
+    """Run silencedetect over one audio track, see parse_silence_output"""
+    try:
+        returncode, _, stderr = run_tracked_process(build_silence_command(video_path, trim, track))
+        if returncode == 0:
+            return parse_silence_output(stderr, trim, duration)
+        return None
+    except Exception as e:
+        logger.info(f"Failed to detect silence in {os.path.basename(video_path)}: {e}")
+        return None
+
+
+async def detect_silence_async(video_path, trim, track=0, duration=None):
+    """Run silencedetect with an asyncio subprocess, like detect_silence"""
+    returncode, _, stderr = await run_async_process(build_silence_command(video_path, trim, track), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if returncode != 0:
+        return None
+    return parse_silence_output(stderr.decode('utf-8', errors='ignore'), trim, duration)
+
+
+def get_missing_silence_tracks(outputs, audio_info, options):
+    """List the audio tracks silence trimming still has to scan
+
+    Detections are stored in audio_info['silence'] by track and reused while
+    the threshold and minimum duration are unchanged; the padding is applied
+    when planning, so changing it needs no new scan.
+    """
+    trim = options['trim_silence']
+    stored = (audio_info or {}).get('silence', {})
+    missing = set()
+    for output in outputs:
+        detection = stored.get(str(output.get('track', 0)))
+        if not detection or detection['threshold'] != trim['threshold'] or detection['min_duration'] != trim['min_duration']:
+            missing.add(output.get('track', 0))
+    return sorted(missing)
+
+
+def plan_silence_trim(detection, trim, duration=None):
+    """Turn a silence detection into an atrim filter and the trimmed [start, end] ranges
+
+    Returns (None, []) when nothing is trimmed, including tracks that are
+    silent throughout.
+    """
+    if not detection:
+        return None, []
+    start = max(detection['content_start'] - trim['padding'], 0.0)
+    end = detection['content_end'] + trim['padding'] if detection['content_end'] is not None else None
+    if duration and end is not None and end >= duration:
+        end = None
+    if end is not None and end <= start:
+        return None, []
+    ranges = []
+    if start > 0:
+        ranges.append([0.0, round(start, 3)])
+    if end is not None:
+        ranges.append([round(end, 3), duration])
+    if not ranges:
+        return None, []
+    atrim = f"atrim=start={start:.6f}" + (f":end={end:.6f}" if end is not None else '')
+    return f"{atrim},asetpts=PTS-STARTPTS", ranges
+
+
+def apply_silence_trim(outputs, audio_info, options, worker_id=None):
+    """Add an atrim filter cutting leading and trailing silence to every output
+
+    The trimmed ranges are kept in output['silence_trim'] for the record.
+    """
+    trim = options['trim_silence']
+    stored = (audio_info or {}).get('silence', {})
+    plans = {}
+    for output in outputs:
+        track = output.get('track', 0)
+        if track not in plans:
+            detection = stored.get(str(track))
+            plans[track] = plan_silence_trim(detection, trim, get_track_info(audio_info, track).get('duration'))
+            ranges = plans[track][1]
+            if ranges:
+                trimmed = sum(range_end - range_start for range_start, range_end in ranges if range_end is not None)
+                worker_logger.info(f"[Worker {worker_id}] Trimming {trimmed:.1f}s of silence from track {track} ({format_time_ranges(ranges)})")
+            elif detection and detection['content_end'] is not None and detection['content_end'] <= detection['content_start']:
+                worker_logger.info(f"[Worker {worker_id}] Track {track} is silent, not trimming")
+        audio_filter, ranges = plans[track]
+        if audio_filter:
+            output['audio_filter'] = audio_filter
+        output['silence_trim'] = dict(trim, ranges=ranges)
+
+
+def format_time_ranges(ranges):
+    """Format [start, end] ranges in seconds for the log, an open end is shown as 'end'"""
+    return ', '.join(
+        f"{range_start:.1f}s-{f'{range_end:.1f}s' if range_end is not None else 'end'}" for range_start, range_end in ranges
+    )
+
+
+def needs_audio_info(use_adaptive, options):
+    """Check whether a task has to probe its source before planning outputs"""
+    return bool(use_adaptive or options.get('passthrough') or options.get('all_tracks') or options.get('segment_above')
+                or options.get('normalize') or options.get('trim_silence'))
+
+
+def plan_extraction_outputs(video_path, output_dir, audio_formats, quality, use_adaptive, options, audio_info, worker_id=None):
+    """Plan every output of a task, one per format and, with all_tracks, per audio track"""
+    # One output per track for files with several audio streams
+    tracks = [None]
+    if options.get('all_tracks') and audio_info and len(audio_info.get('tracks', [])) > 1:
+        tracks = audio_info['tracks']
+        worker_logger.info(f"[Worker {worker_id}] Found {len(tracks)} audio tracks in {Path(video_path).stem}")
+    
+    # Normalized or trimmed audio has to be re-encoded
+    use_passthrough = options.get('passthrough', False) and not (options.get('normalize') or options.get('trim_silence'))
+    outputs = [
+        plan_audio_output(video_path, output_dir, fmt, quality, use_adaptive, use_passthrough, audio_info, worker_id, track)
+        for track in tracks
+        for fmt in audio_formats
+    ]
+    encoders = options.get('encoders') or {}
+    for output in outputs:
+        if not output['passthrough'] and encoders.get(output['format']):
+            output['encoder'] = encoders[output['format']]
+    return outputs
+
+
+def try_segmented_encode(video_path, outputs, audio_info, options, worker_id=None, label=None):
+    """Encode outputs in parallel time segments if the input is long enough
+    
+    Returns (returncode, stderr_tail, progress) of a successful segmented
+    encode, or None when the outputs have to be encoded in a single pass.
+    """
+    segment_above = options.get('segment_above')
+    duration = audio_info.get('duration') if audio_info else None
+    if not (segment_above and duration and duration >= segment_above and can_segment_outputs(outputs, audio_info)):
+        return None
+    segment_count = options.get('segments') or 1
+    if segment_count < 2:
+        return None
+    returncode, stderr_tail, progress = run_segmented_ffmpeg(
+        video_path, outputs, audio_info, segment_count, worker_id, label, options.get('progress_interval', 10)
+    )
+    if returncode == 0:
+        # The joined outputs must cover the source, as a single-pass encode would
+        failures, _ = verify_existing_outputs(video_path, [get_partial_output_path(output['output_file']) for output in outputs], audio_info)
+        if failures:
+            stderr_tail = f"joined output is {', '.join(failures.values())}"
+            returncode = 1
+    if returncode != 0:
+        worker_logger.info(f"[Worker {worker_id}] Segmented encode of {label} failed ({stderr_tail.strip()[-200:]}), encoding in a single pass")
+        remove_partial_outputs(outputs)
+        return None
+    return returncode, stderr_tail, progress
+
+
+def finish_extraction(video_path, outputs, quality, details, worker_id, encoded, encode_wall_time, duration=None):
+    """Record encode metrics, then commit or discard the outputs of a finished encode
+    
+    encoded is the (returncode, stderr_tail, progress) of the encode. Returns
+    the worker result.
+    """
+    returncode, stderr_tail, progress = encoded
+    video_name = Path(video_path).stem
+    metrics = details['metrics']
+    audio_duration = duration or progress['out_time']
+    metrics.update({
+        'encode_wall_time': encode_wall_time,
+        'encode_cpu_time': progress['cpu_time'],
+        'audio_duration': audio_duration,
+        'speed_factor': audio_duration / encode_wall_time if audio_duration and encode_wall_time > 0 else None,
+        'adaptive': [
+            {
+                'format': output['format'],
+                'track': output.get('track'),
+                'target_quality': quality,
+                'final_quality': output['quality'],
+                'passthrough': output['passthrough']
+            }
+            for output in outputs
+        ]
+    })
+    
+    with active_processes_lock:
+        lease_lost = video_path in aborted_videos
+    if lease_lost:
+        # Another node owns the video now and writes the same outputs
+        returncode, stderr_tail = 1, "lease was taken over by another node"
+    if returncode == 0:
+        commit_partial_outputs(outputs)
+        worker_logger.info(f"[Worker {worker_id}] ✓ Successfully extracted: {video_name}")
+        metrics['output_bytes'] = sum(
+            os.path.getsize(output['output_file']) for output in outputs if os.path.exists(output['output_file'])
+        )
+        # Return success status, actual quality used and extraction details
+        return True, (video_name, outputs[0]['quality'], quality, details)
+    else:
+        remove_partial_outputs(outputs)
+        error_msg = f"Extraction failed: {video_name}"
+        if stderr_tail:
+            error_msg += f" - {stderr_tail}"
+        worker_logger.info(f"[Worker {worker_id}] ✗ {error_msg}")
+        return False, error_msg
+
+
+def describe_outputs(outputs):
+    """Summarize planned outputs for the extraction log line"""
+    return ', '.join(
+        f"{os.path.basename(output['output_file'])} {'copy' if output['passthrough'] else output['quality']}" for output in outputs
+    )
+
+
+def extraction_steps(args):
+    """Plan and run one worker task, yielding every subprocess step to the engine
+    
+    Both engines share this planning and only provide the runners of the
+    steps. Each (step, arguments) pair yielded is run by the engine's runner
+    of that step and its result is sent back; an exception is thrown back in.
+    The steps are 'probe', 'detect_silence', 'measure_loudness',
+    'segmented_encode' and 'encode', plus 'acquire' and 'release' around the
+    probe and the ffmpeg passes for engines that limit them. Returns the
+    worker result.
+    """
+    video_path, output_dir, audio_format, quality, record_file, worker_id, original_dir, use_adaptive = args[:8]
+    # Optional per-run settings appended to the task tuple
+    options = args[8] if len(args) > 8 else {}
+    audio_formats = [audio_format] if isinstance(audio_format, str) else list(audio_format)
+    
+    details = {}
+    if options.get('lease'):
+        register_task_lease(video_path, options['lease'])
+    try:
+        video_name = Path(video_path).stem
+        
+        for fmt in audio_formats:
+            if build_audio_codec_args(fmt, quality) is None:
+                return False, f"Unsupported audio format: {fmt}"
+        
+        metrics = {'probe_time': 0.0, 'probe_cached': False, 'input_bytes': os.path.getsize(video_path)}
+        details['metrics'] = metrics
+        
+        audio_info = options.get('audio_info')
+        if audio_info is not None:
+            metrics['probe_cached'] = True
+        elif needs_audio_info(use_adaptive, options):
+            yield 'acquire', ('probe',)
+            probe_start = time.perf_counter()
+            audio_info = yield 'probe', (video_path,)
+            metrics['probe_time'] = time.perf_counter() - probe_start
+            yield 'release', ('probe',)
+            # Hand fresh probe results back so the caller can cache them
+            details['audio_info'] = audio_info
+        if audio_info:
+            details['source_codec'] = audio_info.get('codec')
+        
+        yield 'acquire', ('encode',)
+        # A failed probe is not repeated by adaptive quality
+        planned_info = audio_info if audio_info is not None or not needs_audio_info(use_adaptive, options) else {}
+        outputs = plan_extraction_outputs(video_path, output_dir, audio_formats, quality, use_adaptive, options, planned_info, worker_id)
+        details['outputs'] = outputs
+        
+        if options.get('trim_silence'):
+            missing_tracks = get_missing_silence_tracks(outputs, audio_info, options)
+            if missing_tracks:
+                worker_logger.info(f"[Worker {worker_id}] Detecting silence: {video_name}")
+                detect_start = time.perf_counter()
+                detections = {}
+                for track in missing_tracks:
+                    detections[track] = yield 'detect_silence', (
+                        video_path, options['trim_silence'], track, get_track_info(audio_info, track).get('duration')
+                    )
+                metrics['silence_time'] = time.perf_counter() - detect_start
+                audio_info = store_track_measurements(audio_info, 'silence', detections, details)
+            apply_silence_trim(outputs, audio_info, options, worker_id)
+        
+        if options.get('normalize'):
+            # First loudnorm pass, skipped for tracks measured by an earlier run
+            missing_tracks = get_missing_loudness_tracks(outputs, audio_info, options)
+            if missing_tracks:
+                worker_logger.info(f"[Worker {worker_id}] Measuring loudness: {video_name}")
+                measure_start = time.perf_counter()
+                target = options.get('loudnorm_target') or DEFAULT_LOUDNORM_TARGET
+                measurements = {}
+                for track in missing_tracks:
+                    measurements[track] = yield 'measure_loudness', (video_path, target, track)
+                metrics['loudness_time'] = time.perf_counter() - measure_start
+                audio_info = store_track_measurements(audio_info, 'loudness', measurements, details)
+            apply_loudness_normalization(outputs, audio_info, options, worker_id)
+        
+        os.makedirs(output_dir, exist_ok=True)
+        worker_logger.info(f"[Worker {worker_id}] Extracting: {video_name} ({describe_outputs(outputs)})")
+        duration = audio_info.get('duration') if audio_info else None
+        encode_start = time.perf_counter()
+        encoded = None
+        if options.get('segment_above'):
+            encoded = yield 'segmented_encode', (video_path, outputs, audio_info, options, worker_id, video_name)
+        metrics['segmented'] = encoded is not None
+        if encoded is None:
+            cmd = build_extraction_command(video_path, outputs, options.get('threads'))
+            encoded = yield 'encode', (cmd, duration, worker_id, video_name, options.get('progress_interval', 10))
+        encode_wall_time = time.perf_counter() - encode_start
+        yield 'release', ('encode',)
+        return finish_extraction(video_path, outputs, quality, details, worker_id, encoded, encode_wall_time, duration)
+    
+    except asyncio.CancelledError:
+        if 'outputs' in details:
+            remove_partial_outputs(details['outputs'])
+        worker_logger.info(f"[Worker {worker_id}] ✗ Cancelled: {Path(video_path).stem}")
+        raise
+    except Exception as e:
+        if 'outputs' in details:
+            remove_partial_outputs(details['outputs'])
+        error_msg = f"Error processing file {video_path}: {str(e)}"
+        worker_logger.info(f"[Worker {worker_id}] ✗ {error_msg}")
+        return False, error_msg
+    finally:
+        if options.get('lease'):
+            unregister_task_lease(video_path)
+
+
+def run_extraction_steps(steps, runners):
+    """Run the steps of extraction_steps with blocking runners and return the worker result"""
+    resume, value = steps.send, None
+    while True:
+        try:
+            step, step_args = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            resume, value = steps.send, runners[step](*step_args)
+        except BaseException as e:
+            resume, value = steps.throw, e
+
+
+def extract_audio_from_video_worker(args):
+    """Worker process function for parallel processing
+    
+    audio_format may be a single format or a list of formats, which are all
+    written by one ffmpeg invocation.
+    """
+    return run_extraction_steps(extraction_steps(args), {
+        'acquire': lambda name: None,
+        'release': lambda name: None,
+        'probe': probe_audio_stream,
+        'detect_silence': detect_silence,
+        'measure_loudness': measure_loudness,
+        'segmented_encode': try_segmented_encode,
+        'encode': run_ffmpeg
+    })
+
+
+def extract_audio_from_video(video_path, output_dir, audio_format='mp3', quality='192k', record_file=None, original_dir=None, use_adaptive=False, use_passthrough=False):
+    """Extract audio from video file (single process version, backward compatible)"""
+    result = extract_audio_from_video_worker((video_path, output_dir, audio_format, quality, record_file, 0, original_dir, use_adaptive, {'passthrough': use_passthrough}))
+    if isinstance(result, tuple) and len(result) == 2:
+        success, data = result
+        if success and isinstance(data, tuple) and len(data) >= 3:
+            return success, data[1]  # Return success status and actual quality used
+        return success, None
+    return result, None
+
+
+async def kill_async_process(process):
+    """Kill an asyncio subprocess that is still running and reap it"""
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await process.wait()
+
+
+async def run_async_process(cmd, stdout, stderr):
+    """Run a command as an asyncio subprocess and collect its output
+    
+    The process is stopped on interrupt and killed when the awaiting task is
+    cancelled. Returns (returncode, stdout, stderr) as bytes.
+    """
+    process = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=stdout, stderr=stderr)
+    track_process(process, cmd)
+    try:
+        output, errors = await process.communicate()
+    except asyncio.CancelledError:
+        await kill_async_process(process)
+        raise
+    finally:
+        untrack_process(process)
+    return process.returncode, output, errors
+
+
+async def probe_audio_stream_async(video_path):
+    """Probe the audio streams of a video file with an asyncio subprocess, like probe_audio_stream"""
+    returncode, stdout, _ = await run_async_process(build_probe_command(video_path), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if returncode != 0:
+        return None
+    try:
+        return parse_probe_output(stdout.decode('utf-8', errors='ignore'))
+    except ValueError as e:
+        logger.info(f"Failed to probe audio stream for {os.path.basename(video_path)}: {e}")
+        return None
+
+
+async def run_ffmpeg_async(cmd, duration=None, worker_id=None, label=None, progress_interval=10, stderr_lines=50):
+    """Run ffmpeg as an asyncio subprocess, reporting progress from -progress events
+    
+    stdout and stderr are read concurrently from the event loop. Returns
+    (returncode, stderr_tail, progress) like run_ffmpeg, except that the CPU
+    time is not available (None). Cancelling kills ffmpeg.
+    """
+    cmd = [cmd[0], '-hide_banner', '-nostats', '-progress', 'pipe:1'] + cmd[1:]
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    track_process(process, cmd)
+    
+    stderr_tail = deque(maxlen=stderr_lines)
+    
+    async def drain_stderr():
+        async for line in process.stderr:
+            stderr_tail.append(line.decode('utf-8', errors='ignore'))
+    
+    stderr_task = asyncio.ensure_future(drain_stderr())
+    last_report = time.time()
+    block = {}
+    progress = {'out_time': None, 'speed': None, 'cpu_time': None}
+    try:
+        async for line in process.stdout:
+            if not update_ffmpeg_progress(progress, block, line.decode('utf-8', errors='ignore')):
+                continue
+            now = time.time()
+            if progress_interval and now - last_report >= progress_interval and progress['out_time'] is not None:
+                last_report = now
+                worker_logger.info(format_ffmpeg_progress(progress, duration, worker_id, label))
+        await stderr_task
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        stderr_task.cancel()
+        await kill_async_process(process)
+        raise
+    finally:
+        untrack_process(process)
+    return returncode, ''.join(stderr_tail), progress
+
+
+def new_async_limits(max_workers):
+    """Create the semaphores of the asyncio engine
+    
+    At most max_workers ffmpeg encodes run at a time. Probes have their own
+    limit, so queued tasks are probed while other tasks encode.
+    """
+    return {'probe': asyncio.Semaphore(max_workers), 'encode': asyncio.Semaphore(max_workers)}
+
+
+async def run_extraction_steps_async(steps, runners):
+    """Run the steps of extraction_steps with coroutine runners, like run_extraction_steps"""
+    resume, value = steps.send, None
+    while True:
+        try:
+            step, step_args = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            resume, value = steps.send, await runners[step](*step_args)
+        except BaseException as e:
+            resume, value = steps.throw, e
+
+
+async def extract_audio_from_video_async(args, limits):
+    """asyncio version of extract_audio_from_video_worker
+    
+    Takes the same task and returns the same result. ffprobe and ffmpeg run as
+    asyncio subprocesses under the probe and encode semaphores of limits.
+    Cancelling the task kills them and removes the partial outputs. Segmented
+    encodes run in a thread and finish before a cancellation takes effect.
+    """
+    held = []
+    
+    async def acquire(name):
+        await limits[name].acquire()
+        held.append(name)
+    
+    async def release(name):
+        held.remove(name)
+        limits[name].release()
+    
+    async def segmented_encode(*step_args):
+        segmented = asyncio.get_running_loop().run_in_executor(None, try_segmented_encode, *step_args)
+        try:
+            return await asyncio.shield(segmented)
+        except asyncio.CancelledError:
+            await segmented
+            raise
+    
+    try:
+        return await run_extraction_steps_async(extraction_steps(args), {
+            'acquire': acquire,
+            'release': release,
+            'probe': probe_audio_stream_async,
+            'detect_silence': detect_silence_async,
+            'measure_loudness': measure_loudness_async,
+            'segmented_encode': segmented_encode,
+            'encode': run_ffmpeg_async
+        })
+    finally:
+        for name in held:
+            limits[name].release()
+
+
+async def run_tasks_async(tasks, max_workers, handle_result, max_in_flight):
+    """Run worker tasks on the asyncio engine and pass each result to handle_result
+    
+    Up to max_in_flight tasks are started so their probes overlap with the
+    max_workers running encodes. Tasks may come from a generator that is still
+    discovering files; a None task means it has nothing new yet, as in
+    iter_completed_tasks. The generator may block on scans, hashing or queue
+    leases, so it is advanced in a thread while the event loop keeps serving
+    the running ffmpeg processes. Returns (processed, successful) task counts.
+    """
+    loop = asyncio.get_running_loop()
+    limits = new_async_limits(max_workers)
+    tasks = iter(tasks)
+    end_of_tasks = object()
+    running = {}
+    exhausted = False
+    processed_count = 0
+    success_count = 0
+    while True:
+        # After an interrupt no new tasks start, the running ones finish with their stopped ffmpeg
+        if interrupt_event.is_set():
+            exhausted = True
+        idle = False
+        while not exhausted and len(running) < max_in_flight:
+            task = await loop.run_in_executor(None, next, tasks, end_of_tasks)
+            if task is end_of_tasks:
+                exhausted = True
+                break
+            if task is None:
+                idle = True
+                break
+            running[asyncio.ensure_future(extract_audio_from_video_async(task, limits))] = task
+        
+        if not running:
+            if exhausted:
+                return processed_count, success_count
+            continue
+        
+        done, _ = await asyncio.wait(running, timeout=0 if idle else None, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            processed_count += 1
+            try:
+                success, result = future.result()
+            except Exception as e:
+                logger.error(f"Task execution exception: {e}")
+                success, result = False, f"Task execution exception: {e}"
+            handle_result(task, success, result)
+            if success:
+                success_count += 1
+
+
+def run_async_engine(tasks, max_workers, handle_result, max_in_flight):
+    """Run worker tasks on a new event loop with run_tasks_async"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_tasks_async(tasks, max_workers, handle_result, max_in_flight))
+    finally:
+        loop.close()
+
+
+def update_probe_cache_from_result(probe_cache, video_file, success, result):
+    """Store audio information probed by a worker in the probe cache"""
+    if probe_cache is None or not success:
+        return
+    if isinstance(result, tuple) and len(result) >= 4 and result[3].get('audio_info'):
+        store_probe_cache(probe_cache, video_file, result[3]['audio_info'])
+
+
+def probe_files(video_files, probe_cache=None, max_workers=4):
+    """Probe video files, running ffprobe concurrently for files missing from the cache
+    
+    Returns {video_file: audio_info} and stores fresh results in the cache.
+    """
+    probed = {}
+    missing = []
+    for video_file in video_files:
+        audio_info = lookup_probe_cache(probe_cache, video_file)
+        if audio_info:
+            probed[video_file] = audio_info
+        else:
+            missing.append(video_file)
+    
+    if missing:
+        logger.info(f"Probing {len(missing)} files...")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='Probe') as executor:
+            for video_file, audio_info in zip(missing, executor.map(probe_audio_stream, missing)):
+                if audio_info:
+                    probed[video_file] = audio_info
+                    store_probe_cache(probe_cache, video_file, audio_info)
+    
+    return probed
+
+
+def order_pending_files(pending_files, probed, order):
+    """Order pending files by probed duration
+    
+    'longest' starts long jobs first so they do not end up running alone at
+    the end of the batch, 'shortest' gives quick early results. Files without
+    a known duration are scheduled last, in their original order.
+    """
+    known = [video_file for video_file in pending_files if (probed.get(video_file) or {}).get('duration') is not None]
+    unknown = [video_file for video_file in pending_files if (probed.get(video_file) or {}).get('duration') is None]
+    known.sort(key=lambda video_file: probed[video_file]['duration'], reverse=(order == 'longest'))
+    return known + unknown
+
+
+def worker_signal_handler(signum, frame):
+    """Signal handler of worker processes: stop the worker's running ffmpeg processes"""
+    interrupt_event.set()
+    terminate_active_processes()
+
+
+def worker_lease_signal_handler(signum, frame):
+    """Signal handler of worker processes: stop the tasks whose lease was taken over"""
+    abort_lost_lease_tasks()
+
+
+def init_worker_process(process_counter=None, console=False):
+    """Initialize a worker process of the process executor
+    
+    The worker counts its ffmpeg processes in the main process' counter. With
+    console, a worker started without the handlers of the main process (spawn
+    start method) attaches them itself.
+    """
+    global active_process_counter
+    if process_counter is not None:
+        active_process_counter = process_counter
+    if console and not worker_logger.handlers:
+        configure_console()
+    signal.signal(signal.SIGINT, worker_signal_handler)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, worker_signal_handler)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, worker_lease_signal_handler)
+
+
+def signal_executor_workers(executor, signum):
+    """Send a signal to the worker processes of a process executor
+    
+    Their ffmpeg processes are children of the workers, out of reach of this
+    process. Thread workers share this process and need nothing.
+    """
+    if not isinstance(executor, ProcessPoolExecutor) or os.name == 'nt':
+        return
+    # The pool keeps no public list of its worker processes
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        try:
+            os.kill(process.pid, signum)
+        except OSError:
+            pass
+
+
+def interrupt_executor_workers(executor):
+    """Forward an interrupt to the worker processes of a process executor"""
+    signal_executor_workers(executor, signal.SIGINT)
+
+
+def create_executor(executor_mode, max_workers):
+    """Create the executor that runs extraction tasks
+    
+    Workers only orchestrate ffmpeg/ffprobe child processes, so the thread mode
+    runs them from threads in this process. The process mode keeps the original
+    behaviour of one Python worker process per parallel task.
+    """
+    if executor_mode == 'thread':
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='Worker')
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker_process,
+                               initargs=(get_active_process_counter(), bool(worker_logger.handlers)))
+
+
+def append_metrics_record(metrics_file, entry):
+    """Append one per-file metrics record to a JSON Lines file"""
+    try:
+        with open(metrics_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    except Exception as e:
+        logger.error(f"Failed to write metrics: {e}")
+
+
+def build_metrics_record(video_name, audio_formats, success, result):
+    """Build the metrics record of one finished file"""
+    entry = {
+        'timestamp': time.time(),
+        'file': video_name,
+        'formats': list(audio_formats),
+        'status': 'completed' if success else 'failed'
+    }
+    if success and isinstance(result, tuple) and len(result) >= 4:
+        entry.update(result[3].get('metrics', {}))
+        entry['source_codec'] = result[3].get('source_codec')
+    elif not success:
+        # Keep the first line of the error, the stderr tail belongs in the log
+        entry['error'] = str(result).splitlines()[0] if result else None
+    return entry
+
+
+# Upper bounds of the realtime speed factor histogram buckets
+SPEED_HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+
+
+def new_batch_stats():
+    """Create batch counters for the Prometheus textfile exporter"""
+    return {
+        'lock': threading.Lock(),
+        'start_time': time.time(),
+        'completed': 0,
+        'failed': 0,
+        'pending': 0,
+        'submitted': 0,
+        'finished': 0,
+        'bytes_in': 0,
+        'bytes_out': 0,
+        'format_completed': {},
+        'format_failed': {},
+        'speed_buckets': [0] * len(SPEED_HISTOGRAM_BUCKETS),
+        'speed_count': 0,
+        'speed_sum': 0.0
+    }
+
+
+def update_batch_stats(stats, audio_formats, success, result):
+    """Add one finished file to the batch counters"""
+    with stats['lock']:
+        counters = stats['format_completed'] if success else stats['format_failed']
+        for audio_format in audio_formats:
+            counters[audio_format] = counters.get(audio_format, 0) + 1
+        if not success:
+            stats['failed'] += 1
+            return
+        
+        stats['completed'] += 1
+        metrics = result[3].get('metrics', {}) if isinstance(result, tuple) and len(result) >= 4 else {}
+        stats['bytes_in'] += metrics.get('input_bytes') or 0
+        stats['bytes_out'] += metrics.get('output_bytes') or 0
+        speed = metrics.get('speed_factor')
+        if speed is not None:
+            stats['speed_count'] += 1
+            stats['speed_sum'] += speed
+            for i, bound in enumerate(SPEED_HISTOGRAM_BUCKETS):
+                if speed <= bound:
+                    stats['speed_buckets'][i] += 1
+
+
+def render_prometheus_metrics(stats):
+    """Render batch counters in the Prometheus text exposition format"""
+    with stats['lock']:
+        lines = [
+            '# HELP extract_audio_files_completed_total Files extracted successfully in this run.',
+            '# TYPE extract_audio_files_completed_total counter',
+            f"extract_audio_files_completed_total {stats['completed']}",
+            '# HELP extract_audio_files_failed_total Files that failed in this run.',
+            '# TYPE extract_audio_files_failed_total counter',
+            f"extract_audio_files_failed_total {stats['failed']}",
+            '# HELP extract_audio_files_pending Discovered files still waiting to be processed.',
+            '# TYPE extract_audio_files_pending gauge',
+            f"extract_audio_files_pending {stats['pending']}",
+            '# HELP extract_audio_ffmpeg_processes_active ffmpeg and ffprobe processes currently running.',
+            '# TYPE extract_audio_ffmpeg_processes_active gauge',
+            f"extract_audio_ffmpeg_processes_active {count_active_processes()}",
+            '# HELP extract_audio_input_bytes_total Bytes of video read by completed files.',
+            '# TYPE extract_audio_input_bytes_total counter',
+            f"extract_audio_input_bytes_total {stats['bytes_in']}",
+            '# HELP extract_audio_output_bytes_total Bytes of audio written by completed files.',
+            '# TYPE extract_audio_output_bytes_total counter',
+            f"extract_audio_output_bytes_total {stats['bytes_out']}",
+            '# HELP extract_audio_format_files_total Files finished per output format and status.',
+            '# TYPE extract_audio_format_files_total counter'
+        ]
+        for status, counters in (('completed', stats['format_completed']), ('failed', stats['format_failed'])):
+            for audio_format, count in sorted(counters.items()):
+                lines.append(f'extract_audio_format_files_total{{format="{audio_format}",status="{status}"}} {count}')
+        
+        lines += [
+            '# HELP extract_audio_encode_speed_factor Audio duration divided by encode wall time.',
+            '# TYPE extract_audio_encode_speed_factor histogram'
+        ]
+        # Bucket counts are already cumulative
+        for bound, count in zip(SPEED_HISTOGRAM_BUCKETS, stats['speed_buckets']):
+            lines.append(f'extract_audio_encode_speed_factor_bucket{{le="{bound}"}} {count}')
+        lines += [
+            f'extract_audio_encode_speed_factor_bucket{{le="+Inf"}} {stats["speed_count"]}',
+            f"extract_audio_encode_speed_factor_sum {stats['speed_sum']}",
+            f"extract_audio_encode_speed_factor_count {stats['speed_count']}",
+            '# HELP extract_audio_run_start_time_seconds Unix time the run started.',
+            '# TYPE extract_audio_run_start_time_seconds gauge',
+            f"extract_audio_run_start_time_seconds {stats['start_time']}",
+            '# HELP extract_audio_last_update_time_seconds Unix time this file was written.',
+            '# TYPE extract_audio_last_update_time_seconds gauge',
+            f"extract_audio_last_update_time_seconds {time.time()}"
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(prom_file, stats):
+    """Write batch metrics for node_exporter's textfile collector
+    
+    The file is written under a temporary name and renamed, so the collector
+    never reads a partial file.
+    """
+    try:
+        temp_file = f"{prom_file}.{os.getpid()}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write(render_prometheus_metrics(stats))
+        os.replace(temp_file, prom_file)
+    except Exception as e:
+        logger.error(f"Failed to write Prometheus metrics: {e}")
+
+
+def start_prometheus_writer(prom_file, stats, interval):
+    """Rewrite the Prometheus textfile every interval seconds until the returned event is set"""
+    stop_event = threading.Event()
+    
+    def writer():
+        while not stop_event.wait(interval):
+            write_prometheus_textfile(prom_file, stats)
+    
+    threading.Thread(target=writer, name='Prometheus', daemon=True).start()
+    return stop_event
+
+
+def build_record_entry(video_file, output_dir, audio_format, default_quality, result):
+    """Build extraction record entry for one output format from a successful worker result"""
+    # Get actual quality used from result
+    actual_quality = default_quality  # Default to original quality
+    details = {}
+    if isinstance(result, tuple) and len(result) >= 3:
+        actual_quality = result[1]  # Get actual quality used
+    if isinstance(result, tuple) and len(result) >= 4:
+        details = result[3]
+    
+    outputs = [output for output in details.get('outputs', []) if output['format'] == audio_format]
+    output = outputs[0] if outputs else {}
+    entry = {
+        'status': 'completed',
+        'output_file': output.get('output_file', get_audio_output_path(output_dir, Path(video_file).stem, audio_format)),
+        'audio_format': audio_format,
+        'quality': output.get('quality', actual_quality),
+        'timestamp': str(time.time())
+    }
+    if output.get('encoder'):
+        entry['encoder'] = output['encoder']
+    if output.get('loudnorm'):
+        entry['loudnorm'] = output['loudnorm']
+    if 'silence_trim' in output:
+        entry['silence_trim'] = output['silence_trim']
+    if 'passthrough_reason' in output:
+        entry['passthrough'] = output['passthrough']
+        entry['passthrough_reason'] = output['passthrough_reason']
+        entry['source_codec'] = details.get('source_codec')
+    if 'track' in output:
+        entry['tracks'] = [
+            {key: track_output[key] for key in ('track', 'language', 'output_file', 'quality', 'passthrough')}
+            for track_output in outputs
+        ]
+    return entry
+
+
+def build_failed_record_entry(audio_format, result):
+    """Build extraction record entry for one output format from a failed worker result"""
+    return {
+        'status': 'failed',
+        'audio_format': audio_format,
+        # Keep the first line of the error, the stderr tail belongs in the log
+        'error': str(result).splitlines()[0] if result else None,
+        'timestamp': str(time.time())
+    }
+
+
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v'}
+
+
+def iter_video_files(directory, recursive=False, exclude_dirs=()):
+    """Yield video files in directory as they are discovered
+    
+    Uses os.scandir so the file type comes from the directory entry itself,
+    avoiding a stat call per entry on most filesystems. Subdirectories are
+    walked depth-first when recursive is set, skipping any in exclude_dirs.
+    """
+    exclude_dirs = {os.path.abspath(path) for path in exclude_dirs}
+    pending_dirs = [directory]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            with os.scandir(current_dir) as entries:
+                subdirs = []
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            if os.path.splitext(entry.name)[1].lower() in VIDEO_EXTENSIONS:
+                                yield entry.path
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            if os.path.abspath(entry.path) not in exclude_dirs:
+                                subdirs.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.info(f"Failed to scan directory {current_dir}: {e}")
+            continue
+        # Reverse so subdirectories are visited in the order they were listed
+        pending_dirs.extend(reversed(subdirs))
+
+
+def get_video_files(directory, recursive=False):
+    """Get all video files in directory"""
+    if not os.path.exists(directory):
+        logger.info(f"Directory {directory} does not exist")
+        return []
+    
+    return list(iter_video_files(directory, recursive))
+
+
+def get_video_files_from_root():
+    """Get all video files in root directory"""
+    current_dir = os.getcwd()
+    # Use absolute path
+    return [os.path.abspath(video_file) for video_file in iter_video_files(current_dir)]
+
+
+# inotify event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+def open_inotify():
+    """Open an inotify instance through libc, or return None where inotify is not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return {'libc': libc, 'fd': fd, 'watch_dirs': {}}
+
+
+def add_inotify_watch(inotify, directory):
+    """Watch one directory for new and changed files"""
+    wd = inotify['libc'].inotify_add_watch(inotify['fd'], os.fsencode(directory), INOTIFY_WATCH_MASK)
+    if wd < 0:
+        logger.info(f"Failed to watch directory {directory}: {os.strerror(ctypes.get_errno())}")
+        return False
+    inotify['watch_dirs'][wd] = directory
+    return True
+
+
+def read_inotify_events(inotify, timeout):
+    """Wait up to timeout seconds and return (path, is_dir, removed) tuples, or None after a queue overflow"""
+    ready, _, _ = select.select([inotify['fd']], [], [], timeout)
+    if not ready:
+        return []
+    events = []
+    while True:
+        try:
+            buffer = os.read(inotify['fd'], 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            name = buffer[offset:offset + name_length].rstrip(b'\0')
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = inotify['watch_dirs'].get(wd)
+            if directory is not None and name:
+                events.append((os.path.join(directory, os.fsdecode(name)), bool(mask & IN_ISDIR),
+                               bool(mask & (IN_MOVED_FROM | IN_DELETE))))
+
+
+def watch_video_files(directories, stable_seconds=5.0, poll_interval=2.0, exclude_dirs=()):
+    """Yield video files from watched directories once they stop changing
+
+    directories is a list of (directory, recursive) pairs. Files already in
+    the directories are yielded first, then new or rewritten files as they
+    arrive. A file is only yielded after its size and mtime stayed the same
+    for stable_seconds, so videos still being copied are never picked up.
+
+    inotify reports changed paths on Linux so only those are checked;
+    elsewhere the directories are rescanned every poll_interval seconds.
+    None is yielded whenever there is nothing new, letting the caller
+    collect finished tasks while waiting. The generator never ends.
+
+    Files that were deleted or moved out of the watched tree are forgotten,
+    so a later file at the same path is picked up again.
+    """
+    exclude_dirs = [os.path.abspath(path) for path in exclude_dirs]
+    candidates = {}
+    yielded = {}
+    inotify = open_inotify()
+
+    def is_excluded(path):
+        path = os.path.abspath(path)
+        return any(path == excluded or path.startswith(excluded + os.sep) for excluded in exclude_dirs)
+
+    def scan(directory, recursive):
+        """Add existing video files to the candidates, watching subdirectories on the way"""
+        if inotify is not None:
+            add_inotify_watch(inotify, directory)
+            if recursive:
+                for current_dir, subdirs, _ in os.walk(directory):
+                    subdirs[:] = [subdir for subdir in subdirs if not is_excluded(os.path.join(current_dir, subdir))]
+                    for subdir in subdirs:
+                        add_inotify_watch(inotify, os.path.join(current_dir, subdir))
+        for video_file in iter_video_files(directory, recursive, exclude_dirs):
+            candidates.setdefault(video_file, None)
+
+    def forget(path):
+        """Drop yielded files at path or below it"""
+        path = os.path.abspath(path)
+        for video_file in list(yielded):
+            absolute = os.path.abspath(video_file)
+            if absolute == path or absolute.startswith(path + os.sep):
+                del yielded[video_file]
+
+    def rescan():
+        for video_file in [video_file for video_file in yielded if not os.path.exists(video_file)]:
+            del yielded[video_file]
+        for directory, recursive in directories:
+            scan(directory, recursive)
+
+    recursive_dirs = [os.path.abspath(directory) for directory, recursive in directories if recursive]
+    rescan()
+    logger.info(f"Watching {', '.join(directory for directory, _ in directories)} "
+                 f"({'inotify' if inotify is not None else f'polling every {poll_interval:g}s'}, "
+                 f"files are picked up after {stable_seconds:g}s without changes)")
+
+    try:
+        while True:
+            now = time.time()
+            for video_file, previous in list(candidates.items()):
+                try:
+                    stat = os.stat(video_file)
+                except OSError:
+                    # Deleted or moved away
+                    del candidates[video_file]
+                    yielded.pop(video_file, None)
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if yielded.get(video_file) == signature:
+                    del candidates[video_file]
+                elif previous is None and now - stat.st_mtime >= stable_seconds:
+                    # Untouched for long enough already, no need to wait
+                    yielded[video_file] = signature
+                    del candidates[video_file]
+                    yield video_file
+                elif previous is None or previous[0] != signature:
+                    candidates[video_file] = (signature, now)
+                elif now - previous[1] >= stable_seconds:
+                    yielded[video_file] = signature
+                    del candidates[video_file]
+                    yield video_file
+
+            yield None
+
+            if inotify is None:
+                time.sleep(poll_interval)
+                rescan()
+                continue
+
+            # Wake up early only when candidates are waiting for their stability check
+            timeout = min(poll_interval, stable_seconds) if candidates else poll_interval
+            events = read_inotify_events(inotify, timeout)
+            if events is None:
+                logger.info("inotify event queue overflowed, rescanning watched directories")
+                rescan()
+                continue
+            for path, is_dir, removed in events:
+                if is_excluded(path):
+                    continue
+                if removed:
+                    forget(path)
+                elif is_dir:
+                    parent = os.path.dirname(os.path.abspath(path))
+                    if any(parent == directory or parent.startswith(directory + os.sep) for directory in recursive_dirs):
+                        # Files may have been added before the watch was in place
+                        scan(path, True)
+                elif os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+                    candidates.setdefault(path, None)
+    finally:
+        if inotify is not None:
+            os.close(inotify['fd'])
+
+
+def get_record_key(video_file, directory=None):
+    """Get extraction record key for a video file
+    
+    Files directly in the video directory are keyed by file name, files in
+    subdirectories by their path relative to the video directory.
+    """
+    if directory is None:
+        return os.path.basename(video_file)
+    return os.path.relpath(video_file, directory).replace(os.sep, '/')
+
+
+def get_output_subdir(output_dir, video_file, directory=None):
+    """Get output directory for a video file, mirroring its subdirectory"""
+    if directory is None:
+        return output_dir
+    relative_dir = os.path.dirname(os.path.relpath(video_file, directory))
+    return os.path.join(output_dir, relative_dir) if relative_dir else output_dir
+
+
+def iter_watched_video_files(directory, recursive, stable_seconds, poll_interval, exclude_dirs=()):
+    """Watch the video directory and the root directory for new videos
+    
+    Videos dropped into the root directory are moved to the video directory,
+    where the watch picks them up again once moved.
+    """
+    root_dir = os.getcwd()
+    directories = [(directory, recursive)]
+    if os.path.abspath(directory) != root_dir:
+        directories.append((root_dir, False))
+    for video_file in watch_video_files(directories, stable_seconds, poll_interval, exclude_dirs):
+        if video_file is not None and os.path.dirname(os.path.abspath(video_file)) == root_dir and os.path.abspath(directory) != root_dir:
+            move_video_files_to_original([os.path.abspath(video_file)], directory)
+            continue
+        yield video_file
+
+
+def get_default_node_id():
+    """Get the default node name of a shared work queue"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', socket.gethostname()) or 'node'
+
+
+def open_work_queue(queue_dir, node_id, lease_ttl=60.0):
+    """Open a work queue shared by several nodes through a directory
+    
+    A node encodes a file only while it holds the file's lease, a file in
+    <queue_dir>/leases created with O_CREAT | O_EXCL. Held leases are touched
+    by a heartbeat. A lease whose mtime has not changed for lease_ttl seconds
+    of this node's clock belonged to a crashed node and is taken over, so
+    clock differences between nodes do not matter. Finished files get a marker
+    in <queue_dir>/done with their record entries.
+    """
+    for subdir in ('leases', 'done'):
+        os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+    return {
+        'dir': queue_dir,
+        'node': node_id,
+        'token': f"{node_id}-{os.getpid()}-{os.urandom(4).hex()}",
+        'ttl': lease_ttl,
+        'started': time.time(),
+        'held': {},
+        'lost': set(),
+        'observed': {},
+        'lock': threading.Lock()
+    }
+
+
+def get_queue_file(queue, kind, key):
+    """Get the lease or done marker path of a record key"""
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(queue['dir'], 'leases' if kind == 'lease' else 'done', f"{digest}.{kind}")
+
+
+def read_done_marker(queue, key):
+    """Read the done marker of a record key, or None if no node has finished it"""
+    try:
+        with open(get_queue_file(queue, 'done', key), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_lease_expired(queue, lease_file):
+    """Check whether a lease has not been touched for the lease TTL
+    
+    The mtime is compared with its value when this node first saw it, timed
+    by this node's clock.
+    """
+    try:
+        mtime = os.stat(lease_file).st_mtime
+    except FileNotFoundError:
+        return True
+    now = time.monotonic()
+    seen = queue['observed'].get(lease_file)
+    if seen is None or seen[0] != mtime:
+        queue['observed'][lease_file] = (mtime, now)
+        return False
+    return now - seen[1] > queue['ttl']
+
+
+def read_lease_token(lease_file):
+    """Get the token of the node holding a lease, or None if there is no readable lease"""
+    try:
+        with open(lease_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('token')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def break_expired_lease(queue, lease_file):
+    """Remove an expired lease if this node wins the race to take it over
+    
+    Nodes race on a takeover file created with O_CREAT | O_EXCL, named after
+    the inode and mtime of the expired lease, so only one node removes that
+    lease and a renewed or new lease starts a new race. The winner removes
+    the lease only if it is still unchanged; an owner renewing it at that
+    very moment finds it gone in its heartbeat and stops the encode.
+    Returns the takeover file to remove once the new lease is written, or
+    None if this node did not break the lease.
+    """
+    stale_mtime = queue['observed'].pop(lease_file, (None,))[0]
+    try:
+        stale = os.stat(lease_file)
+    except OSError:
+        return None
+    if stale.st_mtime != stale_mtime:
+        return None
+    takeover_file = f"{lease_file}.{stale.st_ino}-{stale.st_mtime_ns}.takeover"
+    try:
+        fd = os.open(takeover_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        # A node that crashed while breaking the lease leaves its takeover file behind
+        if is_lease_expired(queue, takeover_file):
+            queue['observed'].pop(takeover_file, None)
+            try:
+                os.remove(takeover_file)
+            except OSError:
+                pass
+        return None
+    except OSError:
+        return None
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(queue['token'])
+    try:
+        current = os.stat(lease_file)
+        if (current.st_ino, current.st_mtime_ns) == (stale.st_ino, stale.st_mtime_ns):
+            os.remove(lease_file)
+    except OSError:
+        pass
+    return takeover_file
+
+
+def try_acquire_lease(queue, key):
+    """Try to take the lease of a record key, taking over an expired one
+    
+    Returns True if this node now holds the lease.
+    """
+    lease_file = get_queue_file(queue, 'lease', key)
+    takeover_file = None
+    try:
+        for attempt in range(2):
+            try:
+                fd = os.open(lease_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if attempt or not is_lease_expired(queue, lease_file):
+                    return False
+                takeover_file = break_expired_lease(queue, lease_file)
+                if takeover_file is None:
+                    return False
+                logger.info(f"Lease of {key} expired, taking it over")
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'node': queue['node'], 'token': queue['token'], 'acquired': time.time()}, f)
+            with queue['lock']:
+                queue['held'][key] = lease_file
+                queue['lost'].discard(key)
+            return True
+        return False
+    finally:
+        if takeover_file is not None:
+            try:
+                os.remove(takeover_file)
+            except OSError:
+                pass
+
+
+def release_lease(queue, key):
+    """Remove a lease held by this node"""
+    with queue['lock']:
+        lease_file = queue['held'].pop(key, None)
+    if lease_file is None:
+        return
+    # A lease taken over by another node is no longer ours to remove
+    if read_lease_token(lease_file) == queue['token']:
+        try:
+            os.remove(lease_file)
+        except OSError:
+            pass
+
+
+def complete_lease(queue, key, status, entries=None):
+    """Write the done marker of a record key, then release its lease"""
+    done_file = get_queue_file(queue, 'done', key)
+    temp_file = f"{done_file}.{queue['token']}.tmp"
+    try:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'status': status, 'node': queue['node'], 'time': time.time(), 'entries': entries or {}}, f, ensure_ascii=False)
+        os.replace(temp_file, done_file)
+    except OSError as e:
+        logger.error(f"Failed to write done marker of {key}: {e}")
+    release_lease(queue, key)
+
+
+def release_all_leases(queue):
+    """Release every lease still held, so other nodes do not wait for them to expire"""
+    for key in list(queue['held']):
+        release_lease(queue, key)
+
+
+def start_lease_heartbeat(queue, on_lost=None):
+    """Touch held leases every quarter of the lease TTL until the returned event is set
+    
+    A lease that is gone or carries another node's token was taken over. It
+    is dropped from the held leases, its key is added to queue['lost'] and
+    on_lost(key) is called so the encode can be stopped.
+    """
+    stop_event = threading.Event()
+    
+    def heartbeat():
+        while not stop_event.wait(queue['ttl'] / 4):
+            with queue['lock']:
+                held = list(queue['held'].items())
+            for key, lease_file in held:
+                if read_lease_token(lease_file) != queue['token']:
+                    logger.error(f"Lease of {key} was taken over by another node, stopping its encode")
+                    with queue['lock']:
+                        queue['held'].pop(key, None)
+                        queue['lost'].add(key)
+                    if on_lost is not None:
+                        on_lost(key)
+                    continue
+                try:
+                    os.utime(lease_file, None)
+                except OSError as e:
+                    logger.error(f"Failed to renew lease of {key}: {e}")
+    
+    threading.Thread(target=heartbeat, name='Lease', daemon=True).start()
+    return stop_event
+
+
+def iter_completed_tasks(executor, tasks, max_in_flight):
+    """Submit tasks lazily and yield (task, future) pairs as they complete
+    
+    At most max_in_flight tasks are submitted at a time, so tasks can come
+    from a generator that is still discovering files. A None task means the
+    generator has nothing new yet; finished tasks are collected without
+    blocking and the generator is asked again. After an interrupt, queued
+    tasks are cancelled and only the tasks already running are yielded.
+    """
+    tasks = iter(tasks)
+    future_to_task = {}
+    exhausted = False
+    while True:
+        if interrupt_event.is_set() and not exhausted:
+            exhausted = True
+            for future in list(future_to_task):
+                if future.cancel():
+                    del future_to_task[future]
+            interrupt_executor_workers(executor)
+        idle = False
+        while not exhausted and len(future_to_task) < max_in_flight:
+            try:
+                task = next(tasks)
+            except StopIteration:
+                exhausted = True
+                break
+            if task is None:
+                idle = True
+                break
+            future_to_task[executor.submit(extract_audio_from_video_worker, task)] = task
+        
+        if not future_to_task:
+            if exhausted:
+                return
+            continue
+        
+        done, _ = wait(future_to_task, timeout=0 if idle else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future_to_task.pop(future), future
+
+
+# Bump when the layout of cached ffmpeg capabilities changes
+CAPABILITY_CACHE_SCHEMA = 3
+
+
+def get_file_identity(path):
+    """Get the resolved path, mtime and size of a file"""
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return {'path': path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def get_binary_identity(name):
+    """Get the resolved path, mtime and size of an executable found in PATH"""
+    path = shutil.which(name)
+    if path is None:
+        raise FileNotFoundError(f"{name} not found in PATH")
+    return get_file_identity(path)
+
+
+def run_binary_query(path, args):
+    """Run an informational ffmpeg/ffprobe command and return its output"""
+    result = subprocess.run([path, '-hide_banner'] + args, capture_output=True, check=True, text=True, encoding='utf-8', errors='ignore')
+    return result.stdout
+
+
+def parse_component_list(output, flag):
+    """Get component names from ffmpeg -encoders or -muxers output whose flags contain flag"""
+    names = []
+    listing = False
+    for line in output.splitlines():
+        fields = line.split()
+        if not listing:
+            listing = bool(fields) and set(fields[0]) == {'-'}
+            continue
+        if len(fields) >= 2 and flag in fields[0]:
+            names.append(fields[1])
+    return names
+
+
+def parse_library_versions(output):
+    """Get the run-time versions of the libav* libraries listed by ffmpeg -version"""
+    return {
+        name: re.sub(r'\s+', '', runtime)
+        for name, runtime in re.findall(r'^(lib\w+)\s+[\d.\s]+?/\s*([\d.\s]+?)\s*$', output, re.MULTILINE)
+    }
+
+
+def find_ffmpeg_libraries(ffmpeg_path, ffmpeg_output):
+    """Get the resolved paths of the libav* shared libraries ffmpeg loads
+    
+    ldd lists them where it is available. Otherwise they are looked up in the
+    libdir or prefix of a shared build from its -version configuration.
+    Static builds have none.
+    """
+    try:
+        ldd_output = subprocess.run(['ldd', ffmpeg_path], capture_output=True, text=True,
+                                    encoding='utf-8', errors='ignore').stdout
+    except OSError:
+        ldd_output = None
+    if ldd_output is not None:
+        paths = re.findall(r'^\s*lib(?:av|sw|postproc)\S*\s+=>\s+(/\S+)', ldd_output, re.MULTILINE)
+    else:
+        configuration = dict(re.findall(r'--(prefix|libdir)=(\S+)', ffmpeg_output))
+        if '--enable-shared' not in ffmpeg_output or 'prefix' not in configuration:
+            return []
+        libdir = configuration.get('libdir', os.path.join(configuration['prefix'], 'lib'))
+        paths = [path for name in parse_library_versions(ffmpeg_output)
+                 for path in glob.glob(os.path.join(glob.escape(libdir), f"{name}.*"))]
+    return sorted({os.path.realpath(path) for path in paths})
+
+
+def detect_ffmpeg_capabilities(identities):
+    """Query the version, shared libraries, audio encoders and muxers of ffmpeg and ffprobe"""
+    ffmpeg_path = identities['ffmpeg']['path']
+    ffmpeg_output = run_binary_query(ffmpeg_path, ['-version'])
+    ffprobe_output = subprocess.run([identities['ffprobe']['path'], '-version'], capture_output=True, check=True,
+                                    text=True, encoding='utf-8', errors='ignore').stdout
+    return {
+        'schema': CAPABILITY_CACHE_SCHEMA,
+        'ffmpeg': dict(identities['ffmpeg'],
+                       version=ffmpeg_output.splitlines()[0].strip() if ffmpeg_output else None,
+                       library_versions=parse_library_versions(ffmpeg_output),
+                       libraries=[get_file_identity(path) for path in find_ffmpeg_libraries(ffmpeg_path, ffmpeg_output)],
+                       encoders=parse_component_list(run_binary_query(ffmpeg_path, ['-encoders']), 'A'),
+                       muxers=parse_component_list(run_binary_query(ffmpeg_path, ['-muxers']), 'E')),
+        'ffprobe': dict(identities['ffprobe'],
+                        version=ffprobe_output.splitlines()[0].strip() if ffprobe_output else None)
+    }
+
+
+def load_ffmpeg_capabilities(cache_file=None):
+    """Get ffmpeg and ffprobe capabilities, from the cache while both binaries are unchanged
+    
+    The cache is keyed by the resolved path, mtime and size of each binary and
+    of the libav* shared libraries ffmpeg loads, which can be upgraded without
+    touching the binary. A warm start only stats these files. Raises
+    FileNotFoundError or subprocess.CalledProcessError when either binary is
+    missing or broken.
+    """
+    identities = {name: get_binary_identity(name) for name in ('ffmpeg', 'ffprobe')}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('schema') == CAPABILITY_CACHE_SCHEMA and all(
+                {key: cached.get(name, {}).get(key) for key in identity} == identity for name, identity in identities.items()
+            ) and all(get_file_identity(library['path']) == library for library in cached['ffmpeg']['libraries']):
+                return cached
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+    
+    capabilities = detect_ffmpeg_capabilities(identities)
+    if cache_file:
+        try:
+            temp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(capabilities, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, cache_file)
+        except OSError as e:
+            logger.error(f"Failed to save ffmpeg capability cache: {e}")
+    return capabilities
+
+
+def select_audio_encoders(capabilities, overrides=None):
+    """Pick the preferred available encoder of every output format
+    
+    overrides maps formats to encoders requested explicitly. Raises
+    ValueError if one of them is not available in the local ffmpeg.
+    """
+    available = set(capabilities['ffmpeg'].get('encoders', []))
+    encoders = {}
+    for audio_format, candidates in ENCODER_PREFERENCES.items():
+        encoders[audio_format] = next((encoder for encoder in candidates if encoder in available), DEFAULT_ENCODERS[audio_format])
+    for audio_format, encoder in (overrides or {}).items():
+        if encoder not in available:
+            raise ValueError(f"encoder {encoder} for {audio_format} is not available in {capabilities['ffmpeg']['path']}")
+        encoders[audio_format] = encoder
+    return encoders
+
+
+def parse_encoder_override(value):
+    """Parse a FORMAT=ENCODER command line value"""
+    audio_format, _, encoder = value.partition('=')
+    if audio_format not in ENCODER_PREFERENCES or not encoder:
+        raise argparse.ArgumentTypeError(f"expected FORMAT=ENCODER with FORMAT one of {', '.join(ENCODER_PREFERENCES)}: {value!r}")
+    return audio_format, encoder
+
+
+class Job:
+    """One video to extract audio from with an Extractor
+    
+    formats may be a single format or a list of formats, which are all written
+    by one ffmpeg invocation. With move_done, the video is moved below
+    <original_dir>/done, keeping its path relative to original_dir, once the
+    Result of a successful extraction is complete and its probe results are
+    cached; original_dir defaults to the directory of the video. normalize is 'two-pass' or 'dynamic' EBU
+    R128 loudness normalization to loudnorm_target, a dict of I, TP and LRA
+    (default: DEFAULT_LOUDNORM_TARGET). trim_silence cuts leading and trailing
+    silence; True uses DEFAULT_SILENCE_TRIM, a dict overrides its threshold,
+    min_duration and padding.
+    """
+    
+    def __init__(self, video_path, output_dir='./extracted_audio', formats='mp3', quality='192k',
+                 adaptive=False, passthrough=False, all_tracks=False, move_done=False, original_dir=None,
+                 normalize=None, loudnorm_target=None, trim_silence=False):
+        self.video_path = video_path
+        self.output_dir = output_dir
+        self.formats = [formats] if isinstance(formats, str) else list(dict.fromkeys(formats))
+        self.quality = quality
+        self.adaptive = adaptive
+        self.passthrough = passthrough
+        self.all_tracks = all_tracks
+        self.move_done = move_done
+        self.original_dir = original_dir if original_dir is not None else os.path.dirname(video_path)
+        self.normalize = normalize
+        self.loudnorm_target = loudnorm_target or DEFAULT_LOUDNORM_TARGET
+        self.trim_silence = dict(DEFAULT_SILENCE_TRIM, **trim_silence) if isinstance(trim_silence, dict) else (
+            dict(DEFAULT_SILENCE_TRIM) if trim_silence else None
+        )
+    
+    def __repr__(self):
+        return f"Job({self.video_path!r}, formats={self.formats!r}, quality={self.quality!r})"
+
+
+class Result:
+    """Outcome of a Job
+    
+    outputs lists one dict per written file with its output_file, format,
+    quality, passthrough decision and track. metrics holds the same stage
+    timings as --metrics-file, and audio_info the probed source audio.
+    """
+    
+    def __init__(self, job, success, outputs=None, error=None, metrics=None, audio_info=None):
+        self.job = job
+        self.success = success
+        self.outputs = outputs or []
+        self.error = error
+        self.metrics = metrics or {}
+        self.audio_info = audio_info
+    
+    @property
+    def output_files(self):
+        return [output['output_file'] for output in self.outputs]
+    
+    def __repr__(self):
+        if self.success:
+            return f"Result({self.job.video_path!r}, success=True, outputs={self.output_files!r})"
+        return f"Result({self.job.video_path!r}, success=False, error={self.error!r})"
+
+
+def build_result(job, success, data):
+    """Wrap a worker result in a Result"""
+    if not success:
+        return Result(job, False, error=data)
+    details = data[3]
+    return Result(job, True, details.get('outputs'), metrics=details.get('metrics'), audio_info=details.get('audio_info'))
+
+
+def run_job(job, task):
+    """Run one Job's worker task and wrap the outcome in a Result"""
+    return build_result(job, *extract_audio_from_video_worker(task))
+
+
+class Extractor:
+    """Extract audio from videos from Python code
+    
+    Jobs run in a pool of worker threads (or processes with
+    executor='process') that each drive one ffmpeg process, with the CPU budget
+    split into parallel jobs and ffmpeg threads as on the command line. The
+    pool is planned from the formats of the first job unless jobs is given.
+    submit() returns a Future of the Result, and run() yields Results as jobs
+    complete. From asyncio code, await extract_async() instead; it runs the
+    job on the asyncio engine, and cancelling it stops the job's ffmpeg.
+    The fastest available encoder of each format is picked from the
+    capabilities of the local ffmpeg, cached in capability_cache_file if
+    given; encoders maps formats to encoders to use instead.
+    Extraction records and resume are left to the caller.
+    
+        with Extractor(probe_cache_file='probe_cache.json') as extractor:
+            for result in extractor.run(Job(path, 'out', ['mp3', 'flac']) for path in paths):
+                print(result.job.video_path, result.success, result.output_files)
+    """
+    
+    def __init__(self, jobs=0, cpu_budget=0, ffmpeg_threads=0, executor='thread', probe_cache_file=None,
+                 progress_interval=0, segment_above=0, segments=0, capability_cache_file=None, encoders=None):
+        self.jobs = jobs
+        self.cpu_budget = cpu_budget if cpu_budget > 0 else multiprocessing.cpu_count()
+        self.ffmpeg_threads = ffmpeg_threads
+        self.executor_mode = executor
+        self.probe_cache_file = probe_cache_file
+        self.progress_interval = progress_interval
+        self.segment_above = segment_above
+        self.segments = segments
+        self.max_workers = None
+        self._executor = None
+        self._async_limits = None
+        self._lock = threading.Lock()
+        self._task_count = 0
+        self.capabilities = load_ffmpeg_capabilities(capability_cache_file)
+        self.encoders = select_audio_encoders(self.capabilities, encoders)
+        self.probe_cache = load_probe_cache(probe_cache_file, self.capabilities['ffprobe']['version']) if probe_cache_file else None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _build_task(self, job):
+        """Build the worker task for a job, planning the parallel jobs on first use"""
+        with self._lock:
+            if self.max_workers is None:
+                self.max_workers, _ = plan_cpu_budget(self.cpu_budget, job.formats, self.jobs)
+            self._task_count += 1
+            audio_info = lookup_probe_cache(self.probe_cache, job.video_path)
+        threads = self.ffmpeg_threads or plan_cpu_budget(self.cpu_budget, job.formats, self.max_workers)[1]
+        segments = plan_segment_count(self.cpu_budget, self.max_workers, self.segments)
+        options = {
+            'passthrough': job.passthrough,
+            'all_tracks': job.all_tracks,
+            'progress_interval': self.progress_interval,
+            'threads': threads,
+            'segment_above': self.segment_above,
+            'segments': segments,
+            'encoders': self.encoders,
+            'normalize': job.normalize,
+            'loudnorm_target': job.loudnorm_target,
+            'trim_silence': job.trim_silence,
+            'audio_info': audio_info
+        }
+        return (job.video_path, job.output_dir, job.formats, job.quality, None, self._task_count, job.original_dir, job.adaptive, options)
+    
+    def _complete_result(self, result):
+        """Cache audio information probed by a finished job, then move its video to done"""
+        if self.probe_cache is not None and result.audio_info:
+            with self._lock:
+                store_probe_cache(self.probe_cache, result.job.video_path, result.audio_info)
+        if result.success and result.job.move_done:
+            move_completed_file_to_done(result.job.video_path, result.job.original_dir)
+    
+    def _complete_future(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self._complete_result(future.result())
+    
+    def submit(self, job):
+        """Queue a job and return a Future of its Result"""
+        task = self._build_task(job)
+        with self._lock:
+            if self._executor is None:
+                self._executor = create_executor(self.executor_mode, self.max_workers)
+        future = self._executor.submit(run_job, job, task)
+        future.add_done_callback(self._complete_future)
+        return future
+    
+    async def extract_async(self, job):
+        """Run a job on the asyncio engine and return its Result
+        
+        Jobs awaited concurrently share the probe and encode limits of this
+        Extractor. Cancelling the awaiting task kills the job's ffprobe or
+        ffmpeg and removes its partial outputs.
+        """
+        task = self._build_task(job)
+        if self._async_limits is None:
+            self._async_limits = new_async_limits(self.max_workers)
+        result = build_result(job, *await extract_audio_from_video_async(task, self._async_limits))
+        self._complete_result(result)
+        return result
+    
+    def run(self, jobs):
+        """Run jobs and yield their Results in completion order
+        
+        jobs may be a generator; at most twice the parallel jobs are queued at
+        a time. A job whose worker fails unexpectedly yields a failed Result.
+        """
+        jobs = iter(jobs)
+        future_to_job = {}
+        exhausted = False
+        while True:
+            while not exhausted and (self.max_workers is None or len(future_to_job) < self.max_workers * 2):
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future_to_job[self.submit(job)] = job
+            if not future_to_job:
+                return
+            done, _ = wait(future_to_job, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = future_to_job.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = Result(job, False, error=f"Task execution exception: {e}")
+                yield result
+    
+    def close(self):
+        """Wait for queued jobs, stop the pool and save the probe cache"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.probe_cache is not None:
+            with self._lock:
+                save_probe_cache(self.probe_cache_file, self.probe_cache)
+
+
+def main():
+    global current_probe_cache_file, current_probe_cache, current_work_queue
+    
+    configure_console()
+    
+    parser = argparse.ArgumentParser(description='Batch extract audio from video files with resume support and parallel processing')
+    parser.add_argument('-d', '--directory', default='./original', 
+                       help='Video files directory (default: ./original)')
+    parser.add_argument('-o', '--output', default='./extracted_audio',
+                       help='Audio output directory (default: ./extracted_audio)')
+    parser.add_argument('-r', '--recursive', action='store_true',
+                       help='Scan the video directory recursively and mirror its subdirectories in the output directory')
+    parser.add_argument('-f', '--format', nargs='+', default=['mp3'],
+                       choices=['mp3', 'aac', 'wav', 'flac'],
+                       help='Audio format, several formats are written from a single decode (default: mp3)')
+    parser.add_argument('-q', '--quality', default='192k',
+                       help='Audio quality (default: 192k)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Enable adaptive quality: automatically adjust extraction quality based on original video audio bitrate')
+    parser.add_argument('--passthrough', action='store_true',
+                       help='Stream-copy source audio without re-encoding when it already matches the target format at or below the target quality')
+    parser.add_argument('--normalize', nargs='?', const='two-pass', default=None, choices=['two-pass', 'dynamic'],
+                       help='EBU R128 loudness normalization with loudnorm. two-pass measures first and applies a linear gain, '
+                            'measurements are kept in the probe cache; dynamic normalizes in a single pass (default: two-pass)')
+    parser.add_argument('--target-lufs', type=float, default=DEFAULT_LOUDNORM_TARGET['I'],
+                       help=f"Integrated loudness target of --normalize in LUFS (default: {DEFAULT_LOUDNORM_TARGET['I']:g})")
+    parser.add_argument('--true-peak', type=float, default=DEFAULT_LOUDNORM_TARGET['TP'],
+                       help=f"Maximum true peak of --normalize in dBTP (default: {DEFAULT_LOUDNORM_TARGET['TP']:g})")
+    parser.add_argument('--loudness-range', type=float, default=DEFAULT_LOUDNORM_TARGET['LRA'],
+                       help=f"Loudness range target of --normalize in LU (default: {DEFAULT_LOUDNORM_TARGET['LRA']:g})")
+    parser.add_argument('--trim-silence', action='store_true',
+                       help='Cut leading and trailing silence, the trimmed ranges are stored in the extraction record')
+    parser.add_argument('--silence-threshold', type=float, default=DEFAULT_SILENCE_TRIM['threshold'],
+                       help=f"Level in dB below which --trim-silence treats audio as silent (default: {DEFAULT_SILENCE_TRIM['threshold']:g})")
+    parser.add_argument('--silence-duration', type=float, default=DEFAULT_SILENCE_TRIM['min_duration'],
+                       help=f"Shortest leading or trailing silence in seconds that is trimmed (default: {DEFAULT_SILENCE_TRIM['min_duration']:g})")
+    parser.add_argument('--silence-padding', type=float, default=DEFAULT_SILENCE_TRIM['padding'],
+                       help=f"Seconds of silence kept before and after the content (default: {DEFAULT_SILENCE_TRIM['padding']:g})")
+    parser.add_argument('--all-tracks', action='store_true',
+                       help='Extract every audio track of multi-track videos as <name>.track<N>-<language>.<format>, in one pass')
+    parser.add_argument('--verify-existing', action='store_true',
+                       help='Check the duration of auto-detected outputs against the source and extract incomplete ones again')
+    parser.add_argument('--verify-tolerance', type=float, default=0.5,
+                       help='Seconds an output duration may differ from the source with --verify-existing (default: 0.5)')
+    parser.add_argument('--dedup', nargs='?', const='partial', default=None, choices=['partial', 'full'],
+                       help='Detect re-uploaded videos by content and hardlink (or copy) the existing outputs instead of re-encoding. '
+                            'partial hashes the size and first and last MiB, full hashes the whole file (default: partial)')
+    parser.add_argument('--encoder', action='append', type=parse_encoder_override, default=None, metavar='FORMAT=ENCODER',
+                       help='Use this ffmpeg encoder for a format, e.g. aac=aac (default: fastest available, libfdk_aac over aac)')
+    parser.add_argument('--capability-cache', default='ffmpeg_capabilities.json',
+                       help='Cache of ffmpeg/ffprobe versions, encoders and muxers, keyed by path, mtime and size of the binaries and libav* libraries (default: ffmpeg_capabilities.json)')
+    parser.add_argument('--no-capability-cache', action='store_true',
+                       help='Disable the capability cache and query ffmpeg on every start')
+    parser.add_argument('--probe-cache', default='probe_cache.json',
+                       help='Probe cache file, keyed by path, size and mtime (default: probe_cache.json)')
+    parser.add_argument('--no-probe-cache', action='store_true',
+                       help='Disable the probe cache and always run ffprobe')
+    parser.add_argument('--progress-interval', type=float, default=10,
+                       help='Seconds between progress reports for each running ffmpeg, 0 to disable (default: 10)')
+    parser.add_argument('--metrics-file', default=None,
+                       help='Append per-file stage timings (probe, encode wall/CPU, speed, sizes, move) to this JSON Lines file')
+    parser.add_argument('--prom-file', default=None,
+                       help='Periodically write batch metrics to this file for the node_exporter textfile collector (*.prom)')
+    parser.add_argument('--prom-interval', type=float, default=15,
+                       help='Seconds between Prometheus textfile updates (default: 15)')
+    parser.add_argument('--move-done', action='store_true',
+                       help='Move each video to <directory>/done after its audio has been extracted')
+    parser.add_argument('--watch', action='store_true',
+                       help='Keep running and extract audio from new videos as they arrive in the video directory or the root directory')
+    parser.add_argument('--stable-seconds', type=float, default=5,
+                       help='Watch mode: seconds a file size and mtime must stay unchanged before it is processed (default: 5)')
+    parser.add_argument('--watch-interval', type=float, default=2,
+                       help='Watch mode: seconds between stability checks, and between rescans without inotify (default: 2)')
+    parser.add_argument('--queue-dir', default=None,
+                       help='Shared directory coordinating several nodes on the same videos with leases, so no file is encoded twice')
+    parser.add_argument('--node-id', default=None,
+                       help='Name of this node in the work queue, unique per process (default: host name)')
+    parser.add_argument('--lease-ttl', type=float, default=60,
+                       help='Seconds without heartbeat after which a lease of a crashed node is taken over (default: 60)')
+    parser.add_argument('--no-resume', action='store_true',
+                       help='Disable resume functionality')
+    parser.add_argument('--compact-every', type=int, default=1000,
+                       help='Compact the record journal into the JSON snapshot, or commit the SQLite records, every N changes (default: 1000)')
+    parser.add_argument('--record-store', default='json', choices=['json', 'sqlite'],
+                       help='Extraction record store: JSON files per format, or one SQLite database in WAL mode (default: json)')
+    parser.add_argument('--record-db', default='extraction_records.db',
+                       help='SQLite record database, existing JSON records are migrated into it once (default: extraction_records.db)')
+    parser.add_argument('--list-records', nargs='?', const='all', default=None, choices=['all', 'completed', 'failed'],
+                       help='Print the extraction records of the selected formats and exit (default: all)')
+    parser.add_argument('--since', type=parse_duration_seconds, default=None,
+                       help='With --list-records, only records from the last duration, e.g. 12h or 7d')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
                        help='Number of parallel jobs (default: auto-detect CPU cores)')
+    parser.add_argument('--cpu-budget', type=int, default=0,
+                       help='CPU cores shared by all ffmpeg processes (default: auto-detect CPU cores)')
+    parser.add_argument('--ffmpeg-threads', type=int, default=0,
+                       help='Threads per ffmpeg process (default: planned from the CPU budget and audio format)')
+    parser.add_argument('--segment-above', type=float, default=0,
+                       help='Encode MP3/AAC outputs of inputs longer than this many seconds in parallel time segments, 0 to disable. '
+                            'MP3 segments are encoded with -reservoir 0 (no bit reservoir), which costs a little quality (default: 0)')
+    parser.add_argument('--segments', type=int, default=0,
+                       help='Maximum number of time segments for --segment-above (default: CPU budget per parallel task)')
+    parser.add_argument('--order', default='directory', choices=['directory', 'longest', 'shortest'],
+                       help='Scheduling order: directory order, longest or shortest probed duration first (default: directory)')
     parser.add_argument('--sequential', action='store_true',
                        help='Use sequential processing mode (disable parallel)')
+    parser.add_argument('--executor', default='thread', choices=['thread', 'process', 'asyncio'],
+                       help='Parallel executor: threads managing ffmpeg processes, one Python worker process per task, '
+                            'or one asyncio event loop running ffprobe and ffmpeg as subprocesses (default: thread)')
     
     args = parser.parse_args()
     
+    # List records and exit, without scanning or extracting
+    if args.list_records:
+        node_id = (args.node_id or get_default_node_id()) if args.queue_dir else None
+        _, records = open_extraction_records(list(dict.fromkeys(args.format)), args.record_store, args.record_db, node_id,
+                                             read_only=True)
+        since = time.time() - args.since if args.since else None
+        count = list_extraction_records(records, None if args.list_records == 'all' else args.list_records, since)
+        logger.info(f"{count} records listed")
+        return
+    
     # 设置信号处理器
     signal.signal(signal.SIGINT, signal_handler)
+    if args.watch:
+        # Daemons are usually stopped with SIGTERM
+        signal.signal(signal.SIGTERM, signal_handler)
     atexit.register(atexit_handler)
     
-    # Check if ffmpeg is installed
+    # Check if ffmpeg is installed - capabilities are cached while the binaries are unchanged
     try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        subprocess.run(['ffprobe', '-version'], capture_output=True, check=True)
+        capabilities = load_ffmpeg_capabilities(None if args.no_capability_cache else args.capability_cache)
     except (subprocess.CalledProcessError, FileNotFoundError):
-        logging.error("Error: ffmpeg or ffprobe not found. Please ensure ffmpeg is installed and added to system PATH.")
+        logger.error("Error: ffmpeg or ffprobe not found. Please ensure ffmpeg is installed and added to system PATH.")
+        sys.exit(1)
+    ffprobe_version = capabilities['ffprobe']['version']
+    try:
+        encoders = select_audio_encoders(capabilities, dict(args.encoder or []))
+    except ValueError as e:
+        logger.error(f"Error: {e}")
         sys.exit(1)
     
     # Ensure original folder exists
@@ -432,101 +3963,259 @@ def main():
     # Check if there are video files in root directory, if so move them to original folder
     root_video_files = get_video_files_from_root()
     if root_video_files:
-        logging.info(f"Found {len(root_video_files)} video files in root directory, moving to {args.directory} folder...")
+        logger.info(f"Found {len(root_video_files)} video files in root directory, moving to {args.directory} folder...")
         moved_files = move_video_files_to_original(root_video_files, args.directory)
-        logging.info(f"File move completed!")
+        logger.info(f"File move completed!")
     
-    # Get video file list
-    video_files = get_video_files(args.directory)
-    
-    if not video_files:
-        logging.error(f"No video files found in directory {args.directory}")
-        logging.error("Please ensure video files are placed in this directory")
-        sys.exit(1)
+    # Get video files - streamed in recursive and watch mode so extraction starts while the scan is running
+    streaming = args.recursive or args.watch
+    # Skip the output folder and the done folder if they are nested in the video directory
+    exclude_dirs = [args.output, os.path.join(args.directory, 'done')]
+    if args.watch:
+        video_files = iter_watched_video_files(args.directory, args.recursive, args.stable_seconds, args.watch_interval, exclude_dirs)
+    elif streaming:
+        video_files = iter_video_files(args.directory, recursive=True, exclude_dirs=exclude_dirs)
+    else:
+        video_files = get_video_files(args.directory)
+        
+        if not video_files:
+            logger.error(f"No video files found in directory {args.directory}")
+            logger.error("Please ensure video files are placed in this directory")
+            sys.exit(1)
     
     # Create output directory
     os.makedirs(args.output, exist_ok=True)
     
-    # Resume functionality - record file saved in root directory
-    record_file = None
-    pending_files = video_files
-    completed_files = []
+    # Shared work queue - nodes coordinate through lease files instead of racing on the same videos
+    work_queue = None
+    if args.queue_dir:
+        node_id = args.node_id or get_default_node_id()
+        work_queue = open_work_queue(args.queue_dir, node_id, args.lease_ttl)
+        current_work_queue = work_queue
+    
+    # Partial outputs of interrupted runs are never complete, remove them before checking for existing outputs.
+    # Other runs on the same output folder may be writing theirs, so only partial outputs that have not
+    # changed for a while are removed; with a work queue, at least for a lease
+    sweep_min_age = max(PARTIAL_SWEEP_MIN_AGE, args.lease_ttl) if work_queue else PARTIAL_SWEEP_MIN_AGE
+    removed_partials = sweep_partial_outputs(args.output, sweep_min_age)
+    if removed_partials:
+        logger.info(f"Removed {removed_partials} partial outputs left by an interrupted run")
+    
+    # Remove duplicate formats while keeping their order
+    audio_formats = list(dict.fromkeys(args.format))
+    
+    # Resume functionality - one record file per format saved in root directory, one per node with a shared work queue
+    record_files = {}
+    records = {}
     
     if not args.no_resume:
-        # Record file saved in root directory
-        record_file = f"extraction_record_{args.format}.json"
-        current_record_file = record_file
-        
-        # Load JSON record
-        record = load_extraction_record(record_file)
-        current_record = record.copy()
-        
-        # Detect existing audio files (even without JSON records)
-        auto_detected = check_existing_audio_files(video_files, args.output, args.format)
-        
-        # Merge records
-        for filename, info in auto_detected.items():
-            if filename not in record:
-                record[filename] = info
-                current_record[filename] = info
+        record_files, records = open_extraction_records(
+            audio_formats, args.record_store, args.record_db, work_queue['node'] if work_queue else None, args.compact_every
+        )
+        for audio_format, record_file in record_files.items():
+            current_records[record_file] = records[audio_format]
+    
+    def get_pending_formats(video_file):
+        """Get formats not yet extracted, detecting existing audio files even without JSON records"""
+        if args.no_resume:
+            return audio_formats
+        video_name = get_record_key(video_file, args.directory)
+        output_dir = get_output_subdir(args.output, video_file, args.directory)
+        pending_formats = []
+        for audio_format in audio_formats:
+            record = records[audio_format]
+            if record.get(video_name, {}).get('status') != 'completed' and (video_name, audio_format) not in failed_verification:
+                info = detect_existing_audio_file(video_file, output_dir, audio_format, args.all_tracks,
+                                                  lookup_probe_cache(probe_cache, video_file) if args.all_tracks else None)
+                if info:
+                    # Merge records
+                    record[video_name] = info
+            if not (video_name in record and record[video_name]['status'] == 'completed'):
+                pending_formats.append(audio_format)
+        return pending_formats
+    
+    def is_completed(video_file):
+        """Check resume records for every requested format"""
+        return not get_pending_formats(video_file)
+    
+    scan_counts = {'found': 0, 'completed': 0}
+    
+    # Probe cache - loaded before the scan, verification of existing outputs also uses it
+    probe_cache = None
+    silence_trim = {
+        'threshold': args.silence_threshold,
+        'min_duration': args.silence_duration,
+        'padding': args.silence_padding
+    } if args.trim_silence else None
+    needs_probe = (args.adaptive or args.passthrough or args.all_tracks or args.order != 'directory'
+                   or args.verify_existing or args.segment_above > 0 or args.normalize or args.trim_silence)
+    if needs_probe and not args.no_probe_cache:
+        probe_cache = load_probe_cache(args.probe_cache, ffprobe_version)
+        current_probe_cache_file = args.probe_cache
+        current_probe_cache = probe_cache
+    
+    # Auto-detected outputs are checked against the source duration before they are trusted
+    failed_verification = set()
+    verify_workers = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    verify_executor = ThreadPoolExecutor(max_workers=verify_workers, thread_name_prefix='Verify') if args.verify_existing else None
+    verifying = {}
+    
+    def get_unverified_outputs(video_file):
+        """Get {format: output files} of auto-detected completions not verified yet
         
-        # Filter completed files
-        pending_files = []
-        for video_file in video_files:
-            video_name = os.path.basename(video_file)
-            if video_name in record and record[video_name]['status'] == 'completed':
-                completed_files.append(video_file)
+        Entries of --all-tracks outputs list the file of every track.
+        """
+        video_name = get_record_key(video_file, args.directory)
+        unverified = {}
+        for audio_format in audio_formats:
+            entry = records[audio_format].get(video_name, {})
+            if entry.get('detected') == 'auto' and not entry.get('verified'):
+                unverified[audio_format] = [track['output_file'] for track in entry.get('tracks', [])] or [entry['output_file']]
+        return unverified
+    
+    def collect_verified(block=False):
+        """Handle finished verifications, yielding files that have to be extracted again"""
+        if not verifying:
+            return
+        done, _ = wait(verifying, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            video_file, unverified = verifying.pop(future)
+            video_name = get_record_key(video_file, args.directory)
+            try:
+                failures, fresh_audio_info = future.result()
+            except Exception as e:
+                failures, fresh_audio_info = {}, None
+                logger.info(f"Failed to verify {video_name}: {e}")
+            if fresh_audio_info:
+                store_probe_cache(probe_cache, video_file, fresh_audio_info)
+            for audio_format, output_files in unverified.items():
+                failed_files = [output_file for output_file in output_files if output_file in failures]
+                if failed_files:
+                    # One incomplete track is enough to extract every track of the format again
+                    for output_file in failed_files:
+                        logger.info(f"✗ {output_file} is incomplete ({failures[output_file]}), extracting {video_name} again")
+                    failed_verification.add((video_name, audio_format))
+                    del records[audio_format][video_name]
+                else:
+                    entry = records[audio_format][video_name]
+                    entry['verified'] = 'duration'
+                    records[audio_format][video_name] = entry
+            if failures:
+                yield video_file
             else:
-                pending_files.append(video_file)
-    
-    logging.info(f"Found {len(video_files)} video files:")
-    logging.info(f"  - Completed: {len(completed_files)}")
-    logging.info(f"  - Pending: {len(pending_files)}")
-    
-    if completed_files:
-        logging.info("\nCompleted files:")
-        for video_file in completed_files:
-            video_name = os.path.basename(video_file)
-            info = current_record.get(video_name, {})
-            if info.get('detected') == 'auto':
-                logging.info(f"  ✓ {video_name} (auto-detected)")
+                scan_counts['completed'] += 1
+    
+    def iter_pending_files(video_files):
+        """Filter completed files while video files are being discovered"""
+        for video_file in video_files:
+            if video_file is None:
+                if verify_executor is not None:
+                    yield from collect_verified()
+                yield None
+                continue
+            scan_counts['found'] += 1
+            if not is_completed(video_file):
+                yield video_file
+            elif verify_executor is not None and get_unverified_outputs(video_file):
+                # Keep a bounded number of checks in flight while the scan goes on
+                while len(verifying) >= verify_workers * 4:
+                    yield from collect_verified(block=True)
+                unverified = get_unverified_outputs(video_file)
+                audio_info = lookup_probe_cache(probe_cache, video_file)
+                future = verify_executor.submit(verify_existing_outputs, video_file,
+                                                [output_file for output_files in unverified.values() for output_file in output_files], audio_info,
+                                                args.verify_tolerance, silence_trim)
+                verifying[future] = (video_file, unverified)
+                yield from collect_verified()
             else:
-                logging.info(f"  ✓ {video_name}")
+                scan_counts['completed'] += 1
+        while verifying:
+            yield from collect_verified(block=True)
+        if verify_executor is not None:
+            verify_executor.shutdown()
     
-    if pending_files:
-        logging.info("\nPending files:")
-        for video_file in pending_files:
-            video_name = os.path.basename(video_file)
-            logging.info(f"  - {video_name}")
+    if args.watch:
+        pending_files = iter_pending_files(video_files)
+        total_count = None
+        logger.info(f"Watch mode: processing new videos in {args.directory} until interrupted")
+    elif streaming:
+        pending_files = iter_pending_files(video_files)
+        total_count = None
+        logger.info(f"Scanning {args.directory} recursively, extraction starts as files are found")
+    else:
+        # Filter completed files
+        pending_files = list(iter_pending_files(video_files))
+        pending_set = set(pending_files)
+        completed_files = [video_file for video_file in video_files if video_file not in pending_set]
+        total_count = len(pending_files)
+        
+        logger.info(f"Found {len(video_files)} video files:")
+        logger.info(f"  - Completed: {len(completed_files)}")
+        logger.info(f"  - Pending: {len(pending_files)}")
+        
+        if completed_files:
+            logger.info("\nCompleted files:")
+            for video_file in completed_files:
+                video_name = get_record_key(video_file, args.directory)
+                if all(records[fmt].get(video_name, {}).get('detected') == 'auto' for fmt in audio_formats):
+                    logger.info(f"  ✓ {video_name} (auto-detected)")
+                else:
+                    logger.info(f"  ✓ {video_name}")
+        
+        if pending_files:
+            logger.info("\nPending files:")
+            for video_file in pending_files:
+                video_name = get_record_key(video_file, args.directory)
+                logger.info(f"  - {video_name}")
     
-    logging.info(f"\nAudio will be saved to: {args.output}")
-    logging.info(f"Audio format: {args.format}")
-    logging.info(f"Audio quality: {args.quality}")
+    logger.info(f"\nAudio will be saved to: {args.output}")
+    logger.info(f"Audio format: {', '.join(audio_formats)}")
+    logger.info(f"Audio quality: {args.quality}")
+    logger.info(f"Encoders: {', '.join(f'{audio_format} {encoders[audio_format]}' for audio_format in audio_formats)}")
+    if args.normalize:
+        logger.info(f"Loudness normalization: {args.normalize}, {args.target_lufs:g} LUFS, {args.true_peak:g} dBTP, LRA {args.loudness_range:g} LU")
+    if args.trim_silence:
+        logger.info(f"Silence trimming: below {args.silence_threshold:g} dB for at least {args.silence_duration:g}s, keeping {args.silence_padding:g}s of padding")
+    if args.passthrough and (args.normalize or args.trim_silence):
+        logger.info("Passthrough: disabled, normalized or trimmed audio is re-encoded")
     
     if args.adaptive:
-        logging.info("Adaptive quality: Enabled (automatically adjust based on original video audio bitrate)")
+        logger.info("Adaptive quality: Enabled (automatically adjust based on original video audio bitrate)")
     else:
-        logging.info("Adaptive quality: Disabled (use fixed quality)")
+        logger.info("Adaptive quality: Disabled (use fixed quality)")
+    
+    if args.passthrough:
+        logger.info("Passthrough: Enabled (stream-copy source audio that already satisfies the target)")
+    
+    if args.all_tracks:
+        logger.info("All tracks: Enabled (one output per audio track)")
     
     if not args.no_resume:
-        logging.info(f"Resume functionality: Enabled (record file: {record_file})")
-        logging.info("Smart detection: Automatically detect existing audio files")
+        logger.info(f"Resume functionality: Enabled (record file: {', '.join(dict.fromkeys(record_files.values()))})")
+        logger.info("Smart detection: Automatically detect existing audio files")
     else:
-        logging.info("Resume functionality: Disabled")
+        logger.info("Resume functionality: Disabled")
     
-    # Determine parallel task count
+    # Determine parallel task count and ffmpeg threads from the CPU budget
+    cpu_budget = args.cpu_budget if args.cpu_budget > 0 else multiprocessing.cpu_count()
+    job_count = None if streaming else len(pending_files)
     if args.sequential:
-        max_workers = 1
-        logging.info("Parallel processing: Disabled (sequential mode)")
+        max_workers, ffmpeg_threads = plan_cpu_budget(cpu_budget, audio_formats, 1)
+        logger.info("Parallel processing: Disabled (sequential mode)")
     else:
-        if args.jobs > 0:
-            max_workers = args.jobs
-        else:
-            max_workers = min(multiprocessing.cpu_count(), len(pending_files))
-        logging.info(f"Parallel processing: Enabled (using {max_workers} parallel tasks)")
+        max_workers, ffmpeg_threads = plan_cpu_budget(cpu_budget, audio_formats, args.jobs, job_count)
+        logger.info(f"Parallel processing: Enabled (using {max_workers} parallel tasks, {args.executor} executor)")
+    if args.ffmpeg_threads > 0:
+        ffmpeg_threads = args.ffmpeg_threads
+    logger.info(f"CPU budget: {cpu_budget} cores, {ffmpeg_threads} ffmpeg threads per task")
+    segment_count = plan_segment_count(cpu_budget, max_workers, args.segments)
+    if args.segment_above > 0 and segment_count > 1:
+        logger.info(f"Segmented encoding: inputs over {format_seconds(args.segment_above)} are encoded in {segment_count} parallel segments")
+    elif args.segment_above > 0:
+        logger.info("Segmented encoding: Disabled (no CPU budget left per task, lower -j or raise --cpu-budget)")
     
-    if not pending_files:
-        logging.info("\nAll files have been processed!")
+    if not streaming and not pending_files:
+        logger.info("\nAll files have been processed!")
         return
     
     # Confirm whether to continue
@@ -535,86 +4224,374 @@ def main():
     #     print("Operation cancelled")
     #     sys.exit(0)
     
+    # Per-run settings passed to every worker
+    options = {
+        'passthrough': args.passthrough,
+        'all_tracks': args.all_tracks,
+        'progress_interval': args.progress_interval,
+        'threads': ffmpeg_threads,
+        'segment_above': args.segment_above,
+        'segments': segment_count,
+        'encoders': encoders,
+        'normalize': args.normalize,
+        'loudnorm_target': {'I': args.target_lufs, 'TP': args.true_peak, 'LRA': args.loudness_range},
+        'trim_silence': silence_trim
+    }
+    
+    # Probe cache - reuse ffprobe results for files that have not changed
+    if probe_cache is not None:
+        if not streaming:
+            cached_count = sum(1 for video_file in pending_files if lookup_probe_cache(probe_cache, video_file))
+            logger.info(f"Probe cache: {cached_count}/{len(pending_files)} pending files already probed ({args.probe_cache})")
+    
+    # Schedule by probed duration - longest first shortens the tail of the batch
+    probed = {}
+    if args.order != 'directory' and args.watch:
+        logger.info("Scheduling order: ignored in watch mode, files are processed as they arrive")
+    elif args.order != 'directory':
+        if streaming:
+            logger.info(f"Ordering by duration: waiting for the scan of {args.directory} to finish")
+            pending_files = list(pending_files)
+        probed = probe_files(pending_files, probe_cache, max_workers * 2)
+        pending_files = order_pending_files(pending_files, probed, args.order)
+        logger.info(f"Scheduling order: {args.order} jobs first")
+    
+    # Content fingerprints - re-uploads reuse the outputs of the original instead of being extracted again
+    fingerprint_index = build_fingerprint_index(records) if args.dedup else {}
+    fingerprints = {}
+    in_flight_fingerprints = {}
+    deferred_duplicates = {}
+    dedup_counts = {'reused': 0}
+    if args.dedup:
+        logger.info(f"Deduplication: Enabled ({args.dedup} content hash)")
+    
+    def reuse_duplicate(video_file, output_dir, task_formats, fingerprint):
+        """Reuse the outputs of an extracted file with the same content, returning the formats still to extract"""
+        video_name = get_record_key(video_file, args.directory)
+        remaining_formats = []
+        for audio_format in task_formats:
+            original = fingerprint_index.get(audio_format, {}).get(fingerprint)
+            entry = None
+            if original and original[0] != video_name:
+                entry = reuse_duplicate_outputs(video_file, output_dir, audio_format, original[0], original[1], fingerprint)
+            if entry is None:
+                remaining_formats.append(audio_format)
+                continue
+            logger.info(f"✓ {video_name} is a duplicate of {original[0]}, {entry['reused']} {audio_format} output")
+            if audio_format in record_files:
+                update_extraction_record(record_files[audio_format], records[audio_format], video_name, entry, args.compact_every)
+        if not remaining_formats:
+            dedup_counts['reused'] += 1
+            scan_counts['completed'] += 1
+            if args.move_done:
+                move_completed_file_to_done(video_file, args.directory)
+        return remaining_formats
+    
+    # Files leased by other nodes, claimed later once they finish or their lease expires
+    queue_counts = {'remote': 0}
+    busy_files = []
+    
+    def finish_claim(video_file, success):
+        """Publish the outcome of a claimed file to the other nodes and release its lease"""
+        video_name = get_record_key(video_file, args.directory)
+        entries = {
+            audio_format: records[audio_format][video_name]
+            for audio_format in audio_formats
+            if audio_format in records and video_name in records[audio_format]
+        }
+        complete_lease(work_queue, video_name, 'completed' if success else 'failed', entries)
+    
+    def apply_done_marker(video_file, marker):
+        """Take over the outcome another node published, returning True if the file needs no work here"""
+        video_name = get_record_key(video_file, args.directory)
+        if marker['status'] == 'failed':
+            # Failures of earlier runs are retried, failures of this run are not encoded twice
+            if marker.get('time', 0) < work_queue['started']:
+                return False
+            logger.info(f"✗ Skipped {video_name}: failed on node {marker.get('node')}")
+            return True
+        if marker['status'] != 'completed':
+            return False
+        entries = marker.get('entries', {})
+        if records and not all(audio_format in entries for audio_format in get_pending_formats(video_file)):
+            return False
+        for audio_format, entry in entries.items():
+            if audio_format in record_files and records[audio_format].get(video_name, {}).get('status') != 'completed':
+                update_extraction_record(record_files[audio_format], records[audio_format], video_name, entry, args.compact_every)
+        logger.info(f"✓ {video_name} was extracted by node {marker.get('node')}")
+        queue_counts['remote'] += 1
+        scan_counts['completed'] += 1
+        return True
+    
+    def claim(video_file):
+        """Try to claim a file in the work queue, returning 'claimed', 'done' or 'busy'"""
+        video_name = get_record_key(video_file, args.directory)
+        marker = read_done_marker(work_queue, video_name)
+        if marker is not None and apply_done_marker(video_file, marker):
+            return 'done'
+        if not try_acquire_lease(work_queue, video_name):
+            return 'busy'
+        # Another node may have finished the file just before releasing the lease
+        marker = read_done_marker(work_queue, video_name)
+        if marker is not None and apply_done_marker(video_file, marker):
+            release_lease(work_queue, video_name)
+            return 'done'
+        return 'claimed'
+    
+    def build_tasks(pending_files):
+        """Build worker tasks for pending files"""
+        i = 0
+        
+        def build_task(video_file):
+            nonlocal i
+            output_dir = get_output_subdir(args.output, video_file, args.directory)
+            task_formats = get_pending_formats(video_file)
+            if not task_formats:
+                if work_queue:
+                    finish_claim(video_file, True)
+                return None
+            if args.dedup:
+                fingerprint = compute_file_fingerprint(video_file, args.dedup == 'full')
+                if fingerprint:
+                    task_formats = reuse_duplicate(video_file, output_dir, task_formats, fingerprint)
+                    if not task_formats:
+                        if work_queue:
+                            finish_claim(video_file, True)
+                        return None
+                    if set(task_formats) <= in_flight_fingerprints.get(fingerprint, set()):
+                        # The same content is being extracted right now, reuse its outputs once it finishes
+                        deferred_duplicates.setdefault(fingerprint, []).append((video_file, output_dir, task_formats))
+                        return None
+                    fingerprints[video_file] = fingerprint
+                    in_flight_fingerprints.setdefault(fingerprint, set()).update(task_formats)
+            i += 1
+            audio_info = probed.get(video_file) or lookup_probe_cache(probe_cache, video_file)
+            task_options = dict(options, audio_info=audio_info)
+            if work_queue:
+                # Lets the worker notice when another node takes the lease over
+                lease_file = get_queue_file(work_queue, 'lease', get_record_key(video_file, args.directory))
+                task_options['lease'] = (lease_file, work_queue['token'])
+            with batch_stats['lock']:
+                batch_stats['submitted'] += 1
+            return (video_file, output_dir, task_formats, args.quality, record_files.get(task_formats[0]), i, args.directory, args.adaptive, task_options)
+        
+        def claim_busy_files():
+            """Claim files that were leased by other nodes, taking over expired leases"""
+            still_busy = []
+            for video_file in busy_files:
+                state = claim(video_file)
+                if state == 'busy':
+                    still_busy.append(video_file)
+                elif state == 'claimed':
+                    task = build_task(video_file)
+                    if task is not None:
+                        yield task
+            busy_files[:] = still_busy
+        
+        for video_file in pending_files:
+            if video_file is None:
+                # Watch mode idle tick, pass it on to the dispatch loop
+                if work_queue:
+                    yield from claim_busy_files()
+                yield None
+                continue
+            if work_queue:
+                state = claim(video_file)
+                if state == 'busy':
+                    busy_files.append(video_file)
+                    continue
+                if state == 'done':
+                    continue
+            task = build_task(video_file)
+            if task is not None:
+                yield task
+        
+        # Work stealing - wait for the files of other nodes until they finish them or their leases expire
+        while busy_files:
+            yield from claim_busy_files()
+            if busy_files:
+                time.sleep(min(work_queue['ttl'] / 4, 1.0))
+                yield None
+    
+    def handle_result(task, success, result):
+        """Record the result of a finished task"""
+        update_probe_cache_from_result(probe_cache, task[0], success, result)
+        update_batch_stats(batch_stats, task[2], success, result)
+        with batch_stats['lock']:
+            batch_stats['finished'] += 1
+            # Files found by the scan that are neither completed nor processed yet
+            batch_stats['pending'] = max(scan_counts['found'] - scan_counts['completed'] - batch_stats['finished'], 0)
+        fingerprint = fingerprints.pop(task[0], None)
+        video_name = get_record_key(task[0], args.directory)
+        if not success and work_queue and video_name in work_queue['lost']:
+            # Stopped because another node took the lease over, that node records the outcome
+            logger.info(f"✗ Lease lost: {video_name}, left to the node that took it over")
+            with work_queue['lock']:
+                work_queue['lost'].discard(video_name)
+            if fingerprint:
+                in_flight_fingerprints.pop(fingerprint, None)
+                for video_file, _, _ in deferred_duplicates.pop(fingerprint, []):
+                    release_lease(work_queue, get_record_key(video_file, args.directory))
+            return
+        if not success and interrupt_event.is_set():
+            # Stopped by the interrupt rather than failed, the file is extracted again on the next run
+            logger.info(f"✗ Interrupted: {video_name}")
+            if work_queue:
+                release_lease(work_queue, video_name)
+            if fingerprint:
+                in_flight_fingerprints.pop(fingerprint, None)
+                for video_file, _, _ in deferred_duplicates.pop(fingerprint, []):
+                    if work_queue:
+                        release_lease(work_queue, get_record_key(video_file, args.directory))
+            return
+        if success:
+            # Update record in real-time
+            for audio_format in task[2]:
+                # Use actual quality used, not original set quality
+                entry = build_record_entry(task[0], task[1], audio_format, args.quality, result)
+                if fingerprint:
+                    entry['fingerprint'] = fingerprint
+                    fingerprint_index.setdefault(audio_format, {})[fingerprint] = (video_name, entry)
+                if audio_format in record_files:
+                    update_extraction_record(record_files[audio_format], records[audio_format], video_name, entry, args.compact_every)
+        else:
+            # Failures are recorded in the SQLite store so they can be listed, the files are still retried
+            # on the next run. JSON records keep only completed files, as before the store existed.
+            for audio_format in task[2]:
+                if audio_format in record_files and isinstance(records[audio_format], SqliteRecord):
+                    entry = build_failed_record_entry(audio_format, result)
+                    update_extraction_record(record_files[audio_format], records[audio_format], video_name, entry, args.compact_every)
+        if work_queue:
+            finish_claim(task[0], success)
+        # Moved only once the result is recorded and the probe cache has the size and mtime of the source
+        if success and args.move_done:
+            move_start = time.perf_counter()
+            move_completed_file_to_done(task[0], task[6])
+            result[3]['metrics']['move_time'] = time.perf_counter() - move_start
+        if args.metrics_file:
+            append_metrics_record(args.metrics_file, build_metrics_record(video_name, task[2], success, result))
+        if fingerprint:
+            in_flight_fingerprints.pop(fingerprint, None)
+            # Duplicates that arrived while this file was being extracted
+            for video_file, output_dir, task_formats in deferred_duplicates.pop(fingerprint, []):
+                duplicate_name = get_record_key(video_file, args.directory)
+                reused = False
+                if not success:
+                    logger.error(f"✗ Skipped {duplicate_name}: duplicate of {video_name}, which failed")
+                elif reuse_duplicate(video_file, output_dir, task_formats, fingerprint):
+                    logger.error(f"✗ Could not reuse the outputs of {video_name} for {duplicate_name}, it will be extracted on the next run")
+                else:
+                    reused = True
+                if work_queue:
+                    finish_claim(video_file, reused)
+    
+    # Batch counters for the Prometheus textfile exporter
+    batch_stats = new_batch_stats()
+    batch_stats['pending'] = max(scan_counts['found'] - scan_counts['completed'], 0)
+    prom_stop_event = None
+    if args.prom_file:
+        write_prometheus_textfile(args.prom_file, batch_stats)
+        prom_stop_event = start_prometheus_writer(args.prom_file, batch_stats, args.prom_interval)
+        logger.info(f"Prometheus metrics: {args.prom_file} (every {args.prom_interval:g}s)")
+    
+    # Executor of the parallel tasks while it runs, signalled when a lease is lost
+    running_executors = []
+    
+    def stop_lost_lease_encode(key):
+        """Stop the encode of a file whose lease another node took over"""
+        abort_lost_lease_tasks()
+        if hasattr(signal, 'SIGUSR1'):
+            for executor in running_executors:
+                signal_executor_workers(executor, signal.SIGUSR1)
+    
+    lease_stop_event = None
+    if work_queue:
+        lease_stop_event = start_lease_heartbeat(work_queue, stop_lost_lease_encode)
+        logger.info(f"Work queue: {args.queue_dir} as node {work_queue['node']} (lease TTL {args.lease_ttl:g}s)")
+    
     # Batch extract audio
-    logging.info("\nStarting audio extraction...")
+    logger.info("\nStarting audio extraction...")
     start_time = time.time()
+    success_count = 0
+    processed_count = 0
     
     if max_workers == 1:
         # Sequential processing
-        success_count = 0
-        total_count = len(pending_files)
-        
-        for i, video_file in enumerate(pending_files, 1):
-            logging.info(f"\n[{i}/{total_count}] ", end="")
-            success, actual_quality = extract_audio_from_video(video_file, args.output, args.format, args.quality, record_file, args.directory, args.adaptive)
+        for task in build_tasks(pending_files):
+            if interrupt_event.is_set():
+                break
+            if task is None:
+                continue
+            processed_count += 1
+            logger.info(f"\n[{processed_count}/{total_count or '?'}] {get_record_key(task[0], args.directory)}")
+            success, result = extract_audio_from_video_worker(task)
+            handle_result(task, success, result)
             if success:
                 success_count += 1
-                # Update record in real-time
-                if record_file:
-                    video_name = os.path.basename(video_file)
-                    # Use actual quality used, not original set quality
-                    quality_for_record = actual_quality if actual_quality else args.quality
-                    current_record[video_name] = {
-                        'status': 'completed',
-                        'output_file': os.path.join(args.output, f"{Path(video_file).stem}.{args.format}"),
-                        'audio_format': args.format,
-                        'quality': quality_for_record,
-                        'timestamp': str(time.time())
-                    }
-                    save_extraction_record(record_file, current_record)
+    elif args.executor == 'asyncio':
+        # asyncio engine - ffprobe and ffmpeg run as subprocesses of one event loop
+        processed_count, success_count = run_async_engine(build_tasks(pending_files), max_workers, handle_result, max_workers * 2)
     else:
-        # Parallel processing
-        success_count = 0
-        total_count = len(pending_files)
-        
-        tasks = []
-        for i, video_file in enumerate(pending_files):
-            tasks.append((video_file, args.output, args.format, args.quality, record_file, i + 1, args.directory, args.adaptive))
-        
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            future_to_task = {executor.submit(extract_audio_from_video_worker, task): task for task in tasks}
-            
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
+        # Parallel processing - keep a bounded number of tasks in flight
+        with create_executor(args.executor, max_workers) as executor:
+            running_executors.append(executor)
+            for task, future in iter_completed_tasks(executor, build_tasks(pending_files), max_workers * 2):
+                processed_count += 1
                 try:
                     success, result = future.result()
+                    handle_result(task, success, result)
                     if success:
                         success_count += 1
-                        # Update record in real-time
-                        if record_file:
-                            video_name = os.path.basename(task[0])
-                            # Get actual quality used from result
-                            actual_quality = args.quality  # Default to original quality
-                            if isinstance(result, tuple) and len(result) == 3:
-                                actual_quality = result[1]  # Get actual quality used
-                            
-                            current_record[video_name] = {
-                                'status': 'completed',
-                                'output_file': os.path.join(args.output, f"{Path(task[0]).stem}.{args.format}"),
-                                'audio_format': args.format,
-                                'quality': actual_quality,
-                                'timestamp': str(time.time())
-                            }
-                            save_extraction_record(record_file, current_record)
                 except Exception as e:
-                    logging.error(f"Task execution exception: {e}")
+                    logger.error(f"Task execution exception: {e}")
+                    handle_result(task, False, f"Task execution exception: {e}")
+    
+    if lease_stop_event is not None:
+        lease_stop_event.set()
+        release_all_leases(work_queue)
+    
+    if prom_stop_event is not None:
+        prom_stop_event.set()
+        write_prometheus_textfile(args.prom_file, batch_stats)
+    
+    total_count = processed_count
+    if streaming:
+        logger.info(f"\nScanned {scan_counts['found']} video files ({scan_counts['completed']} already completed)")
+    
+    if probe_cache is not None:
+        save_probe_cache(args.probe_cache, probe_cache)
+    
+    # Compact the record journals into the snapshots
+    for audio_format, record_file in record_files.items():
+        save_extraction_record(record_file, records[audio_format])
     
     # Calculate processing time
     end_time = time.time()
     processing_time = end_time - start_time
     
     # Output result statistics
-    logging.info(f"\n=== Extraction Complete! ===")
-    logging.info(f"This run successful: {success_count}/{total_count}")
-    logging.info(f"Total completed: {len(completed_files) + success_count}/{len(video_files)}")
-    logging.info(f"Processing time: {processing_time:.2f} seconds")
-    if max_workers > 1:
-        logging.info(f"Average per file: {processing_time/len(pending_files):.2f} seconds")
-    logging.info(f"Audio files saved to: {os.path.abspath(args.output)}")
-    logging.info(f"Completed video files moved to: {os.path.abspath(os.path.join(args.directory, 'done'))}")
-    
-    if record_file:
-        logging.info(f"Extraction record saved to: {os.path.abspath(record_file)}")
+    logger.info(f"\n=== Extraction Complete! ===")
+    logger.info(f"This run successful: {success_count}/{total_count}")
+    logger.info(f"Total completed: {scan_counts['completed'] + success_count}/{scan_counts['found']}")
+    logger.info(f"Processing time: {processing_time:.2f} seconds")
+    if max_workers > 1 and total_count:
+        logger.info(f"Average per file: {processing_time/total_count:.2f} seconds")
+    logger.info(f"Audio files saved to: {os.path.abspath(args.output)}")
+    if args.move_done:
+        logger.info(f"Completed video files moved to: {os.path.abspath(os.path.join(args.directory, 'done'))}")
+    if dedup_counts['reused']:
+        logger.info(f"Duplicates reused without re-encoding: {dedup_counts['reused']}")
+    if queue_counts['remote']:
+        logger.info(f"Extracted by other nodes: {queue_counts['remote']}")
+    if args.metrics_file:
+        logger.info(f"Per-file metrics written to: {os.path.abspath(args.metrics_file)}")
+    
+    for record_file in dict.fromkeys(record_files.values()):
+        logger.info(f"Extraction record saved to: {os.path.abspath(record_file)}")
+    
+    if interrupt_event.is_set():
+        logger.info("Interrupted: the remaining files will be extracted on the next run")
+        sys.exit(130)
 
 
 if __name__ == "__main__":